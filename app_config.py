@@ -10,7 +10,9 @@ class AppConfig:
     """ application specific values """
     CONFIG_DIR = environ.get("CONFIG_DIR", "/etc/tran")
     CONFIG_FILE = environ.get("CONFIG_FILE", "config.json")
-    BACKGROUND_JOB_BASE = environ.get("TRAN_BACKGROUND_JOB_BASE", 'http://127.0.0.1:80/api/_internal')
+    # directory for data shared by the processes (uwsgi workers: snapshot, configuration versions),
+    # empty to keep the data in every process
+    SHARED_SNAPSHOT_DIR = environ.get("SHARED_SNAPSHOT_DIR", "/tmp/tran")
 
     """Set Flask config variables."""
 
@@ -0,0 +1,61 @@
+"""
+Micro-benchmark of user defined calculated fields evaluation (per position cost).
+Compares eval of the source string (compiled for every row) with eval of the cached compiled code.
+
+Run from the project root: python -m benchmarks.bench_calculated_fields
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from src.data_processor.compiled_fields import get_compiled_calc_fn
+from src.data_source.position_store import PositionStore
+
+ROWS = 20000
+
+Field = namedtuple('Field', ['id', 'name', 'calc_fn'])
+FIELDS = [
+    Field(1, 'speed_ms', "current_item['speed'] / 3.6 if current_item['speed'] is not None else None"),
+    Field(2, 'power_delta', "current_item['power'] - position_list[current_item_index - 1]['power'] "
+                            "if current_item_index > 0 else 0"),
+    Field(3, 'distance_start', "current_item['odometer'] - position_list[0]['odometer']"),
+]
+
+
+def generate_positions() -> PositionStore:
+    start = datetime(2021, 1, 2, 12, 30)
+    rows = [(i, start + timedelta(seconds=i), 100.0 + i * 0.03, 80 + i % 40, 20 + i % 60) for i in range(ROWS)]
+    return PositionStore.from_rows(['id', 'date', 'odometer', 'speed', 'power'], rows)
+
+
+def _evaluate_all(positions: PositionStore, get_code):
+    for i in range(len(positions)):
+        current_item = positions[i]
+        for field in FIELDS:
+            current_item[field.name] = eval(get_code(field), {}, {
+                'current_item': current_item,
+                'position_list': positions,
+                'current_item_index': i,
+            })
+
+
+def _timed(fn) -> float:
+    start = perf_counter()
+    fn()
+    return perf_counter() - start
+
+
+def main():
+    positions = generate_positions()
+    evaluations = ROWS * len(FIELDS)
+    print(f"{ROWS} positions, {len(FIELDS)} fields")
+
+    source_time = _timed(lambda: _evaluate_all(positions, lambda field: field.calc_fn))
+    compiled_time = _timed(lambda: _evaluate_all(positions, get_compiled_calc_fn))
+    for title, total_time in (('eval(source):', source_time), ('cached code:', compiled_time)):
+        print(f"{title:14} {total_time:8.4f} s, {total_time / evaluations * 1_000_000:6.2f} us per field and row")
+    print(f"{source_time / compiled_time:.1f}x faster")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark of distance to start calculation (used by lap finding) on synthetic 24h track.
+Compares the original geopy loop with the vectorized engine (both modes).
+
+Run from the project root: python -m benchmarks.bench_distance
+"""
+import math
+from time import perf_counter
+
+import numpy as np
+from geopy.distance import distance as geopy_distance
+
+from src.data_processor.distance import distances_to_point
+from src.enums import DistanceModeEnum
+
+START = (49.532277, 12.135311)
+HOURS = 24
+POSITION_PERIOD_SECONDS = 1  # TeslaMate records roughly every second when driving
+LAP_SECONDS = 300
+
+
+def generate_track():
+    """ 24h of laps on ~4 km ellipse starting at START, with some GPS noise """
+    count = HOURS * 3600 // POSITION_PERIOD_SECONDS
+    t = np.arange(count) * POSITION_PERIOD_SECONDS
+    angle = 2 * math.pi * (t % LAP_SECONDS) / LAP_SECONDS
+    rng = np.random.default_rng(42)
+    latitudes = START[0] + 0.006 * np.sin(angle) + rng.normal(0, 0.00002, count)
+    longitudes = START[1] + 0.012 * (1 - np.cos(angle)) + rng.normal(0, 0.00002, count)
+    return latitudes.tolist(), longitudes.tolist()
+
+
+def _timed(fn):
+    start = perf_counter()
+    result = fn()
+    return perf_counter() - start, result
+
+
+def main():
+    latitudes, longitudes = generate_track()
+    print(f"{len(latitudes)} positions")
+
+    geopy_time, geopy_result = _timed(
+        lambda: np.array([geopy_distance(point, START).km for point in zip(latitudes, longitudes)]))
+    print(f"geopy loop:  {geopy_time:8.4f} s")
+
+    for mode in DistanceModeEnum:
+        mode_time, mode_result = _timed(lambda: distances_to_point(latitudes, longitudes, START, mode.value))
+        max_error_m = np.max(np.abs(mode_result - geopy_result)) * 1000
+        print(f"{mode.value + ':':12} {mode_time:8.4f} s, {geopy_time / mode_time:6.1f}x faster, "
+              f"max difference {max_error_m:.6f} m")
+
+
+if __name__ == '__main__':
+    main()
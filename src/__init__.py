@@ -12,14 +12,15 @@ from flask_admin import helpers as admin_helpers
 
 import logging
 import sys
-import requests
 import pendulum
 from apscheduler.schedulers.background import BackgroundScheduler
 
 
 from src.parent_views import MyRedirectView, MyRoleRequiredDataView, MyRoleRequiredCustomView
 from src.enums import CalculatedFieldScopeEnum, LabelFormatGroupEnum
-from src.utils import function_timer_block
+from src.refresh_engine import refresh_engine
+from src.shared_snapshot import shared_snapshot
+from src.config_cache import config_cache, driver_change_index
 
 import logging
 logger = logging.getLogger(__name__)
@@ -36,11 +37,6 @@ user_datastore = None
 # Globally accessible libraries
 configuration: Configuration = None
 
-# note this is ugly hack to trigger background jobs as normal endpoints
-# URLs set from app.config later
-background_job_update_status_url: str = None
-background_job_update_laps_url: str = None
-
 
 def load_config(new_configuration, overwrite_file):
     global configuration
@@ -79,6 +75,10 @@ def create_app():
     db.init_app(app)
     jwt.init_app(app)
     admin.init_app(app)
+    refresh_engine.init_app(app)
+    shared_snapshot.init_app(app)
+    config_cache.init_app(app)
+    driver_change_index.init_app(app)
 
     with app.app_context():
         handler = logging.StreamHandler(sys.stdout)
@@ -90,10 +90,6 @@ def create_app():
         # load local config
         load_config(None, False)
 
-        global background_job_update_status_url, background_job_update_laps_url
-        background_job_update_status_url = app.config["BACKGROUND_JOB_BASE"] + '/update_status'
-        background_job_update_laps_url = app.config["BACKGROUND_JOB_BASE"] + '/update_laps'
-
         # flask-security-too
         # Define models
         fsqla.FsModels.set_db_info(db)  # once 4.0 in place, this is how to change table names , user_table_name="fs_users", role_table_name="fs_roles"
@@ -165,22 +161,40 @@ def create_app():
         admin.add_view(MyRedirectView(logged_user_required=True, target_endpoint='security.logout', name="Logout",
                                       endpoint="sec_logout", category="User"))
 
-        # register background jobs
+        # register background jobs (the scheduler just triggers the refresh, it runs in refresh engine workers)
+        # with more processes (uwsgi workers), just one of them refreshes and publishes the data to the others
+        from src.data_processor.data_processor import data_processor
+
+        def _check_config_versions():
+            # the configuration may have been changed by another process (uwsgi worker)
+            config_cache.check_version()
+            driver_change_index.check_version()
+
+        def _refresh_status():
+            _check_config_versions()
+            data_processor.refresh(data_processor.update_status)
+
+        def _refresh_laps():
+            _check_config_versions()
+            changed = data_processor.refresh(data_processor.update_positions_laps_forecast)
+            if 'charging' in changed:
+                refresh_engine.trigger('charging_details')  # not to delay the laps
+
+        refresh_engine.register('status', _refresh_status)
+        refresh_engine.register('laps', _refresh_laps)
+        refresh_engine.register('charging_details', data_processor.prefetch_charging_details)
+
         def _update_car_status():
             from src import configuration
-            if configuration.update_run_background and background_job_update_status_url:
+            if configuration.update_run_background and shared_snapshot.acquire_refresher():
                 logger.info("Updating car status by background job")
-                with function_timer_block('bg update status'):
-                    resp = requests.get(background_job_update_status_url)
-                    logger.info(f"{pendulum.now()}: {resp}")
+                refresh_engine.trigger('status')
 
         def _update_car_laps():
             from src import configuration
-            if configuration.update_run_background and background_job_update_laps_url:
+            if configuration.update_run_background and shared_snapshot.acquire_refresher():
                 logger.info("Updating car laps... by background job")
-                with function_timer_block('bg update laps'):
-                    resp = requests.get(background_job_update_laps_url)
-                    logger.info(f"{pendulum.now()}: {resp}")
+                refresh_engine.trigger('laps')
 
         scheduler.add_job(_update_car_status, 'interval', seconds=configuration.update_status_seconds)
         scheduler.add_job(_update_car_laps, 'interval', seconds=configuration.update_laps_seconds)
@@ -207,6 +221,8 @@ def create_app():
                 get_url=url_for
             )
 
+        app.before_request(_check_config_versions)
+
         @app.before_first_request
         def before_first_request():
             # Create any database tables that don't exist yet.  (? remove on prod ?
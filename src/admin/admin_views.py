@@ -8,6 +8,8 @@ from src.admin.admin_forms import TestLabelFormatForm, TestCalculatedFieldForm,
 from src.data_processor.data_processor import data_processor
 from src.parent_views import MyRoleRequiredCustomView
 from src.data_models import ConfigBackupData
+from src.data_source.position_store import PositionStore
+from src.config_cache import config_cache, driver_change_index
 
 
 class MyTestCalculatedFieldView(MyRoleRequiredCustomView):
@@ -40,6 +42,7 @@ class MyTestCalculatedFieldView(MyRoleRequiredCustomView):
                     try:
                         db.session.add(cf)
                         db.session.commit()
+                        config_cache.invalidate()
                         flash(f"Calculated field {form.name.data} stored to database for code {form.field_scope.data}", "info")
                     except Exception as ex:
                         db.session.rollback()
@@ -48,7 +51,7 @@ class MyTestCalculatedFieldView(MyRoleRequiredCustomView):
                 flash(f"{type(ex).__name__}: {ex}", "error")
         laps = data_processor.get_laps_raw()
         lap = laps[-2 if len(laps) > 1 else -1]
-        lap = {k: v for k, v in lap.items() if not isinstance(v, dict) and not isinstance(v, list)}
+        lap = {k: v for k, v in lap.items() if not isinstance(v, (dict, list, PositionStore))}
         return self.render('admin/test_calculated_field.html', form=form,
                            current_status=data_processor.get_status_raw(),
                            position=data_processor.get_positions_raw()[-1],
@@ -95,6 +98,7 @@ class MyTestLabelFormatTestView(MyRoleRequiredCustomView):
                     try:
                         db.session.add(lf)
                         db.session.commit()
+                        config_cache.invalidate()
                         flash(f"Label format {form.field_name.data} stored to database for code {form.label_group.data}", "info")
                     except Exception as ex:
                         db.session.rollback()
@@ -123,6 +127,7 @@ class DriverChangeView(MyRoleRequiredCustomView):
                 rec.valid_to = now
             db.session.add(DriverChange(driver=form.driver.data, copilot=form.copilot.data, valid_from=now))
             db.session.commit()
+            driver_change_index.invalidate()
             return redirect(url_for("admin.index"))
         return self.render("admin/driver_change.html", form=form)
 
@@ -5,6 +5,7 @@ from src.data_models import LabelFormatApi, LabelFormatApiList
 from src.data_models import CalculatedFieldApi, CalculatedFieldApiList
 from src.data_models import DriverApi, DriverApiList
 from src.data_models import DriverChangeApi, DriverChangeApiList
+from src.config_cache import config_cache, driver_change_index
 
 from src import db
 
@@ -54,6 +55,8 @@ def save_calculated_fields(field_scope_code: str, req_data: CalculatedFieldApiLi
     except Exception as ex:
         db.session.rollback()
         raise ex
+    finally:
+        config_cache.invalidate()
     return len(db_obj_list)
 
 
@@ -119,6 +122,8 @@ def save_label_formats(label_group_code: str, req_data: LabelFormatApiList) -> i
     except Exception as ex:
         db.session.rollback()
         raise ex
+    finally:
+        config_cache.invalidate()
     return len(db_obj_list)
 
 
@@ -202,5 +207,7 @@ def save_driver_changes(req_data: DriverChangeApiList) -> int:
     except Exception as ex:
         db.session.rollback()
         raise ex
+    finally:
+        driver_change_index.invalidate()
     return len(db_obj_list)
 
@@ -2,6 +2,8 @@ from flask import Blueprint, render_template, Response, abort, request
 from flask import jsonify as jsonify_native
 import pendulum
 import json
+import threading
+import time
 from typing import Optional, List
 from pydantic import BaseModel
 
@@ -9,7 +11,10 @@ from src import configuration, db
 from src.db_models import LabelGroup, LabelFormat, FieldScope, CalculatedField
 from src.jwt_roles import jwt_ex_role_required, ensure_jwt_has_user_role
 
-from src.data_processor.data_processor import data_processor
+from src.data_processor.data_processor import data_processor, RESPONSE_FIELDS
+from src.data_processor import graph_data
+from src.response_cache import response_cache, make_response, make_conditional
+from src.data_source.position_store import PositionStore, PositionRow
 from src.enums import LabelFormatGroupEnum, CalculatedFieldScopeEnum
 
 import logging
@@ -21,6 +26,15 @@ api_bp = Blueprint('api_bp', __name__,
                    static_url_path='/assets')
 
 
+def _json_default(value):
+    """ positions are dumped as list of dicts, anything else not serializable as string """
+    if isinstance(value, PositionStore):
+        return value.to_dict_list()
+    if isinstance(value, PositionRow):
+        return dict(value)
+    return str(value)
+
+
 def _jsonify(data):
     """
     In case there are field not natively serialiable, workaround it by passing as string
@@ -30,9 +44,82 @@ def _jsonify(data):
     try:
         return jsonify_native(data)
     except TypeError:
-        out = json.dumps(data, default=str)
+        out = json.dumps(data, default=_json_default)
         return Response(out, mimetype='application/json')
 
+
+def _cached_response(name: str, get_formatted):
+    """
+    Return the response pre-serialized by the refresher, serialize it now if not available
+    :param name: name of the response (see data_processor.RESPONSE_FIELDS)
+    :param get_formatted: getter of the formatted data
+    :return: HTTP Response
+    """
+    cached = data_processor.get_response(name)
+    if cached is None:
+        out = Response(get_formatted().json(), mimetype='application/json')
+        out.add_etag()  # hash of the payload
+        return make_conditional(out)
+    return make_response(cached)
+
+
+EVENTS_POLL_SECONDS = 1  # how often the shared snapshot is checked (when not running in the refresher process)
+EVENTS_KEEPALIVE_SECONDS = 15  # comment sent if there is no change, so the proxies keep the connection
+EVENTS_MAX_STREAM_SECONDS = 600  # the browser reconnects, so the connections get spread over the workers again
+EVENTS_RETRY_AFTER_SECONDS = 60  # when the streams are over the limit (the clients poll meanwhile)
+
+_events_lock = threading.Lock()
+_events_streams = 0  # streams open in this process
+
+
+def _acquire_events_stream(max_streams: int) -> bool:
+    """ count the stream in if the process is not over the limit (every stream holds a worker thread) """
+    global _events_streams
+    with _events_lock:
+        if _events_streams >= max_streams:
+            return False
+        _events_streams += 1
+        return True
+
+
+def _release_events_stream():
+    global _events_streams
+    with _events_lock:
+        _events_streams -= 1
+
+
+def _iter_events(names: List[str]):
+    """
+    Server-sent events stream, every response is sent when connected and then whenever it changes.
+    Laps are sent as delta (just the records changed since the last event, see RecordDelta)
+    :param names: names of the responses (see data_processor.RESPONSE_FIELDS)
+    :return: chunks of the stream
+    """
+    sent_versions = {}
+    laps_since = 0  # version of the laps delta sent
+    started = last_sent = time.monotonic()
+    generation = response_cache.generation
+    while time.monotonic() - started < EVENTS_MAX_STREAM_SECONDS:
+        for name in names:
+            cached = data_processor.get_response(name)  # syncs the shared snapshot too
+            if not cached or cached.version == sent_versions.get(name):
+                continue
+            body = cached.body
+            if name == 'laps':
+                delta = data_processor.get_lap_list_delta()
+                if delta is None:
+                    continue  # the client merges deltas only
+                body = delta.get_changed(laps_since)
+                laps_since = delta.version
+            sent_versions[name] = cached.version
+            last_sent = time.monotonic()
+            yield b"event: " + name.encode() + b"\ndata: " + body + b"\n\n"
+        if time.monotonic() - last_sent > EVENTS_KEEPALIVE_SECONDS:
+            last_sent = time.monotonic()
+            yield b": keepalive\n\n"
+        generation = response_cache.wait_for_change(generation, EVENTS_POLL_SECONDS)
+
+
 ########################################
 # activate update for background tasks #
 ########################################
@@ -55,32 +142,56 @@ def update_laps():
 
 @api_bp.route('/car/status')
 def get_status():
-    resp = data_processor.get_status_formatted()
-    return Response(resp.json(), mimetype='application/json')
+    return _cached_response('status', data_processor.get_status_formatted)
 
 
 @api_bp.route('/car/laps')
 def get_laps():
-    resp = data_processor.get_laps_formatted()
-    return Response(resp.json(), mimetype='application/json')
+    return _cached_response('laps', data_processor.get_laps_formatted)
+
+
+@api_bp.route('/car/laps/delta')
+def get_laps_delta():
+    """
+    Formatted laps changed since the version given (query parameter since, 0 or missing for all)
+    """
+    since = request.args.get('since', 0, type=int)
+    return Response(data_processor.get_laps_delta(since), mimetype='application/json')
 
 
 @api_bp.route('/car/chargings')
 def get_chargings():
-    resp = data_processor.get_charging_process_list_formatted()
-    return Response(resp.json(), mimetype='application/json')
+    return _cached_response('chargings', data_processor.get_charging_process_list_formatted)
 
 
 @api_bp.route('/car/total')
 def get_total():
-    resp = data_processor.get_total_formatted()
-    return Response(resp.json(), mimetype='application/json')
+    return _cached_response('total', data_processor.get_total_formatted)
 
 
 @api_bp.route('/car/forecast')
 def get_forecast():
-    resp = data_processor.get_forecast_formatted()
-    return Response(resp.json(), mimetype='application/json')
+    return _cached_response('forecast', data_processor.get_forecast_formatted)
+
+
+@api_bp.route('/car/events')
+def get_events():
+    """
+    Push the public responses to the client (server-sent events) instead of polling.
+    Query parameter groups: comma separated response names (all if not given)
+    """
+    from src import configuration  # imports global configuration
+    if not configuration.update_run_background:
+        abort(404)  # data are updated per request, the clients have to poll
+    names = [name for name in request.args.get('groups', '').split(',') if name in RESPONSE_FIELDS]
+    if not _acquire_events_stream(configuration.events_max_streams):
+        # not to hold all the threads of the process, the clients fall back to polling
+        return Response("Too many event streams", status=503,
+                        headers={'Retry-After': str(EVENTS_RETRY_AFTER_SECONDS)})
+    out = Response(_iter_events(names or list(RESPONSE_FIELDS)), mimetype='text/event-stream',
+                   headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})  # no buffering in nginx
+    out.call_on_close(_release_events_stream)  # even if the stream has not been started
+    return out
 
 
 # not needed any more
@@ -178,13 +289,13 @@ def get_graph_data_lap():
     lap_id = request.args.get('lap')
     field = request.args.get('field')
 
-    laps = data_processor.get_laps_raw()
-    lap = laps[int(lap_id) if lap_id else -1]
-    lap_data = lap['lap_data']
-    graph_periods = [pendulum.Period(lap_data[0]['date'], item['date']) for item in lap_data]
-    graph_labels = [f"{raw_value.hours:02d}:{raw_value.minutes:02d}:{raw_value.remaining_seconds:02d}" for raw_value in graph_periods]
-    graph_data = [float(item[field]) if item[field] is not None else None for item in lap_data]
-    return _jsonify({"labels": graph_labels, "values": graph_data})
+    points = min(request.args.get('points', graph_data.DEFAULT_POINTS, type=int), graph_data.MAX_POINTS)
+    method = request.args.get('method', graph_data.METHOD_LTTB)
+    if method not in (graph_data.METHOD_LTTB, graph_data.METHOD_MIN_MAX):
+        abort(400, f"unknown method {method}")
+
+    resp = data_processor.get_lap_graph_data(int(lap_id) if lap_id else -1, field, points, method)
+    return Response(resp, mimetype='application/json')
 
 
 @api_bp.route('/graph_data/lap/chargings')
@@ -192,11 +303,10 @@ def get_graph_charging_lap_data():
     lap_id = request.args.get('lap')
     field = request.args.get('field')
 
-    laps = data_processor.get_laps_raw()
-    lap = laps[int(lap_id) if lap_id else -1]
-    lap_data = lap['lap_data']
-    lap_chargings = data_processor.get_car_chargings(int(lap_id))
-    charges = lap_chargings[0]['charges']
+    lap_chargings = data_processor.get_car_chargings(int(lap_id) if lap_id else -1)
+    charges = lap_chargings[0]['charges'] if lap_chargings else []
+    if not charges:
+        return _jsonify({"labels": [], "values": [], 'raw': lap_chargings})
 
     graph_periods = [pendulum.Period(charges[0]['date'], charge['date']) for charge in charges]
     graph_labels = [f"{raw_value.hours:02d}:{raw_value.minutes:02d}:{raw_value.remaining_seconds:02d}" for raw_value in graph_periods]
@@ -48,13 +48,16 @@ def dashboard():
                            configuration=configuration,
                            get_status_url=url_for("api_bp.get_status"),
                            get_laps_url=url_for("api_bp.get_laps"),
+                           get_laps_delta_url=url_for("api_bp.get_laps_delta"),
                            get_chargings_url=url_for("api_bp.get_chargings"),
+                           get_events_url=url_for("api_bp.get_events", groups='status,laps,chargings'),
                            admin_ui_url=_get_admin_ui_url())
 
 
 @web_bp.route('/map', methods=['GET'])
 def map():
-    return render_template("map.html", get_status_url=url_for("api_bp.get_status"))
+    return render_template("map.html", get_status_url=url_for("api_bp.get_status"),
+                           get_events_url=url_for("api_bp.get_events", groups='status'))
 
 
 @web_bp.route('/laps', methods=['GET'])
@@ -63,7 +66,9 @@ def laps():
                            configuration=configuration,
                            get_status_url=url_for("api_bp.get_status"),
                            get_laps_url=url_for("api_bp.get_laps"),
+                           get_laps_delta_url=url_for("api_bp.get_laps_delta"),
                            get_chargings_url=url_for("api_bp.get_chargings"),
+                           get_events_url=url_for("api_bp.get_events", groups='laps'),
                            admin_ui_url=_get_admin_ui_url())
 
 
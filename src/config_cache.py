@@ -0,0 +1,304 @@
+"""
+In-process cache of the configuration stored in database (calculated fields, label groups and formats).
+The whole configuration is loaded at once when first needed and kept until invalidated, so the refreshes
+don't query the database at all. Anything changing the tables has to call config_cache.invalidate()
+(backup.save_*, admin views, DB editor views).
+Every invalidation increments the version, the version may be used to find out data derived from the config
+are outdated. With more processes (uwsgi workers) the version is kept in a file shared by all of them
+(SHARED_SNAPSHOT_DIR), every process calls check_version() before a request or refresh and drops its cache
+if the configuration has been changed by another process.
+Driver changes are cached separately (driver_change_index), they change during the race and don't affect
+anything but driver names.
+"""
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+from bisect import bisect_right
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, NamedTuple, Tuple
+
+from pydantic import BaseModel
+
+from src.data_models import CalculatedFieldCached, LabelFormatCached, LabelGroupCached
+from src.data_processor.compiled_fields import invalidate_compiled_calc_fns, get_source_hash
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SharedVersion:
+    """
+    Version counter shared by the processes (a file in the shared directory), just process local if there is no
+    shared directory configured
+    """
+    def __init__(self, name: str):
+        self._name = name
+        self._path: Optional[str] = None
+        self._file_key: Optional[Tuple[int, int]] = None  # (inode, mtime) of the version file read
+        self._value = 1
+
+    def init_app(self, app):
+        shared_dir = app.config.get("SHARED_SNAPSHOT_DIR") or None
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            self._path = os.path.join(shared_dir, f"{self._name}.version")
+            self.check()
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def _read(self) -> Optional[int]:
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        file_key = (stat.st_ino, stat.st_mtime_ns)
+        if file_key == self._file_key:
+            return self._value
+        try:
+            with open(self._path) as f:
+                value = int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+        self._file_key = file_key
+        return value
+
+    def check(self) -> bool:
+        """
+        Take the shared version (if any)
+        :return: True if the version has been changed by another process since the last check
+        """
+        if not self._path:
+            return False
+        value = self._read()
+        if value is None or value == self._value:
+            return False
+        self._value = value
+        return True
+
+    def increment(self) -> int:
+        """
+        Increment the version (for all the processes)
+        :return: the new version
+        """
+        if not self._path:
+            self._value += 1
+            return self._value
+        with open(self._path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # released by closing the file
+            value = max(self._read() or 0, self._value) + 1
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._path), prefix=f".{self._name}")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(str(value))
+                os.replace(tmp_path, self._path)  # readers see either the old or the new file
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+            self._file_key = None
+            self._value = value
+        return value
+
+
+class _ConfigData(BaseModel):
+    """ configuration loaded for single version """
+    calculated_fields: Dict[str, List[CalculatedFieldCached]]  # by scope code, ordered by order_key
+    label_groups: Dict[str, LabelGroupCached]  # by group code
+    label_formats: Dict[str, List[LabelFormatCached]]  # by group code, ordered by order_key
+    calculated_fields_hash: str  # fingerprint of the calculated fields (content, stays the same after restart)
+
+
+class ConfigCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = SharedVersion('config')
+        self._data: Optional[_ConfigData] = None
+
+    def init_app(self, app):
+        self._version.init_app(app)
+
+    @property
+    def version(self) -> int:
+        """ version of the configuration, changes by every invalidation (in any process) """
+        return self._version.value
+
+    def _drop(self):
+        with self._lock:
+            self._data = None
+        invalidate_compiled_calc_fns()
+        logger.info(f"configuration cache invalidated, version {self._version.value}")
+
+    def invalidate(self):
+        """ drop the cached configuration, to be called whenever the configuration tables are changed """
+        with self._lock:
+            self._version.increment()
+        self._drop()
+
+    def check_version(self):
+        """ drop the cached configuration if it has been changed by another process """
+        with self._lock:
+            changed = self._version.check()
+        if changed:
+            self._drop()
+
+    @classmethod
+    def _load(cls) -> _ConfigData:
+        from src.db_models import FieldScope, CalculatedField, LabelGroup, LabelFormat
+
+        scope_codes = {scope.id: scope.code for scope in FieldScope.query.all()}
+        calculated_fields = {code: [] for code in scope_codes.values()}
+        for field in CalculatedField.query.order_by(CalculatedField.order_key, CalculatedField.id).all():
+            scope_code = scope_codes[field.scope_id]
+            calculated_fields[scope_code].append(CalculatedFieldCached(
+                id=field.id, name=field.name, description=field.description, return_type=field.return_type,
+                calc_fn=field.calc_fn, order_key=field.order_key, scope_code=scope_code,
+                source_hash=get_source_hash(field.calc_fn)))
+
+        label_groups = {group.code: LabelGroupCached(id=group.id, code=group.code, title=group.title)
+                        for group in LabelGroup.query.all()}
+        group_codes = {group.id: group.code for group in label_groups.values()}
+        label_formats = {code: [] for code in label_groups}
+        for label_format in LabelFormat.query.order_by(LabelFormat.order_key, LabelFormat.id).all():
+            group_code = group_codes[label_format.group_id]
+            label_formats[group_code].append(LabelFormatCached(
+                id=label_format.id, field=label_format.field, label=label_format.label,
+                format_function=label_format.format_function, format=label_format.format, unit=label_format.unit,
+                default=label_format.default, order_key=label_format.order_key, group_code=group_code))
+
+        calculated_fields_hash = hashlib.sha1(
+            '\n'.join(f"{field.scope_code}:{field.name}:{field.calc_fn}"
+                      for fields in calculated_fields.values() for field in fields).encode()).hexdigest()
+        return _ConfigData(calculated_fields=calculated_fields, label_groups=label_groups, label_formats=label_formats,
+                           calculated_fields_hash=calculated_fields_hash)
+
+    def _get_data(self) -> _ConfigData:
+        data = self._data
+        if data is None:
+            version = self._version.value
+            data = self._load()
+            with self._lock:
+                if version == self._version.value:  # not invalidated while loading
+                    self._data = data
+            logger.info(f"configuration cache loaded, version {version}")
+        return data
+
+    def get_calculated_fields(self, field_scope_code: str) -> List[CalculatedFieldCached]:
+        """ calculated fields of the scope (the same as CalculatedField.get_all_by_scope) """
+        data = self._get_data()
+        if field_scope_code not in data.calculated_fields:
+            raise Exception("invalid field scope")
+        return data.calculated_fields[field_scope_code]
+
+    def get_all_calculated_fields(self) -> List[CalculatedFieldCached]:
+        return [field for fields in self._get_data().calculated_fields.values() for field in fields]
+
+    def get_calculated_fields_hash(self) -> str:
+        """ fingerprint of the calculated fields, unlike version it's the same for the same content """
+        return self._get_data().calculated_fields_hash
+
+    def get_label_group(self, label_group_code: str) -> Optional[LabelGroupCached]:
+        return self._get_data().label_groups.get(label_group_code)
+
+    def get_label_formats(self, label_group_code: str) -> List[LabelFormatCached]:
+        """ label formats of the group (the same as LabelFormat.get_all_by_group) """
+        data = self._get_data()
+        if label_group_code not in data.label_formats:
+            raise Exception("invalid group code")
+        return data.label_formats[label_group_code]
+
+    def get_all_label_formats(self) -> List[LabelFormatCached]:
+        return [label_format for label_formats in self._get_data().label_formats.values()
+                for label_format in label_formats]
+
+
+def _to_timestamp(dt: Optional[datetime], default: float) -> float:
+    if dt is None:
+        return default
+    if dt.tzinfo is None:  # the dates are stored in utc without timezone
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class _DriverChangeData(NamedTuple):
+    """ driver changes ordered by valid_from """
+    valid_from: List[float]  # timestamps
+    valid_to: List[float]  # timestamps, inf for the active one
+    max_valid_to: List[float]  # max of valid_to up to the index (to stop searching early)
+    drivers: List[Tuple[Optional[str], Optional[str]]]  # (driver, copilot)
+
+
+class DriverChangeIndex:
+    """
+    Driver changes kept in memory, the driver valid for given time is found by bisect (no query per lap).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = SharedVersion('driver_changes')
+        self._data: Optional[_DriverChangeData] = None
+
+    def init_app(self, app):
+        self._version.init_app(app)
+
+    @property
+    def version(self) -> int:
+        """ version of the driver changes, changes by every invalidation (in any process) """
+        return self._version.value
+
+    def invalidate(self):
+        """ drop the cached driver changes, to be called whenever driver_changes table is changed """
+        with self._lock:
+            self._version.increment()
+            self._data = None
+
+    def check_version(self):
+        """ drop the cached driver changes if they have been changed by another process """
+        with self._lock:
+            if self._version.check():
+                self._data = None
+
+    @classmethod
+    def _load(cls) -> _DriverChangeData:
+        from src.db_models import DriverChange
+        data = _DriverChangeData([], [], [], [])
+        max_valid_to = float('-inf')
+        for driver_change in DriverChange.query.order_by(DriverChange.valid_from, DriverChange.id).all():
+            valid_to = _to_timestamp(driver_change.valid_to, float('inf'))
+            max_valid_to = max(max_valid_to, valid_to)
+            data.valid_from.append(_to_timestamp(driver_change.valid_from, float('-inf')))
+            data.valid_to.append(valid_to)
+            data.max_valid_to.append(max_valid_to)
+            data.drivers.append((driver_change.driver, driver_change.copilot))
+        return data
+
+    def _get_data(self) -> _DriverChangeData:
+        data = self._data
+        if data is None:
+            version = self._version.value
+            data = self._load()
+            with self._lock:
+                if version == self._version.value:  # not invalidated while loading
+                    self._data = data
+        return data
+
+    def get_drivers(self, dt: datetime) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Get driver and copilot valid at the time (the latest change started before and not finished yet)
+        :return: (driver, copilot), (None, None) if there is no driver change for the time
+        """
+        data = self._get_data()
+        ts = _to_timestamp(dt, 0)
+        i = bisect_right(data.valid_from, ts) - 1  # the last one started before
+        # usually the very first one matches, older ones are checked only if they can overlap the time
+        while i >= 0 and data.max_valid_to[i] >= ts:
+            if data.valid_to[i] >= ts:
+                return data.drivers[i]
+            i -= 1
+        return None, None
+
+
+# let's have just one singleton to be used
+config_cache = ConfigCache()
+driver_change_index = DriverChangeIndex()
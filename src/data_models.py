@@ -2,6 +2,9 @@ from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import pendulum
 import datetime
+import hashlib
+
+from src.data_source.position_store import PositionStore
 
 
 class DatabaseFieldDescription(BaseModel):
@@ -43,10 +46,24 @@ class Configuration(BaseModel):
     update_status_seconds: int
     update_laps_seconds: int
 
+    distance_mode: str = 'ellipsoidal'  # how to calculate distances to start (haversine or ellipsoidal)
+    db_fetch_size: int = 5000  # rows fetched at once when loading positions (streaming by server side cursor)
+    time_machine_granularity_seconds: int = 1  # time machine snapshots are created for time rounded down to this
+    time_machine_cache_mb: int = 256  # memory limit of time machine snapshots cache
+    idle_update_seconds: int = 30  # data depending on time (i.e. status) are recalculated at least this often
+    forecast_simulations: int = 0  # runs of Monte Carlo forecast (simulated_distance_p* fields), 0 to disable
+    forecast_simulation_budget_ms: int = 200  # time limit of the simulation by refresh (it's reused till next lap)
+    forecast_simulation_processes: int = 0  # processes to simulate by, 0 to simulate in the refresher
+    events_max_streams: int = 8  # server-sent event streams per process (each holds a thread), 503 over it
+
     def post_process(self):
         if isinstance(self.start_time, datetime.datetime):
             self.start_time = pendulum.from_timestamp(self.start_time.timestamp(), tz='utc')
 
+    def get_hash(self) -> str:
+        """ fingerprint of the configuration, to find out the cached data were calculated for another one """
+        return hashlib.sha1(self.json().encode()).hexdigest()
+
 
 #####################################
 # structures for AJAX API endpoints #
@@ -90,7 +107,7 @@ class JsonStaticSnapshot(BaseModel):
     current_status_raw: Optional[Dict[str, Any]]
     current_status_formatted: Optional[JsonStatusResponse]
 
-    car_positions_raw: Optional[List[Dict[str, Any]]]
+    car_positions_raw: Optional[PositionStore]
 
     lap_list_raw: Optional[List[Dict[str, Any]]]
     lap_list_formatted: Optional[JsonLapsResponse]
@@ -104,6 +121,9 @@ class JsonStaticSnapshot(BaseModel):
     forecast_raw: Optional[Dict[str, Any]]
     forecast_formatted: Optional[JsonLabelGroup]
 
+    class Config:
+        arbitrary_types_allowed = True  # PositionStore
+
 ########################
 # to serialize/deserialize config
 
@@ -172,6 +192,36 @@ class LabelFormatApiDict(BaseModel):
     __root__: Dict[str, LabelFormatApiList]
 
 
+########################
+# cached database config (see src.config_cache), immutable snapshots of the records
+
+
+class CalculatedFieldCached(CalculatedFieldApi):
+    id: int
+    order_key: int
+    scope_code: str
+    source_hash: str  # of calc_fn, compiled code is cached by it (see compiled_fields)
+
+    class Config:
+        allow_mutation = False
+
+
+class LabelGroupCached(LabelGroupApi):
+    id: int
+
+    class Config:
+        allow_mutation = False
+
+
+class LabelFormatCached(LabelFormatApi):
+    id: int
+    order_key: int
+    group_code: str
+
+    class Config:
+        allow_mutation = False
+
+
 class DriverApi(BaseModel):
     name: str
 
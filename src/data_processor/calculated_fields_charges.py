@@ -4,6 +4,9 @@ import pendulum
 from src.data_models import CalculatedFieldDescription
 from src.data_models import Configuration
 
+# inputs (other data groups) the hardcoded fields below read, see field_dependencies
+USED_INPUTS = set()
+
 
 def add_calculated_fields(*,
                           current_item: Dict[str, Any],
@@ -1,10 +1,16 @@
 from typing import Optional, Dict, Any
+import numpy as np
 import pendulum
 from src.data_models import Configuration
+from src.data_processor.forecast_engine import get_lap_arrays, forecast_race, MODELS, MODEL_MEAN, to_seconds, to_float
+from src.data_processor.forecast_simulation import forecast_simulator
 
 import logging
 logger = logging.getLogger(__name__)
 
+# inputs (other data groups and time) the hardcoded fields below read, see field_dependencies
+USED_INPUTS = {'current_status', 'lap_list', 'now_dt'}
+
 
 def add_calculated_fields(*,
                           current_item: Dict[str, Any],
@@ -50,92 +56,61 @@ def add_calculated_fields(*,
 
     start_time = configuration.start_time
     end_time = configuration.start_time.add(hours=configuration.hours)
-    time_since_start = now_dt - start_time if now_dt > start_time else pendulum.period(now_dt, now_dt)
-    time_to_end = end_time - now_dt if now_dt < end_time else pendulum.period(now_dt, now_dt)
+    time_since_start = (now_dt - start_time).total_seconds() if now_dt > start_time else 0.0
+    time_to_end = (end_time - now_dt).total_seconds() if now_dt < end_time else 0.0
     distance_since_start = \
         current_status['distance'] if current_status and 'distance' in current_status and current_status['distance'] is not None else 0.0
 
-    # print(f"from start: {time_since_start.in_hours()}, to end: {time_to_end.in_hours()}, dist: {distance_since_start}")
-
-    avg_lap_time = pendulum.Period(now_dt, now_dt)
-    avg_pit_time = pendulum.Period(now_dt, now_dt)
-    avg_lap_distance = 0
-    for lap in car_laps:
-        avg_lap_time += lap['lap_duration']
-        avg_pit_time += lap['pit_duration']
-        avg_lap_distance += lap['distance']
-    logger.info(f"sum lap time {avg_lap_time}, sum lap distance {avg_lap_distance}")
-    avg_lap_time /= len(car_laps)
-    avg_pit_time /= len(car_laps)
-    avg_lap_distance /= len(car_laps)
-    # print(f"avg lap time {avgLapTime}, avg pit time: {avgPitTime}, avg lap distance {avgLapDistance}")
-    # print(f"avg lap time {avgLapTime}, avg lap distance {avgLapDistance}")
-
-    unfinished_lap_remaining_time = pendulum.Period(now_dt, now_dt)
-    unfinished_lap_remaining_distance = 0
-    # calculate time and dist for the unfinished lap
-    # print(f"unfinished lap duration {unfinished_lap.duration} vs avg {avgLapTime}")
-    if unfinished_lap and unfinished_lap['lap_duration'] < avg_lap_time:
-        unfinished_lap_remaining_time = avg_lap_time - unfinished_lap['lap_duration']
-    # print(f"unfinished lap time remaining time: {unfinished_lap_remaining_time}")
-    if unfinished_lap and unfinished_lap['distance'] < avg_lap_distance:
-        unfinished_lap_remaining_distance = avg_lap_distance - unfinished_lap['distance']
-    # print(f"unfinished lap time remaining distance: {unfinished_lap_remaining_time}")
-
-    time_to_forecast = time_to_end
-    if unfinished_lap_remaining_time:
-        time_to_forecast -= unfinished_lap_remaining_time
-    # print(f"time to forecast: {timeToForecast.in_hours()}")
-    full_laps_remaining = int(time_to_forecast / (avg_lap_time + avg_pit_time))
-    # print(f"laps to go: {fullLapsRemaining}")
-    remaining_last_lap_time = time_to_forecast - full_laps_remaining * (avg_lap_time + avg_pit_time)  # time left after max possible full laps
-    # print(f"last lap time: {remaining_last_lap_time}")
-    coef = remaining_last_lap_time / (avg_lap_time + avg_pit_time)
-    # print(f"coef: {coef}")
-    last_lap_duration = avg_lap_time * coef
-    # print(f"last lap duration: {last_lap_duration}")
-    last_pit_duration = avg_pit_time * coef
-    # print(f"last pit duration : {last_pit_duration}")
-    last_lap_distance = avg_lap_distance * coef
-    # print(f"last lap distance: {last_lap_distance}")
-
-    total_estimated_distance = distance_since_start + unfinished_lap_remaining_distance + full_laps_remaining * avg_lap_distance + last_lap_distance
-    # print(f"total estimated distance: {total_estimated_distance}")
-
-    current_item['avg_lap_duration'] = avg_lap_time
-    current_item['avg_pit_duration'] = avg_pit_time
-    current_item['avg_full_duration'] = avg_lap_time + avg_pit_time
-    current_item['avg_lap_distance'] = avg_lap_distance
-    current_item['unfinished_lap_remaining_time'] = unfinished_lap_remaining_time
-    current_item['unfinished_lap_remaining_distance'] = unfinished_lap_remaining_distance
-    current_item['full_laps_remaining'] = full_laps_remaining
-    current_item['last_lap_duration'] = last_lap_duration
-    current_item['last_pit_duration'] = last_pit_duration
-    current_item['last_full_duration'] = last_lap_duration + last_pit_duration
-    current_item['last_lap_distance'] = last_lap_distance
-    current_item['total_estimated_distance'] = total_estimated_distance
-
-    # add best lap metric (best full avg speed
-    best_lap_id = None
-    best_avg_speed = 0
-    best_full_duration = time_since_start
-    best_lap_distance = 0
-    for lap in car_laps:
-        if 'full_avg_speed' in lap and lap['full_avg_speed'] > best_avg_speed:
-            best_avg_speed = lap['full_avg_speed']
-            best_lap_id = lap['lap_id']
-            best_full_duration = lap['full_duration']
-            best_lap_distance = lap['distance']
-    current_item['best_lap'] = best_lap_id
-
-    best_full_laps_remaining = int(time_to_forecast / best_full_duration)
-    # print(f"laps to go: {fullLapsRemaining}")
-    best_remaining_last_lap_time = time_to_forecast - best_full_laps_remaining * best_full_duration  # time left after max possible full laps
-    # print(f"last lap time: {remaining_last_lap_time}")
-    best_coef = best_remaining_last_lap_time / best_full_duration
-    # print(f"coef: {coef}")
-    best_last_lap_distance = best_lap_distance * best_coef
-    # print(f"last lap distance: {last_lap_distance}")
-
-    best_estimated_distance = distance_since_start + unfinished_lap_remaining_distance + best_full_laps_remaining * best_lap_distance + best_last_lap_distance
-    current_item['best_estimated_distance'] = best_estimated_distance
+    # all the models in one pass on float arrays, durations are created just for the fields
+    laps = get_lap_arrays(car_laps)
+    race_forecast = forecast_race(laps,
+                                  unfinished_lap_time=to_seconds(unfinished_lap.get('lap_duration'))
+                                  if unfinished_lap else None,
+                                  unfinished_lap_distance=to_float(unfinished_lap.get('distance'))
+                                  if unfinished_lap else None,
+                                  time_since_start=time_since_start,
+                                  time_to_end=time_to_end,
+                                  distance_since_start=float(distance_since_start))
+    logger.info(f"sum lap time {np.nansum(laps.lap_time)}, sum lap distance {np.nansum(laps.distance)}")
+
+    mean = MODELS.index(MODEL_MEAN)
+    avg_lap_time = race_forecast.lap_time[mean]
+    avg_pit_time = race_forecast.pit_time[mean]
+    coef = race_forecast.last_lap_coef[mean]
+
+    current_item['avg_lap_duration'] = pendulum.duration(seconds=avg_lap_time)
+    current_item['avg_pit_duration'] = pendulum.duration(seconds=avg_pit_time)
+    current_item['avg_full_duration'] = pendulum.duration(seconds=avg_lap_time + avg_pit_time)
+    current_item['avg_lap_distance'] = float(race_forecast.lap_distance[mean])
+    current_item['unfinished_lap_remaining_time'] = pendulum.duration(seconds=race_forecast.unfinished_lap_remaining_time)
+    current_item['unfinished_lap_remaining_distance'] = race_forecast.unfinished_lap_remaining_distance
+    current_item['full_laps_remaining'] = int(race_forecast.full_laps_remaining[mean])
+    current_item['last_lap_duration'] = pendulum.duration(seconds=avg_lap_time * coef)
+    current_item['last_pit_duration'] = pendulum.duration(seconds=avg_pit_time * coef)
+    current_item['last_full_duration'] = pendulum.duration(seconds=(avg_lap_time + avg_pit_time) * coef)
+    current_item['last_lap_distance'] = float(race_forecast.lap_distance[mean] * coef)
+    current_item['total_estimated_distance'] = float(race_forecast.estimated_distance[mean])
+
+    # add best lap metric (best full avg speed)
+    current_item['best_lap'] = race_forecast.best_lap_id
+
+    # all the models, i.e. trimmed_estimated_distance (best_estimated_distance is the best lap one)
+    for i, model in enumerate(MODELS):
+        current_item[f'{model}_estimated_distance'] = float(race_forecast.estimated_distance[i])
+        current_item[f'{model}_full_laps_remaining'] = int(race_forecast.full_laps_remaining[i])
+        current_item[f'{model}_full_duration'] = \
+            pendulum.duration(seconds=race_forecast.lap_time[i] + race_forecast.pit_time[i])
+
+    # stochastic forecast, the same time to forecast as the models (the unfinished lap completed by mean)
+    if configuration.forecast_simulations > 0:
+        simulated = forecast_simulator.get_percentiles(
+            laps, time_to_end - race_forecast.unfinished_lap_remaining_time,
+            runs=configuration.forecast_simulations,
+            budget_seconds=configuration.forecast_simulation_budget_ms / 1000,
+            processes=configuration.forecast_simulation_processes)
+        if simulated:
+            runs, percentiles = simulated
+            current_item['simulated_runs'] = runs
+            for percentile, distance in percentiles.items():
+                current_item[f'simulated_distance_p{percentile}'] = \
+                    float(distance_since_start) + race_forecast.unfinished_lap_remaining_distance + distance
@@ -4,6 +4,11 @@ import pendulum
 from src.data_models import CalculatedFieldDescription
 from src.data_models import Configuration
 
+# position fields (database columns) the hardcoded fields below read (from lap_data/pit_data)
+USED_POSITION_FIELDS = {'date', 'odometer'}
+# inputs (other data groups) the hardcoded fields below read, see field_dependencies
+USED_INPUTS = set()
+
 
 def add_calculated_fields(*,
                           current_item: Dict[str, Any],
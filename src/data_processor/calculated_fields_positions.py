@@ -5,6 +5,11 @@ from src.data_models import CalculatedFieldDescription
 from geopy.distance import distance as geopy_distance
 from src.data_models import Configuration
 
+# position fields (database columns) the hardcoded fields below read
+USED_POSITION_FIELDS = set()
+# inputs (other data groups) the hardcoded fields below read, see field_dependencies
+USED_INPUTS = set()
+
 
 def add_calculated_fields(*,
                           current_item: Dict[str, Any],
@@ -1,8 +1,11 @@
 from typing import Optional, Dict, Any
 import pendulum
-from geopy.distance import distance as geopy_distance
 
 from src.data_models import Configuration
+from src.data_processor.distance import distance_to_point
+
+# inputs (other data groups and time) the hardcoded fields below read, see field_dependencies
+USED_INPUTS = {'initial_status', 'lap_list', 'now_dt'}
 
 
 def add_calculated_fields(*,
@@ -41,11 +44,9 @@ def add_calculated_fields(*,
 
     current_item['distance'] = current_odo - initial_odo if current_odo is not None and initial_odo is not None else None
 
-    current_item['air_distance'] = geopy_distance(
-        (configuration.start_latitude, configuration.start_longitude),
-        (current_item['latitude'], current_item['longitude'])
-        ).km if 'latitude' in current_item and current_item['latitude'] is not None \
-                and 'longitude' in current_item and current_item['longitude'] is not None else None
+    current_item['air_distance'] = distance_to_point(
+        current_item.get('latitude'), current_item.get('longitude'),
+        (configuration.start_latitude, configuration.start_longitude), configuration.distance_mode)
 
     current_item['start_time'] = start_time
     current_item['end_time'] = end_time
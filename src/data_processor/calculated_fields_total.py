@@ -3,6 +3,11 @@ import pendulum
 from src.data_models import CalculatedFieldDescription
 from src.data_models import Configuration
 
+# position fields (database columns) the hardcoded fields below read
+USED_POSITION_FIELDS = {'odometer'}
+# inputs (other data groups) the hardcoded fields below read, see field_dependencies
+USED_INPUTS = {'position_list'}
+
 
 def add_calculated_fields(*,
                           current_item: Dict[str, Any],
@@ -0,0 +1,70 @@
+"""
+Cache of charges (details of charging processes) for the charging graphs. Closed charging processes can't
+change any more, their charges are kept for good, the ones still open are reloaded after short time.
+The refresher fills the cache in background as soon as a charging process closes (see prefetch), so the graphs
+of finished pit stops don't touch TeslaMate database.
+"""
+import threading
+import time
+from typing import Dict, Any, List, Tuple
+
+import src.data_source.teslamate
+from src.utils import function_timer
+
+import logging
+logger = logging.getLogger(__name__)
+
+OPEN_PROCESS_TTL_SECONDS = 15
+
+
+class ChargingDetailCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._closed: Dict[int, List[Dict[str, Any]]] = {}  # charging process id -> charges
+        self._open: Dict[int, Tuple[float, List[Dict[str, Any]]]] = {}  # charging process id -> (loaded, charges)
+
+    def get(self, charging_process: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Get charges of the charging process
+        :param charging_process: the charging process (id and end_date are used)
+        :return: charges ordered by date
+        """
+        charging_process_id = charging_process['id']
+        charges = self._closed.get(charging_process_id)
+        if charges is not None:
+            return charges
+        if charging_process.get('end_date') is not None:
+            return self._load_closed([charging_process_id])[charging_process_id]
+
+        now = time.monotonic()
+        cached = self._open.get(charging_process_id)
+        if cached and now - cached[0] < OPEN_PROCESS_TTL_SECONDS:
+            return cached[1]
+        charges = src.data_source.teslamate.get_car_charging_details(charging_process_id)
+        with self._lock:
+            self._open[charging_process_id] = (now, charges)
+        return charges
+
+    def _load_closed(self, charging_process_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        charges = src.data_source.teslamate.get_charging_details_bulk(charging_process_ids)
+        with self._lock:
+            self._closed.update(charges)
+            for charging_process_id in charging_process_ids:
+                self._open.pop(charging_process_id, None)
+        return charges
+
+    @function_timer()
+    def prefetch(self, charging_processes: List[Dict[str, Any]]):
+        """
+        Load charges of the closed charging processes not cached yet (all in one query)
+        :param charging_processes: the charging processes
+        """
+        missing = [charging_process['id'] for charging_process in charging_processes
+                   if charging_process.get('end_date') is not None and charging_process['id'] not in self._closed]
+        if missing:
+            self._load_closed(missing)
+            logger.info(f"charges of {len(missing)} closed charging processes cached")
+
+
+# let's have just one singleton to be used
+charging_detail_cache = ChargingDetailCache()
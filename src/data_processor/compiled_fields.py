@@ -0,0 +1,38 @@
+"""
+Cache of compiled user defined calculated fields (CalculatedField.calc_fn). The expression is compiled just once
+and the code object is reused for all the items (i.e. every position) and all the refreshes.
+Entries are keyed by hash of the source, so a changed expression is never evaluated from stale code even if
+the invalidation is missed. The hash is computed once when the field is cached (CalculatedFieldCached.source_hash),
+just the fields not cached (i.e. tested ones) are hashed on every call.
+"""
+import hashlib
+from types import CodeType
+from typing import Dict, Tuple
+
+_compiled_fields: Dict[Tuple[str, str], CodeType] = {}  # (source hash, field name) -> compiled code
+
+
+def get_source_hash(code: str) -> str:
+    return hashlib.sha1(code.encode()).hexdigest()
+
+
+def get_compiled_calc_fn(field_description) -> CodeType:
+    """
+    Get compiled code of calculated field (compile it if not cached yet or if the source has changed)
+    :param field_description: CalculatedFieldCached (or anything having name and calc_fn, i.e. CalculatedField)
+    :return: code object to be passed to eval
+    """
+    source_hash = getattr(field_description, 'source_hash', None) or get_source_hash(field_description.calc_fn)
+    key = (source_hash, field_description.name)
+    compiled = _compiled_fields.get(key)
+    if compiled is None:
+        compiled = compile(field_description.calc_fn, f"<calculated field {field_description.name}>", 'eval')
+        _compiled_fields[key] = compiled
+    return compiled
+
+
+def invalidate_compiled_calc_fns():
+    """
+    Drop compiled code of all the fields (the old sources are not needed any more)
+    """
+    _compiled_fields.clear()
@@ -1,20 +1,91 @@
+import hashlib
+import threading
+import numpy as np
 import pendulum
-from typing import Dict, Any, List, Optional, Callable
+from typing import Dict, Any, List, Optional, Callable, Set
 from pydantic import BaseModel
 import src.data_source.teslamate
 from src.data_processor.labels import generate_labels
 from src.data_models import Configuration, JsonLabelItem, JsonLabelGroup, JsonStatusResponse, JsonLapsResponse, JsonStaticSnapshot, JsonResponseListWrapper
-from src.utils import function_timer
+from src.data_source.position_store import PositionStore
+from src.utils import function_timer, get_string_literals, get_names
 
 from src.enums import LabelFormatGroupEnum, CalculatedFieldScopeEnum
 import src.data_processor.calculated_fields_positions
 import src.data_processor.calculated_fields_laps
 import src.data_processor.calculated_fields_forecast
+import src.data_processor.calculated_fields_total
 from src.data_processor import lap_analyzer
+from src.data_processor.compiled_fields import get_compiled_calc_fn
+from src.data_processor.lap_summaries import lap_summary_store
+from src.config_cache import config_cache, driver_change_index
+from src.shared_snapshot import shared_snapshot
+from src.response_cache import response_cache, EncodedResponse
+from src.data_processor.record_delta import RecordDelta
+from src.data_processor.graph_data import graph_data_cache
+from src.data_processor.charging_details import charging_detail_cache
+from src.data_processor.snapshot_cache import snapshot_cache, SnapshotKey, IMMUTABLE_VERSION
+from src.data_processor.field_dependencies import group_dependencies, GROUPS, INPUT_GROUPS, GROUP_INPUTS, \
+    TIME_INPUT
+from src.data_processor.forecast_simulation import forecast_simulator
 
 import logging
 logger = logging.getLogger(__name__)
 
+# data published to the other processes by parts (see shared_snapshot), the refresh state (lap detector) stays local
+# laps keep views of the positions, so they have to be in the same part (one pickle)
+SHARED_FIELDS = {
+    'data': ('initial_status_raw', 'car_positions_raw', 'car_positions_key', 'lap_list_raw', 'lap_list_formatted',
+             'lap_list_delta', 'charging_process_list_raw', 'charging_process_list_formatted'),
+    'status': ('current_status_raw', 'current_status_formatted', 'total_raw', 'total_formatted',
+               'forecast_raw', 'forecast_formatted'),
+}
+# data groups (see field_dependencies) -> shared part containing them
+GROUP_PARTS = {
+    'initial': 'data',
+    'positions': 'data',
+    'laps': 'data',
+    'charging': 'data',
+    'status': 'status',
+    'total': 'status',
+    'forecast': 'status',
+}
+# data groups (see field_dependencies) -> fields holding the raw data (the same in JsonStaticSnapshot)
+GROUP_FIELDS = {
+    'initial': 'initial_status_raw',
+    'status': 'current_status_raw',
+    'positions': 'car_positions_raw',
+    'laps': 'lap_list_raw',
+    'total': 'total_raw',
+    'charging': 'charging_process_list_raw',
+    'forecast': 'forecast_raw',
+}
+# public responses pre-serialized by the refresher (see response_cache), name -> formatted field
+RESPONSE_FIELDS = {
+    'status': 'current_status_formatted',
+    'laps': 'lap_list_formatted',
+    'chargings': 'charging_process_list_formatted',
+    'total': 'total_formatted',
+    'forecast': 'forecast_formatted',
+}
+# shared part -> public responses published with it
+RESPONSE_PARTS = {
+    'data': ('laps', 'chargings'),
+    'status': ('status', 'total', 'forecast'),
+}
+# configuration the laps and their fields are calculated from, the rest doesn't change frozen laps (see lap_summaries)
+LAP_CONFIGURATION_FIELDS = {'car_id', 'start_time', 'hours', 'start_latitude', 'start_longitude', 'start_radius',
+                            'distance_mode'}
+# data groups -> public responses containing them (status response contains total and forecast labels)
+GROUP_RESPONSES = {
+    'status': ('status',),
+    'laps': ('laps',),
+    'charging': ('chargings',),
+    'total': ('total', 'status'),
+    'forecast': ('forecast', 'status'),
+}
+_update_lock = threading.RLock()  # one update of the live data at a time (with its rendering and publishing)
+
 
 class DataProcessor(BaseModel):
     """ just wrapper around cached data"""
@@ -23,10 +94,13 @@ class DataProcessor(BaseModel):
     current_status_raw: Optional[Dict[str, Any]]
     current_status_formatted: Optional[JsonStatusResponse]
 
-    car_positions_raw: Optional[List[Dict[str, Any]]]
+    car_positions_raw: Optional[PositionStore]
+    car_positions_key: Optional[str]  # what the cached positions were loaded for (see _get_positions_key)
 
     lap_list_raw: Optional[List[Dict[str, Any]]]
     lap_list_formatted: Optional[JsonLapsResponse]
+    lap_detector: Optional[lap_analyzer.LapDetector]  # keeps lap finding state between updates
+    lap_list_delta: Optional[RecordDelta]  # versions of the formatted laps, for delta responses
 
     total_raw: Optional[Dict[str, Any]]
     total_formatted: Optional[JsonLabelGroup]
@@ -37,6 +111,13 @@ class DataProcessor(BaseModel):
     forecast_raw: Optional[Dict[str, Any]]
     forecast_formatted: Optional[JsonLabelGroup]
 
+    snapshot_versions: Dict[str, int] = {}  # part -> version of the shared snapshot taken (if not the refresher)
+    source_signatures: Dict[str, Any] = {}  # group -> identification of the database data it was loaded from
+    evaluated_at: Dict[str, float] = {}  # group -> timestamp of the last change (for groups depending on time)
+
+    class Config:
+        arbitrary_types_allowed = True  # PositionStore
+
     def _get_data_by_group_code(self, code):
         # TODO bring in sync with get_list_of_fields
         if code == 'initial':
@@ -73,12 +154,7 @@ class DataProcessor(BaseModel):
         return src.data_source.teslamate.get_car_status(car_id, start_time)
 
     def _set_driver_change(self, record, dt: pendulum.DateTime):
-        from src.db_models import DriverChange
-        driver_change = DriverChange.query.filter(
-            (DriverChange.valid_from <= dt) & ((DriverChange.valid_to >= dt) | (DriverChange.valid_to == None))
-        ).order_by(DriverChange.valid_from.desc()).first()
-        record['driver_name'] = driver_change.driver if driver_change else None
-        record['copilot_name'] = driver_change.copilot if driver_change else None
+        record['driver_name'], record['copilot_name'] = driver_change_index.get_drivers(dt)
 
     @function_timer()
     def _load_status_raw(self, car_id: int, dt: pendulum.DateTime, *,
@@ -105,27 +181,84 @@ class DataProcessor(BaseModel):
     def _load_positions(self, car_id: int, dt_start: pendulum.DateTime, dt_end: pendulum.DateTime, *,
                         initial_status, current_status, _position_list=None, lap_list, 
                         total, charging_process_list, forecast,
-                        configuration: Configuration) \
-            -> List[Dict[str, Any]]:
-        positions = src.data_source.teslamate.get_car_positions(car_id, dt_start, dt_end)
-        return self._enhance_positions(positions, dt_end,
+                        configuration: Configuration, lap_detector: Optional[lap_analyzer.LapDetector] = None) \
+            -> PositionStore:
+        """
+        Load all the positions in the time window. The rows are streamed from database in batches and every batch
+        is converted, enhanced and passed to lap detection before the next one is fetched (so the raw rows
+        never are in memory all at once)
+        :param lap_detector: if provided, it's fed by the positions as they come
+        """
+        columns = self._get_position_columns(_position_list)
+        positions = src.data_source.teslamate.create_position_store(car_id, columns)
+        for column_names, rows in src.data_source.teslamate.iter_car_positions(
+                car_id, dt_start, dt_end, columns=columns, fetch_size=configuration.db_fetch_size):
+            start_index = len(positions)
+            positions.extend_rows(column_names, rows)
+            self._enhance_positions(positions, dt_end,
+                                    initial_status=initial_status,
+                                    current_status=current_status,
+                                    _position_list=positions,
+                                    lap_list=lap_list,
+                                    total=total,
+                                    charging_process_list=charging_process_list,
+                                    forecast=forecast,
+                                    configuration=configuration,
+                                    start_index=start_index,
+                                    )
+            if lap_detector:
+                lap_detector.feed(configuration, positions)
+        return positions
+
+    @function_timer()
+    def _load_positions_incremental(self, car_id: int, dt_end: pendulum.DateTime, *,
+                                    initial_status, current_status, _position_list, lap_list,
+                                    total, charging_process_list, forecast,
+                                    configuration: Configuration) \
+            -> PositionStore:
+        """
+        Load just the positions newer than the last cached one and append them to the cached list
+        Note it changes the _position_list in place, the positions already loaded are not enhanced again
+        :param _position_list: already loaded (and enhanced) positions, must not be empty
+        :return: the updated list
+        """
+        columns = self._get_position_columns(_position_list)
+        _position_list.ensure_columns(columns)  # columns newly needed, so the old positions don't miss them
+        last_position = _position_list[-1]
+        new_positions = src.data_source.teslamate.get_car_positions_since(car_id, last_position['date'],
+                                                                          last_position['id'], dt_end,
+                                                                          columns=columns)
+        logger.debug(f"{len(new_positions)} new positions to append to {len(_position_list)} cached")
+        if not new_positions:
+            return _position_list
+
+        start_index = len(_position_list)
+        _position_list.extend(new_positions)
+        return self._enhance_positions(_position_list, dt_end,
                                        initial_status=initial_status,
                                        current_status=current_status,
-                                       _position_list=positions,
+                                       _position_list=_position_list,
                                        lap_list=lap_list,
                                        total=total,
                                        charging_process_list=charging_process_list,
                                        forecast=forecast,
                                        configuration=configuration,
-                                    )
+                                       start_index=start_index,
+                                       )
 
     @function_timer()
     def _load_laps(self, positions, dt: pendulum.DateTime, *,
                    initial_status, current_status, position_list, _lap_list=None, 
                    total, charging_process_list, forecast,
-                   configuration: Configuration):
-        # TODO convert to finder
-        laps = lap_analyzer.find_laps(configuration, positions, configuration.start_radius, 0, 0)
+                   configuration: Configuration, lap_detector: Optional[lap_analyzer.LapDetector] = None):
+        """
+        Find laps in positions and enhance them
+        :param lap_detector: if provided, it's used to analyze just positions added since its last use
+        """
+        if lap_detector:
+            laps = lap_detector.update(configuration, positions)
+        else:
+            laps = lap_analyzer.find_laps(configuration, positions, configuration.start_radius, 0, 0)
         for lap in laps:
             if 'lap_data' in lap and lap['lap_data']:
                 self._set_driver_change(lap, lap['lap_data'][0]['date'])
@@ -214,6 +347,25 @@ class DataProcessor(BaseModel):
                                           )
         return forecast
 
+    @classmethod
+    def _get_position_columns(cls, previous_positions: Optional[PositionStore] = None) -> Set[str]:
+        """
+        Position fields to be loaded from database: the ones used by lap finding, hardcoded calculated fields,
+        database calculated fields (string literals in calc_fn) and labels. Anything else is loaded lazily on access.
+        Note it contains names of calculated fields too, the data source ignores the names not being columns.
+        :param previous_positions: positions loaded before, the columns loaded lazily (i.e. graphs) are kept
+        """
+        columns = set(lap_analyzer.USED_POSITION_FIELDS)
+        columns |= src.data_processor.calculated_fields_positions.USED_POSITION_FIELDS
+        columns |= src.data_processor.calculated_fields_laps.USED_POSITION_FIELDS
+        columns |= src.data_processor.calculated_fields_total.USED_POSITION_FIELDS
+        for field in config_cache.get_all_calculated_fields():
+            columns |= get_string_literals(field.calc_fn)
+        columns |= {label_format.field for label_format in config_cache.get_all_label_formats()}
+        if previous_positions is not None:
+            columns |= set(previous_positions.column_names())
+        return columns
+
     #####################################
     # enhancers - add calculated fields #
     #####################################
@@ -226,7 +378,7 @@ class DataProcessor(BaseModel):
                                            current_item_index: Optional[int], now_dt: pendulum.DateTime):
         """
         Add database defined calculated fields to current_item  (helper, not to be called directly)
-        :param field_description: this is of type CalculatedField. I don't want to import because of DB dependency
+        :param field_description: CalculatedField or its cached copy (CalculatedFieldCached)
         :param current_item:
         :param initial_status:
         :param current_status:
@@ -241,7 +393,7 @@ class DataProcessor(BaseModel):
         :return:
         """
         name = field_description.name
-        code = field_description.calc_fn
+        code = get_compiled_calc_fn(field_description)  # compiled just once, not for every item
         value = eval(code, {}, {
             'current_item': current_item,
             'initial_status': initial_status,
@@ -283,8 +435,7 @@ class DataProcessor(BaseModel):
                               )
 
         # add user-defined (db) calculated fields
-        from src.db_models import CalculatedField
-        db_calculated_fields = CalculatedField.get_all_by_scope(CalculatedFieldScopeEnum.STATUS.value)
+        db_calculated_fields = config_cache.get_calculated_fields(CalculatedFieldScopeEnum.STATUS.value)
         for db_calculated_field in db_calculated_fields:
             self._add_user_defined_calculated_field(db_calculated_field, status,
                                                     initial_status=initial_status,
@@ -301,17 +452,18 @@ class DataProcessor(BaseModel):
         return status
 
     @function_timer()
-    def _enhance_positions(self, positions: List[Dict[str, Any]], dt: pendulum.DateTime, *,
+    def _enhance_positions(self, positions: PositionStore, dt: pendulum.DateTime, *,
                            initial_status, current_status, _position_list=None, lap_list, 
                            total, charging_process_list, forecast,
-                           configuration: Configuration) -> List[Dict[str, Any]]:
+                           configuration: Configuration, start_index: int = 0) -> PositionStore:
         # add calculated fields
         # !! note this operation is expensive as it runs on lot of records
+        # start_index allows to skip the positions already enhanced before (incremental load)
+        # the items are dict-like views, the values set by calculated fields are stored as new columns
 
         from src.data_processor.calculated_fields_positions import add_calculated_fields
-        from src.db_models import CalculatedField
-        db_calculated_fields = CalculatedField.get_all_by_scope(CalculatedFieldScopeEnum.POSITION.value)
-        for i in range(len(positions)):
+        db_calculated_fields = config_cache.get_calculated_fields(CalculatedFieldScopeEnum.POSITION.value)
+        for i in range(start_index, len(positions)):
             add_calculated_fields(current_item=positions[i],
                                   initial_status=initial_status,
                                   current_status=current_status,
@@ -345,10 +497,40 @@ class DataProcessor(BaseModel):
                       total, charging_process_list, forecast,
                       configuration: Configuration) -> List[Dict[str, Any]]:
 
-        from src.data_processor.calculated_fields_laps import add_calculated_fields
-        from src.db_models import CalculatedField
-        db_calculated_fields = CalculatedField.get_all_by_scope(CalculatedFieldScopeEnum.POSITION.value)
+        # finished (frozen) laps don't change, the fields depending just on the lap are calculated once and stored,
+        # the fields reading other data (status, total, other laps, time, ...) are calculated every time
+        from src.data_processor.calculated_fields_laps import add_calculated_fields, USED_INPUTS
+        db_calculated_fields = config_cache.get_calculated_fields(CalculatedFieldScopeEnum.POSITION.value)
+        recalculated = self._get_lap_recalculated_fields(db_calculated_fields)
+        recalculated_fields = [field for field in db_calculated_fields if field.name in recalculated]
+        summary_hash = self._get_lap_summary_hash(configuration)
+        to_calculate = []
         for i in range(len(laps)):
+            summary = None
+            if laps[i].get('frozen') and not USED_INPUTS:  # hardcoded fields are not stored if reading other data
+                summary = lap_summary_store.get(summary_hash, laps[i])
+            if summary is None:
+                to_calculate.append(i)
+                continue
+            laps[i].update(summary)
+            for field_description in recalculated_fields:
+                self._add_user_defined_calculated_field(field_description, laps[i],
+                                                        initial_status=initial_status,
+                                                        current_status=current_status,
+                                                        position_list=position_list,
+                                                        lap_list=laps,
+                                                        total=total,
+                                                        charging_process_list=charging_process_list,
+                                                        forecast=forecast,
+                                                        configuration=configuration,
+                                                        current_item_index=i,
+                                                        now_dt=dt,
+                                                        )
+
+        # statistics over positions not loaded (speed, power, temperatures, ...) are aggregated by database
+        aggregates = self._load_lap_aggregates(configuration, [laps[i] for i in to_calculate])
+        for i in to_calculate:
+            laps[i].update(aggregates.get(laps[i]['lap_id'], {}))
             add_calculated_fields(current_item=laps[i],
                                   initial_status=initial_status,
                                   current_status=current_status,
@@ -374,8 +556,38 @@ class DataProcessor(BaseModel):
                                                         current_item_index=i,
                                                         now_dt=dt,
                                                         )
+            if laps[i].get('frozen') and not USED_INPUTS:
+                lap_summary_store.put(summary_hash, laps[i], recalculated)
         return laps
 
+    @classmethod
+    def _get_lap_recalculated_fields(cls, db_calculated_fields) -> Set[str]:
+        """
+        Database calculated fields of laps reading more than the lap itself, these are not stored with the frozen laps
+        (see lap_summaries). The field reads other data if it uses any input but current_item (configuration included,
+        the summaries are kept for the lap related part of it only), or if it reads another field of this kind (found
+        by the string literals, i.e. current_item['x'])
+        :param db_calculated_fields: calculated fields of laps, in order of evaluation
+        :return: names of the fields
+        """
+        outer_names = set(INPUT_GROUPS) | {TIME_INPUT, 'configuration', 'current_item_index'}
+        recalculated = set()
+        for field in db_calculated_fields:
+            if get_names(field.calc_fn) & outer_names or get_string_literals(field.calc_fn) & recalculated:
+                recalculated.add(field.name)
+        return recalculated
+
+    @classmethod
+    def _load_lap_aggregates(cls, configuration: Configuration, laps: List[Dict[str, Any]]) \
+            -> Dict[str, Dict[str, Any]]:
+        """
+        Get aggregates (energy, speeds, temperatures, battery levels) of the driving part of the laps
+        :return: lap id -> aggregated fields
+        """
+        lap_boundaries = [(lap['lap_id'], lap['lap_data'][0]['date'], lap['lap_data'][-1]['date'])
+                          for lap in laps if lap.get('lap_data')]
+        return src.data_source.teslamate.get_lap_aggregates(configuration.car_id, lap_boundaries)
+
     @function_timer()
     def _enhance_total(self, total: Dict[str, Any], dt: pendulum.DateTime, *,
                        initial_status, current_status, position_list, lap_list,
@@ -402,8 +614,7 @@ class DataProcessor(BaseModel):
                               )
 
         # add user-defined (db) calculated fields
-        from src.db_models import CalculatedField
-        db_calculated_fields = CalculatedField.get_all_by_scope(CalculatedFieldScopeEnum.TOTAL.value)
+        db_calculated_fields = config_cache.get_calculated_fields(CalculatedFieldScopeEnum.TOTAL.value)
         for db_calculated_field in db_calculated_fields:
             self._add_user_defined_calculated_field(db_calculated_field, total,
                                                     initial_status=initial_status,
@@ -430,8 +641,7 @@ class DataProcessor(BaseModel):
         :return: the enhanced version (note it does in place enhancements, changes the parameter)
         """
         from src.data_processor.calculated_fields_charges import add_calculated_fields
-        from src.db_models import CalculatedField
-        db_calculated_fields = CalculatedField.get_all_by_scope(CalculatedFieldScopeEnum.POSITION.value)
+        db_calculated_fields = config_cache.get_calculated_fields(CalculatedFieldScopeEnum.POSITION.value)
         for i in range(len(charging_processes)):
             add_calculated_fields(current_item=charging_processes[i],
                                   initial_status=initial_status,
@@ -486,8 +696,7 @@ class DataProcessor(BaseModel):
                               )
 
         # add user-defined (db) calculated fields
-        from src.db_models import CalculatedField
-        db_calculated_fields = CalculatedField.get_all_by_scope(CalculatedFieldScopeEnum.FORECAST.value)
+        db_calculated_fields = config_cache.get_calculated_fields(CalculatedFieldScopeEnum.FORECAST.value)
         for db_calculated_field in db_calculated_fields:
             self._add_user_defined_calculated_field(db_calculated_field, forecast,
                                                     initial_status=initial_status,
@@ -518,11 +727,10 @@ class DataProcessor(BaseModel):
         :param record_id: if provided, it's passed to the ui. i.e. for purpose of table headers
         :return: formatted structure
         """
-        from src.db_models import LabelGroup, LabelFormat
         from src.data_processor.labels import generate_labels
 
-        db_label_group: LabelGroup = src.db_models.LabelGroup.query.filter_by(code=label_group.value).first()
-        formatted_items: List[JsonLabelItem] = generate_labels(LabelFormat.get_all_by_group(label_group.value),
+        db_label_group = config_cache.get_label_group(label_group.value)
+        formatted_items: List[JsonLabelItem] = generate_labels(config_cache.get_label_formats(label_group.value),
                                                                d, dt)
         return JsonLabelGroup(title=db_label_group.title, items=formatted_items, record_id=record_id)
 
@@ -571,121 +779,340 @@ class DataProcessor(BaseModel):
     # update calls (to be used from background jobs #
     #################################################
 
-    @function_timer()
-    def update_status(self):
+    @classmethod
+    def _get_positions_key(cls, configuration: Configuration, dt_end: pendulum.DateTime) -> str:
         """
-        update current status. May be called from background job
+        Identify the data the positions were loaded for. If it changes, cached positions can't be reused
+        (including the database configuration, the calculated fields may have changed)
+        """
+        return f"{configuration.get_hash()}:{config_cache.version}:{dt_end.isoformat()}"
+
+    @classmethod
+    def _get_lap_summary_hash(cls, configuration: Configuration) -> str:
+        """
+        Identify the configuration lap summaries were calculated for (stays the same after restart). Just the lap
+        related configuration is used, so changing i.e. the refresh periods keeps the summaries
+        """
+        lap_configuration = configuration.json(include=LAP_CONFIGURATION_FIELDS)
+        return hashlib.sha1(f"{lap_configuration}:{config_cache.get_calculated_fields_hash()}".encode()).hexdigest()
+
+    @classmethod
+    def _get_inputs(cls, data, group: str) -> Dict[str, Any]:
+        """
+        Inputs of the group loader (the data groups), the group's own one is passed underscored
+        :param data: DataProcessor or JsonStaticSnapshot to take the groups from
+        :param group: the group to be loaded
+        :return: keyword arguments for the loader
+        """
+        inputs = {name: getattr(data, GROUP_FIELDS[input_group]) for name, input_group in INPUT_GROUPS.items()}
+        own = GROUP_INPUTS[group]
+        inputs['_' + own] = inputs.pop(own)
+        return inputs
+
+    @classmethod
+    def _evaluate_groups(cls, loaders: Dict[str, Callable[[bool, bool], bool]], dirty: Set[str],
+                         stale: Set[str] = frozenset()) -> Set[str]:
+        """
+        Evaluate the data groups in order of their dependencies (see field_dependencies). The group is evaluated
+        if it's dirty, stale or if any of the groups it reads has changed, so every group is evaluated once at most
+        :param loaders: group -> loader(reload, recalculate). Reload tells to check the source (database), the group
+                        is calculated again if the source has changed. Recalculate tells to calculate it
+                        anyway (the inputs have changed). The loader returns whether the group has changed.
+        :param dirty: groups to be reloaded from their source
+        :param stale: groups to be recalculated (depending on time)
+        :return: groups changed
+        """
+        dependencies = group_dependencies.get_dependencies()
+        changed = set()
+        for group in group_dependencies.get_order():
+            reload = group in dirty
+            recalculate = group in stale or bool(dependencies[group] & changed)
+            if (reload or recalculate) and loaders[group](reload, recalculate):
+                changed.add(group)
+        return changed
+
+    @classmethod
+    def _get_config_key(cls, configuration: Configuration) -> str:
+        """
+        Identify the configuration (file and database) and the driver changes, the data derived from them
+        have to be calculated again if it changes
+        """
+        return f"{configuration.get_hash()}:{config_cache.version}:{driver_change_index.version}"
+
+    def _get_live_loaders(self, configuration: Configuration, now: pendulum.DateTime) \
+            -> Dict[str, Callable[[bool, bool], bool]]:
+        """
+        Loaders of the live data groups (see _evaluate_groups). The sources are compared with the ones loaded
+        before (source_signatures), the groups are not calculated again if nothing new has come.
         """
-        from src import configuration
         car_id = configuration.car_id
+        dt_end = configuration.start_time.add(hours=configuration.hours)
+        config_key = self._get_config_key(configuration)
+
+        def load_positions(reload: bool, recalculate: bool) -> bool:
+            if not reload:
+                return False  # positions are enhanced just once, when loaded
+            positions_key = self._get_positions_key(configuration, dt_end)
+            if not self.lap_detector or self.lap_detector.key != positions_key:
+                self.lap_detector = lap_analyzer.LapDetector(key=positions_key, region=configuration.start_radius,
+                                                             min_time=0, start_idx=0,
+                                                             distance_mode=configuration.distance_mode)
+            if self.car_positions_raw and self.car_positions_key == positions_key and not self.snapshot_versions:
+                # same race window, just append the new records
+                # (not to the ones mapped from the shared snapshot, if this process has just taken over the refresh)
+                count = len(self.car_positions_raw)
+                positions = self._load_positions_incremental(car_id, dt_end, **self._get_inputs(self, 'positions'),
+                                                             configuration=configuration)
+                changed = len(positions) != count
+            else:
+                # first load or configuration changed, reload all
+                positions = self._load_positions(car_id, configuration.start_time, dt_end,
+                                                 **self._get_inputs(self, 'positions'),
+                                                 configuration=configuration, lap_detector=self.lap_detector)
+                changed = True
+            self.car_positions_raw = positions
+            self.car_positions_key = positions_key
+            self.snapshot_versions = {}  # own data now
+            return changed
+
+        def load_laps(reload: bool, recalculate: bool) -> bool:
+            # find and update laps (just the rest not fed while loading the positions)
+            self.lap_list_raw = self._load_laps(self.car_positions_raw, now, **self._get_inputs(self, 'laps'),
+                                                configuration=configuration, lap_detector=self.lap_detector)
+            return True
+
+        def load_charging(reload: bool, recalculate: bool) -> bool:
+            charging_processes = None
+            if reload:
+                loaded = src.data_source.teslamate.get_car_charging_processes(car_id, configuration.start_time,
+                                                                              dt_end)
+                signature = (config_key, [sorted(charging_process.items()) for charging_process in loaded])
+                if signature != self.source_signatures.get('charging'):
+                    self.source_signatures['charging'] = signature
+                    charging_processes = loaded
+            if charging_processes is None:
+                if not recalculate:
+                    return False  # nothing new in database
+                charging_processes = self.charging_process_list_raw  # just the inputs have changed
+            self.charging_process_list_raw = self._enhance_charging_processes(
+                charging_processes, now, **self._get_inputs(self, 'charging'), configuration=configuration)
+            return True
+
+        def load_status(reload: bool, recalculate: bool) -> bool:
+            status = None
+            if reload:
+                loaded = src.data_source.teslamate.get_car_status(car_id, now)
+                signature = (config_key, loaded.get('id'), loaded.get('date'), loaded.get('fast_data_date'))
+                if signature != self.source_signatures.get('status'):
+                    self.source_signatures['status'] = signature
+                    status = loaded
+                    status['meta_last_updated'] = pendulum.now('utc')
+            if status is None:
+                if not recalculate:
+                    return False  # nothing new in database
+                status = dict(self.current_status_raw)  # just the inputs (or time) have changed
+            self._set_driver_change(status, now)
+            self.current_status_raw = self._enhance_status(status, now, **self._get_inputs(self, 'status'),
+                                                           configuration=configuration)
+            return True
+
+        def load_total(reload: bool, recalculate: bool) -> bool:
+            total = self._load_total(now, **self._get_inputs(self, 'total'), configuration=configuration)
+            # note the stored total has forecast fields too (forecast is built on it), compare just the total ones
+            previous = self.total_raw
+            if previous is not None and self.source_signatures.get('total') == config_key \
+                    and all(key in previous and previous[key] == value for key, value in total.items()):
+                return False
+            self.source_signatures['total'] = config_key
+            self.total_raw = total
+            return True
+
+        def load_forecast(reload: bool, recalculate: bool) -> bool:
+            self.forecast_raw = self._load_forecast(now, **self._get_inputs(self, 'forecast'),
+                                                    configuration=configuration)
+            return True
+
+        return {
+            'positions': load_positions,
+            'laps': load_laps,
+            'charging': load_charging,
+            'status': load_status,
+            'total': load_total,
+            'forecast': load_forecast,
+        }
+
+    def _update_groups(self, dirty: Set[str]) -> Set[str]:
+        """
+        Update the live data groups and the formatted forms of the ones changed. Nothing is calculated
+        nor formatted if no new data have come (besides the groups depending on time, see idle_update_seconds)
+        :param dirty: groups to be reloaded from database, the missing ones are loaded too
+        :return: groups changed
+        """
+        from src import configuration
         now = pendulum.now(tz='utc')
 
-        if not self.initial_status_raw:
-            self.initial_status_raw = self._update_initial_status(car_id, configuration.start_time)  # make sure there is initial status loaded
-
-        status = self._load_status_raw(car_id, now,
-                                       initial_status=self.initial_status_raw,
-                                       _current_status=self.current_status_raw,
-                                       position_list=self.car_positions_raw,
-                                       lap_list=self.lap_list_raw,
-                                       total=self.total_raw,
-                                       charging_process_list=self.charging_process_list_raw,
-                                       forecast=self.forecast_raw,
-                                       configuration=configuration, )
-        self.current_status_raw = status
-        self.current_status_raw['meta_last_updated'] = pendulum.now('utc')
-
-        # just to make sure all data exist before rendering if no bg jobs are allowed
-        if not configuration or not self.total_raw or not self.forecast_raw:
-            self.update_positions_laps_forecast()
+        # status and laps are refreshed by different threads, the simulation is the live one (see forecast_simulation)
+        with _update_lock, forecast_simulator.live():
+            if not self.initial_status_raw:
+                # make sure there is initial status loaded
+                self.initial_status_raw = self._update_initial_status(configuration.car_id, configuration.start_time)
+            missing = {group for group in GROUPS if getattr(self, GROUP_FIELDS[group]) is None}
+            for group in missing:
+                self.source_signatures.pop(group, None)
+            stale = {group for group in group_dependencies.get_time_dependent() - missing
+                     if now.timestamp() - self.evaluated_at.get(group, 0) >= configuration.idle_update_seconds}
+            changed = self._evaluate_groups(self._get_live_loaders(configuration, now), dirty | missing, stale)
+            for group in changed:
+                self.evaluated_at[group] = now.timestamp()
+            if not changed:
+                logger.debug(f"no changes of {sorted(dirty)}")
+
+            # generate the formatted form after, when all are updated
+            if 'laps' in changed:
+                self.lap_list_formatted = self._load_laps_formatted(self.lap_list_raw, now)
+                self.lap_list_delta = RecordDelta.create(self.lap_list_delta,
+                                                         self._get_lap_tables(self.lap_list_formatted))
+            if 'charging' in changed:
+                self.charging_process_list_formatted = \
+                    self._load_charging_process_list_formatted(self.charging_process_list_raw, now)
+            if 'total' in changed:
+                self.total_formatted = self._format_dict(self.total_raw, LabelFormatGroupEnum.TOTAL, now)
+            if 'forecast' in changed:
+                self.forecast_formatted = self._format_dict(self.forecast_raw, LabelFormatGroupEnum.FORECAST, now)
+            if changed & {'status', 'total', 'forecast'}:
+                self.current_status_formatted = self._load_status_formatted(self.current_status_raw, self.total_raw,
+                                                                            self.forecast_raw, now)
+        return changed
 
-        self.current_status_formatted = self._load_status_formatted(self.current_status_raw, self.total_raw,
-                                                                    self.forecast_raw, now)
+    @function_timer()
+    def update_status(self) -> Set[str]:
+        """
+        update current status (and the groups reading it). May be called from background job
+        :return: data groups changed
+        """
+        return self._update_groups({'status'})
 
     @function_timer()
-    def update_positions_laps_forecast(self):
+    def update_positions_laps_forecast(self) -> Set[str]:
+        """
+        update rest of the data (besides status, just the groups reading the data changed). May be called
+        from background job
+        :return: data groups changed
+        """
+        # positions and charging processes come from database, the rest is derived from them
+        return self._update_groups({'positions', 'charging'})
+
+    def refresh(self, update: Callable[[], Set[str]]) -> Set[str]:
+        """
+        run the update, then render the responses and publish the groups changed. Called by the refresher.
+        Status and laps are refreshed by different threads, all of it runs under the update lock, so the data
+        published are consistent and an older response never replaces a newer one
+        :param update: update_status or update_positions_laps_forecast
+        :return: data groups changed
         """
-        update rest of the data (besides status. May be called from background job
+        with _update_lock:
+            changed = update()
+            if changed:  # nothing to render nor publish if no new data have come
+                self.render_groups(changed)
+                self.publish_snapshot(changed)
+        return changed
+
+    def publish_snapshot(self, groups: Set[str]):
+        """
+        publish the data to the other processes. Called by the refresher after every update
+        :param groups: data groups changed, just the parts containing them are published
+        """
+        if not shared_snapshot.enabled:
+            return
+        for part in sorted({GROUP_PARTS[group] for group in groups}):
+            shared_snapshot.publish(part, {name: getattr(self, name) for name in SHARED_FIELDS[part]},
+                                    response_cache.get_blobs(RESPONSE_PARTS[part]))
+
+    def render_responses(self, *names: str):
+        """
+        serialize the public responses once, so the endpoints don't do it per request. Called by the refresher
+        :param names: responses to render (keys of RESPONSE_FIELDS)
+        """
+        for name in names:
+            formatted = getattr(self, RESPONSE_FIELDS[name])
+            if formatted is None:
+                continue
+            if name == 'status':
+                formatted.totalLabels = self.total_formatted  # the same as get_status_formatted does
+            response_cache.put(name, formatted.json().encode())
+
+    def render_groups(self, groups: Set[str]):
+        """
+        serialize the public responses containing the data groups (see render_responses)
+        :param groups: data groups changed
+        """
+        self.render_responses(*sorted({name for group in groups for name in GROUP_RESPONSES.get(group, ())}))
+
+    def _sync_snapshot(self):
+        """
+        take the latest data published by the refresher (just if this process is not the refresher)
         """
         from src import configuration
+        if not configuration.update_run_background or shared_snapshot.is_refresher:
+            return
+        for part, names in SHARED_FIELDS.items():
+            snapshot = shared_snapshot.load(part)
+            if snapshot is None or snapshot.version == self.snapshot_versions.get(part):
+                continue
+            for name in names:
+                setattr(self, name, snapshot.objects.get(name))
+            response_cache.set_blobs(snapshot.blobs)
+            self.snapshot_versions = {**self.snapshot_versions, part: snapshot.version}
+
+    def get_response(self, name: str) -> Optional[EncodedResponse]:
+        """
+        get public response pre-serialized by the refresher
+        :param name: name of the response (key of RESPONSE_FIELDS)
+        :return: the response or None if not available (not updated yet or data are updated per request)
+        """
+        from src import configuration
+        self._sync_snapshot()
+        if not configuration.update_run_background:
+            return None
+        return response_cache.get(name)
 
-        now = pendulum.now(tz='utc')
-        dt_end = configuration.start_time.add(hours=configuration.hours)
-        positions = self._load_positions(
-            configuration.car_id, configuration.start_time, dt_end,
-            initial_status=self.initial_status_raw,
-            current_status=self.current_status_raw,
-            _position_list=self.car_positions_raw,
-            lap_list=self.lap_list_raw,
-            total=self.total_raw,
-            charging_process_list=self.charging_process_list_raw,
-            forecast=self.forecast_raw,
-            configuration=configuration, )
-        self.car_positions_raw = positions
-        # no formatting for positions
-
-        # find and update laps
-        self.lap_list_raw = self._load_laps(
-            positions, now,
-            initial_status=self.initial_status_raw,
-            current_status=self.current_status_raw,
-            position_list=self.car_positions_raw,
-            _lap_list=self.lap_list_raw,
-            total=self.total_raw,
-            charging_process_list=self.charging_process_list_raw,
-            forecast=self.forecast_raw,
-            configuration=configuration,
-            )
-
-        # load charging
-        self.charging_process_list_raw = self._load_charging_processes(
-            configuration.car_id, configuration.start_time, dt_end,
-            initial_status=self.initial_status_raw,
-            current_status=self.current_status_raw,
-            position_list=self.car_positions_raw,
-            lap_list=self.lap_list_raw,
-            total=self.total_raw,
-            _charging_process_list=self.charging_process_list_raw,
-            forecast=self.forecast_raw,
-            configuration=configuration,
-            )
-
-        # load total
-        self.total_raw = self._load_total(
-            now,
-            initial_status=self.initial_status_raw,
-            current_status=self.current_status_raw,
-            position_list=self.car_positions_raw,
-            lap_list=self.lap_list_raw,
-            _total=self.total_raw,
-            charging_process_list=self.charging_process_list_raw,
-            forecast=self.forecast_raw,
-            configuration=configuration,
-            )
-
-        # load forecast
-        self.forecast_raw = self._load_forecast(
-            now,
-            initial_status=self.initial_status_raw,
-            current_status=self.current_status_raw,
-            position_list=self.car_positions_raw,
-            lap_list=self.lap_list_raw,
-            total=self.total_raw,
-            charging_process_list=self.charging_process_list_raw,
-            _forecast=self.forecast_raw,
-            configuration=configuration,
-            )
-
-        # just to make sure all data exist before rendering if no bg jobs are allowed
-        if not configuration or not self.current_status_raw:
-            self.update_status
-
-        # generate the formatted form after, when all are updated
-        self.lap_list_formatted = self._load_laps_formatted(self.lap_list_raw, now)
-        self.charging_process_list_formatted = \
-            self._load_charging_process_list_formatted(self.charging_process_list_raw, now)
-        self.total_formatted = self._format_dict(self.total_raw, LabelFormatGroupEnum.TOTAL, now)
-        self.forecast_formatted = self._format_dict(self.forecast_raw, LabelFormatGroupEnum.FORECAST, now)
+    @classmethod
+    def _get_lap_tables(cls, laps_formatted: JsonLapsResponse) -> Dict[str, List[JsonLabelGroup]]:
+        return {
+            'previous': laps_formatted.previous.__root__,
+            'recent': [laps_formatted.recent] if laps_formatted.recent else [],
+        }
+
+    def get_lap_list_delta(self) -> Optional[RecordDelta]:
+        """
+        get versions of the formatted laps prepared by the refresher (see RecordDelta)
+        :return: the delta or None if not available (not updated yet or data are updated per request)
+        """
+        from src import configuration
+        self._sync_snapshot()
+        if not configuration.update_run_background:
+            return None
+        return self.lap_list_delta
+
+    def get_laps_delta(self, since: int) -> bytes:
+        """
+        get formatted laps changed since the version (see RecordDelta)
+        :param since: version the client has seen (0 for all)
+        :return: serialized delta response
+        """
+        delta = self.get_lap_list_delta()
+        if delta is None:
+            # nothing prepared by the refresher, send everything
+            return RecordDelta.create(None, self._get_lap_tables(self.get_laps_formatted())).get_changed(0)
+        return delta.get_changed(since)
+
+    def get_versions(self) -> Dict[str, int]:
+        """
+        get versions of the data groups (public responses), a version increases whenever the data change
+        :return: response name -> version
+        """
+        self._sync_snapshot()
+        return response_cache.get_versions()
 
     ###########
     # getters #
@@ -697,6 +1124,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.current_status_raw:
             self.update_status()
         return self.current_status_raw
@@ -707,18 +1135,20 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.current_status_formatted:
             self.update_status()
         out = self.current_status_formatted
         out.totalLabels = self.total_formatted  # TODO this is not nice hack
         return out
 
-    def get_positions_raw(self) -> List[Dict[str, Any]]:
+    def get_positions_raw(self) -> PositionStore:
         """
         get current positions raw
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.car_positions_raw:
             self.update_positions_laps_forecast()
         return self.car_positions_raw
@@ -729,6 +1159,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.lap_list_raw:
             self.update_positions_laps_forecast()
         return self.lap_list_raw
@@ -739,6 +1170,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.lap_list_formatted:
             self.update_positions_laps_forecast()
         return self.lap_list_formatted
@@ -749,6 +1181,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.total_raw:
             self.update_positions_laps_forecast()
         return self.total_raw
@@ -759,6 +1192,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.total_formatted:
             self.update_positions_laps_forecast()
         return self.total_formatted
@@ -769,6 +1203,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.charging_process_list_raw:
             self.update_positions_laps_forecast()
         return self.charging_process_list_raw
@@ -779,6 +1214,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.charging_process_list_formatted:
             self.update_positions_laps_forecast()
         return self.charging_process_list_formatted
@@ -789,6 +1225,7 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.forecast_raw:
             self.update_positions_laps_forecast()
         return self.forecast_raw
@@ -799,108 +1236,203 @@ class DataProcessor(BaseModel):
         :return: retrieved data
         """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.forecast_formatted:
             self.update_positions_laps_forecast()
         return self.forecast_formatted
 
-    # TODO add charging in better way
-    def get_car_chargings(self, lap_id: int):
+    def get_lap_graph_data(self, lap_index: int, field: str, points: int, method: str) -> bytes:
+        """
+        get the field of the lap positions downsampled for charts (see graph_data)
+        :param lap_index: index of the lap in the lap list (-1 for the recent one)
+        :param field: field to show
+        :param points: max number of points
+        :param method: downsampling method
+        :return: serialized labels and values
+        """
+        from src import configuration
+        lap = self.get_laps_raw()[lap_index]
+        lap_data: PositionStore = lap['lap_data']
+        key = (self._get_lap_summary_hash(configuration), lap['lap_id'], lap.get('split_signature'), len(lap_data))
+        return graph_data_cache.get_series(key, lap_data, field, points, method)
 
+    def get_car_chargings(self, lap_id: int) -> List[Dict[str, Any]]:
+        """
+        get charging processes of the lap pit stop with their charges (cached, see charging_details)
+        :param lap_id: index of the lap in the lap list
+        :return: charging processes, each one with list of charges added (key charges)
+        """
         from src import configuration
+        self._sync_snapshot()
         if not configuration.update_run_background or not self.lap_list_raw:
             self.update_positions_laps_forecast()
 
         lap = self.lap_list_raw[lap_id]
-        pit_start = lap['pit_start_time']
-        pit_end = lap['pit_end_time']
-        from src import configuration  # imports global configuration
-        return src.data_source.teslamate.get_car_chargings(configuration.car_id, pit_start, pit_end)
+        pit_start = lap.get('pit_start_time')
+        pit_end = lap.get('pit_end_time')
+        if not pit_start or not pit_end:
+            return []
+        return [{**charging_process, 'charges': charging_detail_cache.get(charging_process)}
+                for charging_process in self._get_charging_processes(configuration, pit_start, pit_end)]
+
+    def _get_charging_processes(self, configuration: Configuration, dt_from: pendulum.DateTime,
+                                dt_to: pendulum.DateTime) -> List[Dict[str, Any]]:
+        """
+        Get charging processes overlapping the time window. The live ones are used if they cover the window (loaded
+        for the current configuration together with the positions covering it), database is queried otherwise
+        """
+        if self.charging_process_list_raw is None or self._get_cached_positions_until(configuration, dt_to) is None:
+            return src.data_source.teslamate.get_car_charging_processes(configuration.car_id, dt_from, dt_to)
+        return [charging_process for charging_process in self.charging_process_list_raw
+                if charging_process['start_date'] <= dt_to
+                and (charging_process['end_date'] is None or charging_process['end_date'] >= dt_from)]
+
+    def prefetch_charging_details(self):
+        """
+        cache charges of the charging processes closed meanwhile. May be called from background job
+        """
+        charging_detail_cache.prefetch(self.charging_process_list_raw or [])
 
     ################################
     # static snapshot for datetime #
     ################################
 
-    @function_timer()
+    def _get_cached_positions_until(self, configuration: Configuration,
+                                    dt_end: pendulum.DateTime) -> Optional[PositionStore]:
+        """
+        Get the live positions up to the time (view, no copy), found by bisect on dates
+        :return: the positions or None if the live data don't cover the time (or are loaded for other config)
+        """
+        race_end = configuration.start_time.add(hours=configuration.hours)
+        positions = self.car_positions_raw
+        if not positions or self.car_positions_key != self._get_positions_key(configuration, race_end):
+            return None
+        dates = positions.column('date')
+        ts = int(dt_end.timestamp() * 1_000_000)
+        if ts > dates[-1]:
+            return None  # positions stored since the last update are not in the live data
+        return positions[:int(np.searchsorted(dates, ts, side='right'))]
+
+    def _get_cached_charging_processes_until(self, dt_end: pendulum.DateTime) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get copies of the live charging processes started before the time
+        :return: the charging processes or None if one of them was running at the time (its values are final ones)
+        """
+        charging_processes = []
+        for charging_process in self.charging_process_list_raw or []:
+            if charging_process['start_date'] > dt_end:
+                continue
+            if charging_process['end_date'] is None or charging_process['end_date'] > dt_end:
+                return None
+            charging_processes.append(dict(charging_process))
+        return charging_processes
+
     def get_static_snapshot(self, dt_end: pendulum.DateTime) -> JsonStaticSnapshot:
         """
-        Get system snapshot for specific date and time
+        Get system snapshot for specific date and time (cached, the time is rounded down to the granularity)
+        :param dt_end:
+        :return:
+        """
+        from src import configuration
+        self._sync_snapshot()
+        granularity = max(configuration.time_machine_granularity_seconds, 1)
+        dt_end = pendulum.from_timestamp(dt_end.int_timestamp // granularity * granularity, tz='utc')
+
+        # the data of the time are final if the live data cover it and no charging was running at the time
+        if self._get_cached_positions_until(configuration, dt_end) is not None \
+                and self._get_cached_charging_processes_until(dt_end) is not None:
+            data_version = IMMUTABLE_VERSION
+        else:
+            data_version = pendulum.now(tz='utc').int_timestamp // max(configuration.update_laps_seconds, 1) + 1
+        key = SnapshotKey(self._get_config_key(configuration), data_version, dt_end.int_timestamp)
+        snapshot = snapshot_cache.get(key)
+        if snapshot is None:
+            snapshot = self._build_static_snapshot(dt_end)
+            snapshot_cache.put(key, snapshot, configuration.time_machine_cache_mb * 1024 * 1024,
+                               live_positions=self.car_positions_raw)
+        return snapshot
+
+    @function_timer()
+    def _build_static_snapshot(self, dt_end: pendulum.DateTime) -> JsonStaticSnapshot:
+        """
+        Create system snapshot for specific date and time.
+        The live data are truncated at the time if they cover it (the database is used otherwise),
+        the data groups are created in one pass, ordered by their dependencies (see field_dependencies),
+        cycles of the groups are evaluated twice.
         :param dt_end:
         :return:
         """
         from src import configuration
         snapshot = JsonStaticSnapshot()
-        snapshot.initial_status_raw = self._update_initial_status(configuration.car_id, configuration.start_time)
-        for i in range(2):  # repeat twice in case there are dependent fields
-            snapshot.current_status_raw = self._load_status_raw(
-                configuration.car_id, dt_end,
-                initial_status=snapshot.initial_status_raw,
-                _current_status=snapshot.current_status_raw,
-                position_list=snapshot.car_positions_raw,
-                lap_list=snapshot.lap_list_raw,
-                total=snapshot.total_raw,
-                charging_process_list=snapshot.charging_process_list_raw,
-                forecast=snapshot.forecast_raw,
-                configuration=configuration,
-                )
-            snapshot.car_positions_raw = self._load_positions(
-                configuration.car_id, configuration.start_time, dt_end,
-                initial_status=snapshot.initial_status_raw,
-                current_status=snapshot.current_status_raw,
-                _position_list=snapshot.car_positions_raw,
-                lap_list=snapshot.lap_list_raw,
-                total=snapshot.total_raw,
-                charging_process_list=snapshot.charging_process_list_raw,
-                forecast=snapshot.forecast_raw,
-                configuration=configuration,
-                )
-
-            snapshot.lap_list_raw = self._load_laps(
-                snapshot.car_positions_raw, dt_end,
-                initial_status=snapshot.initial_status_raw,
-                current_status=snapshot.current_status_raw,
-                position_list=snapshot.car_positions_raw,
-                _lap_list=snapshot.lap_list_raw,
-                total=snapshot.total_raw,
-                charging_process_list=snapshot.charging_process_list_raw,
-                forecast=snapshot.forecast_raw,
-                configuration=configuration,
-                )
-
-            snapshot.charging_process_list_raw = self._load_charging_processes(
-                configuration.car_id, configuration.start_time, dt_end,
-                initial_status=snapshot.initial_status_raw,
-                current_status=snapshot.current_status_raw,
-                position_list=snapshot.car_positions_raw,
-                lap_list=snapshot.lap_list_raw,
-                total=snapshot.total_raw,
-                _charging_process_list=snapshot.charging_process_list_raw,
-                forecast=snapshot.forecast_raw,
-                configuration=configuration,
-                )
-
-            snapshot.total_raw = self._load_total(
-                dt_end,
-                initial_status=snapshot.initial_status_raw,
-                current_status=snapshot.current_status_raw,
-                position_list=snapshot.car_positions_raw,
-                lap_list=snapshot.lap_list_raw,
-                _total=snapshot.total_raw,
-                charging_process_list=snapshot.charging_process_list_raw,
-                forecast=snapshot.forecast_raw,
-                configuration=configuration,
-                )
-
-            snapshot.forecast_raw = self._load_forecast(
-                dt_end,
-                initial_status=snapshot.initial_status_raw,
-                current_status=snapshot.current_status_raw,
-                position_list=snapshot.car_positions_raw,
-                lap_list=snapshot.lap_list_raw,
-                total=snapshot.total_raw,
-                charging_process_list=snapshot.charging_process_list_raw,
-                _forecast=snapshot.forecast_raw,
-                configuration=configuration,
-                )
+        race_end = configuration.start_time.add(hours=configuration.hours)
+        positions_key = self._get_positions_key(configuration, race_end)
+        lap_detector = None
+
+        positions = self._get_cached_positions_until(configuration, dt_end)
+        charging_processes = self._get_cached_charging_processes_until(dt_end) if positions is not None else None
+        if positions is not None:
+            snapshot.initial_status_raw = self.initial_status_raw
+        else:
+            logger.info(f"{dt_end} not covered by live data, loading from database")
+            snapshot.initial_status_raw = self._update_initial_status(configuration.car_id, configuration.start_time)
+
+        def load_positions(reload: bool, recalculate: bool) -> bool:
+            nonlocal lap_detector
+            # new detector for every load (the positions may be loaded again, if they are in a cycle)
+            lap_detector = lap_analyzer.LapDetector(key=positions_key, region=configuration.start_radius,
+                                                    min_time=0, start_idx=0, distance_mode=configuration.distance_mode)
+            snapshot.car_positions_raw = positions if positions is not None else self._load_positions(
+                configuration.car_id, configuration.start_time, dt_end, **self._get_inputs(snapshot, 'positions'),
+                configuration=configuration, lap_detector=lap_detector)
+            return True
+
+        def load_laps(reload: bool, recalculate: bool) -> bool:
+            snapshot.lap_list_raw = self._load_laps(snapshot.car_positions_raw, dt_end,
+                                                    **self._get_inputs(snapshot, 'laps'),
+                                                    configuration=configuration, lap_detector=lap_detector)
+            return True
+
+        def load_charging(reload: bool, recalculate: bool) -> bool:
+            if charging_processes is not None:
+                snapshot.charging_process_list_raw = self._enhance_charging_processes(
+                    charging_processes, dt_end, **self._get_inputs(snapshot, 'charging'),
+                    configuration=configuration)
+            else:
+                snapshot.charging_process_list_raw = self._load_charging_processes(
+                    configuration.car_id, configuration.start_time, dt_end, **self._get_inputs(snapshot, 'charging'),
+                    configuration=configuration)
+            return True
+
+        def load_status(reload: bool, recalculate: bool) -> bool:
+            snapshot.current_status_raw = self._load_status_raw(configuration.car_id, dt_end,
+                                                                **self._get_inputs(snapshot, 'status'),
+                                                                configuration=configuration)
+            return True
+
+        def load_total(reload: bool, recalculate: bool) -> bool:
+            snapshot.total_raw = self._load_total(dt_end, **self._get_inputs(snapshot, 'total'),
+                                                  configuration=configuration)
+            return True
+
+        def load_forecast(reload: bool, recalculate: bool) -> bool:
+            snapshot.forecast_raw = self._load_forecast(dt_end, **self._get_inputs(snapshot, 'forecast'),
+                                                        configuration=configuration)
+            return True
+
+        loaders = {
+            'positions': load_positions,
+            'laps': load_laps,
+            'charging': load_charging,
+            'status': load_status,
+            'total': load_total,
+            'forecast': load_forecast,
+        }
+        self._evaluate_groups(loaders, set(GROUPS))
+        cyclic = group_dependencies.get_cyclic()
+        if cyclic:
+            # the first group of a cycle has read the others not evaluated yet (no previous update for snapshot),
+            # evaluate the cycles again, along with the groups reading them
+            self._evaluate_groups(loaders, set(), stale=cyclic)
 
         snapshot.current_status_formatted = self._load_status_formatted(snapshot.current_status_raw,
                                                                         snapshot.total_raw,
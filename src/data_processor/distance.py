@@ -0,0 +1,97 @@
+"""
+Vectorized distance calculations. Distances of many positions to single point (i.e. the start) are calculated
+in one batch using numpy instead of calling geopy for every position.
+"""
+from typing import Tuple, Optional, Sequence, Union
+import numpy as np
+
+from src.enums import DistanceModeEnum
+
+EARTH_RADIUS_KM = 6371.009  # mean earth radius (the same geopy uses for great circle)
+
+# WGS-84 ellipsoid (the same geopy uses for geodesic)
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B_KM = (1 - WGS84_F) * WGS84_A_KM
+
+_VINCENTY_MAX_ITERATIONS = 200
+_VINCENTY_TOLERANCE = 1e-12
+
+ArrayLike = Union[Sequence[Optional[float]], np.ndarray]
+
+
+def _haversine(lat: np.ndarray, lon: np.ndarray, point_lat: float, point_lon: float) -> np.ndarray:
+    """ great circle distance on sphere (fast, ~0.5% error) """
+    d_lat = lat - point_lat
+    d_lon = lon - point_lon
+    a = np.sin(d_lat / 2) ** 2 + np.cos(lat) * np.cos(point_lat) * np.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _vincenty(lat: np.ndarray, lon: np.ndarray, point_lat: float, point_lon: float) -> np.ndarray:
+    """
+    Inverse Vincenty formula on WGS-84 ellipsoid, all the points are iterated at once.
+    It matches geopy geodesic to less than mm for anything but (nearly) antipodal points.
+    """
+    a, b, f = WGS84_A_KM, WGS84_B_KM, WGS84_F
+    l_diff = lon - point_lon
+    u1 = np.arctan((1 - f) * np.tan(point_lat))
+    u2 = np.arctan((1 - f) * np.tan(lat))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = l_diff
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(_VINCENTY_MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = l_diff + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            if not np.any(np.abs(lam - lam_prev) > _VINCENTY_TOLERANCE):  # NaN (missing position) is ignored
+                break
+
+        u_sq = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        return b * big_a * (sigma - delta_sigma)
+
+
+def distances_to_point(latitudes: ArrayLike, longitudes: ArrayLike, point: Tuple[float, float],
+                       mode: str = DistanceModeEnum.ELLIPSOIDAL.value) -> np.ndarray:
+    """
+    Calculate distances of all the positions to the point in one batch
+    :param latitudes: latitudes of the positions (degrees), None is allowed for missing values
+    :param longitudes: longitudes of the positions (degrees), None is allowed for missing values
+    :param point: (latitude, longitude) of the point to measure distance to (i.e. start)
+    :param mode: DistanceModeEnum value (haversine is faster, ellipsoidal is exact)
+    :return: array of distances in km (NaN for missing positions)
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    point_lat, point_lon = np.radians(point[0]), np.radians(point[1])
+    if mode == DistanceModeEnum.HAVERSINE.value:
+        return _haversine(lat, lon, point_lat, point_lon)
+    elif mode == DistanceModeEnum.ELLIPSOIDAL.value:
+        return _vincenty(lat, lon, point_lat, point_lon)
+    raise ValueError(f"unknown distance mode: {mode}")
+
+
+def distance_to_point(latitude: Optional[float], longitude: Optional[float], point: Tuple[float, float],
+                      mode: str = DistanceModeEnum.ELLIPSOIDAL.value) -> Optional[float]:
+    """
+    Distance of single position to the point
+    :return: distance in km or None if the position is not known
+    """
+    if latitude is None or longitude is None:
+        return None
+    return float(distances_to_point([latitude], [longitude], point, mode)[0])
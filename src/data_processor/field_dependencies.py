@@ -0,0 +1,169 @@
+"""
+Dependencies between the data groups (positions, laps, charging processes, status, total, forecast).
+Calculated fields of a group read other groups (i.e. the status reads lap_list to get the lap number), so a group
+has to be evaluated after the groups it reads and again whenever one of them changes.
+The inputs are declared by the hardcoded calculated fields (USED_INPUTS) and found in the code of the database
+calculated fields (names of the variables used). Besides that, some groups are built from others by their loaders:
+laps are found in positions and forecast is built on total and laps.
+Groups reading now_dt depend on time, their values change even if the data they read haven't changed.
+The dependencies are evaluated once per configuration version. Cycles (i.e. position field reading lap_list) can't
+be ordered, they are broken in the default order (the first group of the cycle reads values of the previous update).
+There is no previous update for a snapshot, so the groups of cycles are evaluated twice there (see get_cyclic).
+"""
+import threading
+from typing import Dict, Set, List, Tuple, Optional
+
+import src.data_processor.calculated_fields_positions
+import src.data_processor.calculated_fields_laps
+import src.data_processor.calculated_fields_charges
+import src.data_processor.calculated_fields_status
+import src.data_processor.calculated_fields_total
+import src.data_processor.calculated_fields_forecast
+from src.config_cache import config_cache
+from src.enums import CalculatedFieldScopeEnum
+from src.utils import get_names
+
+import logging
+logger = logging.getLogger(__name__)
+
+INITIAL_GROUP = 'initial'  # initial status, loaded once at the start, never evaluated again
+TIME_INPUT = 'now_dt'  # input of the calculated fields making the group time dependent
+# groups evaluated by the updates, in default order (used if there are no dependencies between the groups)
+GROUPS = ('positions', 'laps', 'charging', 'status', 'total', 'forecast')
+# inputs of the calculated fields -> data group
+INPUT_GROUPS = {
+    'initial_status': INITIAL_GROUP,
+    'current_status': 'status',
+    'position_list': 'positions',
+    'lap_list': 'laps',
+    'total': 'total',
+    'charging_process_list': 'charging',
+    'forecast': 'forecast',
+}
+GROUP_INPUTS = {group: name for name, group in INPUT_GROUPS.items()}
+
+_HARDCODED_INPUTS = {
+    'positions': src.data_processor.calculated_fields_positions.USED_INPUTS,
+    'laps': src.data_processor.calculated_fields_laps.USED_INPUTS,
+    'charging': src.data_processor.calculated_fields_charges.USED_INPUTS,
+    'status': src.data_processor.calculated_fields_status.USED_INPUTS,
+    'total': src.data_processor.calculated_fields_total.USED_INPUTS,
+    'forecast': src.data_processor.calculated_fields_forecast.USED_INPUTS,
+}
+# scopes of the database calculated fields evaluated for the group (see DataProcessor._enhance_*)
+_DB_FIELD_SCOPES = {
+    'positions': CalculatedFieldScopeEnum.POSITION,
+    'laps': CalculatedFieldScopeEnum.POSITION,
+    'charging': CalculatedFieldScopeEnum.POSITION,
+    'status': CalculatedFieldScopeEnum.STATUS,
+    'total': CalculatedFieldScopeEnum.TOTAL,
+    'forecast': CalculatedFieldScopeEnum.FORECAST,
+}
+# groups the loaders build the group from
+_LOADER_INPUTS = {
+    'laps': {'positions'},
+    'forecast': {'laps', 'total'},
+}
+
+
+class GroupDependencies:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # configuration version -> (group -> names it reads, group -> groups it depends on, evaluation order,
+        # groups in cycles)
+        self._cached: Optional[Tuple[int, Dict[str, Set[str]], Dict[str, Set[str]], List[str], Set[str]]] = None
+
+    @classmethod
+    def _find_inputs(cls) -> Dict[str, Set[str]]:
+        inputs = {}
+        for group in GROUPS:
+            inputs[group] = set(_HARDCODED_INPUTS[group])
+            for field in config_cache.get_calculated_fields(_DB_FIELD_SCOPES[group].value):
+                inputs[group] |= get_names(field.calc_fn)
+        return inputs
+
+    @classmethod
+    def _find_dependencies(cls, inputs: Dict[str, Set[str]]) -> Dict[str, Set[str]]:
+        dependencies = {}
+        for group in GROUPS:
+            groups = {INPUT_GROUPS[name] for name in inputs[group] if name in INPUT_GROUPS}
+            dependencies[group] = (groups | _LOADER_INPUTS.get(group, set())) - {group, INITIAL_GROUP}
+        return dependencies
+
+    @classmethod
+    def _sort(cls, dependencies: Dict[str, Set[str]]) -> List[str]:
+        """
+        Topological sort of the groups, the default order is kept where there is no dependency
+        """
+        order = []
+        remaining = list(GROUPS)
+        while remaining:
+            ready = [group for group in remaining if not dependencies[group] - set(order)]
+            if not ready:
+                # cycle, break it in default order
+                logger.warning(f"cyclic dependencies of calculated fields between {remaining}, "
+                               f"{remaining[0]} reads values of the previous update")
+                ready = remaining
+            order.append(ready[0])
+            remaining.remove(ready[0])
+        return order
+
+    @classmethod
+    def _find_cyclic(cls, dependencies: Dict[str, Set[str]]) -> Set[str]:
+        """
+        Groups depending on themselves (through other groups), i.e. the strongly connected components of more groups
+        """
+        cyclic = set()
+        for group in GROUPS:
+            reachable = set()
+            pending = list(dependencies[group])
+            while pending:
+                dependency = pending.pop()
+                if dependency not in reachable:
+                    reachable.add(dependency)
+                    pending.extend(dependencies.get(dependency, ()))
+            if group in reachable:
+                cyclic.add(group)
+        return cyclic
+
+    def _get_data(self) -> Tuple[Dict[str, Set[str]], Dict[str, Set[str]], List[str], Set[str]]:
+        version = config_cache.version
+        cached = self._cached
+        if cached and cached[0] == version:
+            return cached[1:]
+        with self._lock:
+            inputs = self._find_inputs()
+            dependencies = self._find_dependencies(inputs)
+            order = self._sort(dependencies)
+            cyclic = self._find_cyclic(dependencies)
+            self._cached = (version, inputs, dependencies, order, cyclic)
+        logger.info(f"data groups evaluated in order {order}, dependencies {dependencies}")
+        return inputs, dependencies, order, cyclic
+
+    def get_dependencies(self) -> Dict[str, Set[str]]:
+        """
+        :return: group -> groups it reads
+        """
+        return self._get_data()[1]
+
+    def get_order(self) -> List[str]:
+        """
+        :return: groups in order to be evaluated
+        """
+        return self._get_data()[2]
+
+    def get_time_dependent(self) -> Set[str]:
+        """
+        :return: groups reading the time (now_dt)
+        """
+        return {group for group, names in self._get_data()[0].items() if TIME_INPUT in names}
+
+    def get_cyclic(self) -> Set[str]:
+        """
+        :return: groups in cycles (the first of them is evaluated before the others it reads)
+        """
+        return self._get_data()[3]
+
+
+# let's have just one singleton to be used
+group_dependencies = GroupDependencies()
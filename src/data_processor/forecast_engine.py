@@ -0,0 +1,165 @@
+"""
+Forecast of the race distance calculated on arrays of floats (seconds, km). The finished laps are converted
+to arrays once and all the models are evaluated in one batch, pendulum durations are created by the caller
+just for the labels.
+Model is an estimate of lap time, pit time and lap distance for the rest of the race:
+- mean: average of the laps
+- trimmed: average without the extreme laps (TRIM_FRACTION of the shortest and the longest ones)
+- ewma: exponentially weighted average, the recent laps weigh more (EWMA_ALPHA)
+- best: the lap with the best full average speed (lap and pit)
+- trend: lap time of the next lap by linear trend of the lap times (pit time and distance by mean)
+The unfinished lap is completed by the mean model for all of them, so the models differ just by the pace of
+the laps to come.
+Missing values of the laps (i.e. lap without distance) are NaN and left out of the estimates.
+"""
+from typing import List, Dict, Any, NamedTuple, Optional
+
+import numpy as np
+
+MODEL_MEAN = 'mean'
+MODEL_TRIMMED = 'trimmed'
+MODEL_EWMA = 'ewma'
+MODEL_BEST = 'best'
+MODEL_TREND = 'trend'
+MODELS = (MODEL_MEAN, MODEL_TRIMMED, MODEL_EWMA, MODEL_BEST, MODEL_TREND)
+
+TRIM_FRACTION = 0.1  # of the laps cut off on both sides by trimmed mean
+EWMA_ALPHA = 0.3  # weight of the last lap
+
+
+class LapArrays(NamedTuple):
+    """ finished laps as arrays (NaN for missing values) """
+    lap_ids: List[Any]
+    lap_time: np.ndarray  # seconds
+    pit_time: np.ndarray  # seconds
+    distance: np.ndarray  # km
+    full_avg_speed: np.ndarray  # km/h
+
+
+class RaceForecast(NamedTuple):
+    """ the arrays are indexed by model (see MODELS) """
+    lap_time: np.ndarray
+    pit_time: np.ndarray
+    lap_distance: np.ndarray
+    full_laps_remaining: np.ndarray
+    last_lap_coef: np.ndarray  # part of the last (not full) lap driven till the end
+    estimated_distance: np.ndarray
+    unfinished_lap_remaining_time: float
+    unfinished_lap_remaining_distance: float
+    best_lap_id: Optional[Any]
+
+
+def to_seconds(duration, missing: float = 0.0) -> float:
+    return duration.total_seconds() if duration is not None else missing
+
+
+def to_float(value, missing: float = 0.0) -> float:
+    return float(value) if value is not None else missing
+
+
+def get_lap_arrays(laps: List[Dict[str, Any]]) -> LapArrays:
+    """
+    Convert laps (with calculated fields) to arrays
+    :param laps: finished laps
+    :return: the arrays
+    """
+    return LapArrays(
+        lap_ids=[lap['lap_id'] for lap in laps],
+        lap_time=np.array([to_seconds(lap.get('lap_duration'), np.nan) for lap in laps], dtype=np.float64),
+        pit_time=np.array([to_seconds(lap.get('pit_duration'), np.nan) for lap in laps], dtype=np.float64),
+        distance=np.array([to_float(lap.get('distance'), np.nan) for lap in laps], dtype=np.float64),
+        full_avg_speed=np.array([to_float(lap.get('full_avg_speed'), np.nan) for lap in laps], dtype=np.float64),
+    )
+
+
+def _nanmean(values: np.ndarray) -> np.ndarray:
+    """ mean by rows without NaN (NaN if there is no value), without the warning np.nanmean gives """
+    counts = np.count_nonzero(~np.isnan(values), axis=1)
+    return np.where(counts > 0, np.nansum(values, axis=1) / np.maximum(counts, 1), np.nan)
+
+
+def _trimmed_mean(values: np.ndarray) -> np.ndarray:
+    result = np.full(values.shape[0], np.nan)
+    for i, row in enumerate(values):
+        row = np.sort(row[~np.isnan(row)])
+        cut = int(len(row) * TRIM_FRACTION)
+        if len(row):
+            result[i] = row[cut:len(row) - cut].mean()
+    return result
+
+
+def _ewma(values: np.ndarray) -> np.ndarray:
+    weights = (1 - EWMA_ALPHA) ** np.arange(values.shape[1] - 1, -1, -1) * ~np.isnan(values)
+    sums = weights.sum(axis=1)
+    return np.where(sums > 0, (np.nan_to_num(values) * weights).sum(axis=1) / np.where(sums > 0, sums, 1.0), np.nan)
+
+
+def _estimate_models(laps: LapArrays, time_since_start: float) -> np.ndarray:
+    """
+    :return: array models x (lap time, pit time, lap distance)
+    """
+    values = np.vstack((laps.lap_time, laps.pit_time, laps.distance))
+    estimates = np.empty((len(MODELS), 3))
+    mean = _nanmean(values)
+    estimates[MODELS.index(MODEL_MEAN)] = mean
+    estimates[MODELS.index(MODEL_TRIMMED)] = _trimmed_mean(values)
+    estimates[MODELS.index(MODEL_EWMA)] = _ewma(values)
+
+    speeds = np.nan_to_num(laps.full_avg_speed, nan=0.0)
+    if speeds.max() > 0:
+        best = values[:, int(np.argmax(speeds))]  # the first one of the best
+        estimates[MODELS.index(MODEL_BEST)] = np.where(np.isnan(best), mean, best)
+    else:
+        estimates[MODELS.index(MODEL_BEST)] = (time_since_start, 0.0, 0.0)
+
+    trend = mean.copy()
+    valid = ~np.isnan(laps.lap_time)
+    count = len(laps.lap_time)
+    if np.count_nonzero(valid) > 1:
+        slope, intercept = np.polyfit(np.arange(count)[valid], laps.lap_time[valid], 1)
+        next_lap_time = intercept + slope * count
+        if next_lap_time > 0:
+            trend[0] = next_lap_time
+    estimates[MODELS.index(MODEL_TREND)] = trend
+    return np.nan_to_num(estimates, nan=0.0)  # no value at all (i.e. no lap with distance)
+
+
+def forecast_race(laps: LapArrays, unfinished_lap_time: Optional[float], unfinished_lap_distance: Optional[float],
+                  time_since_start: float, time_to_end: float, distance_since_start: float) -> RaceForecast:
+    """
+    Forecast the race distance by all the models
+    :param laps: finished laps (at least one)
+    :param unfinished_lap_time: driving time of the unfinished lap so far (None if there is no unfinished lap)
+    :param unfinished_lap_distance: distance of the unfinished lap so far (None if there is no unfinished lap)
+    :param time_since_start: seconds since the race start
+    :param time_to_end: seconds to the race end
+    :param distance_since_start: distance driven so far
+    :return: the forecast
+    """
+    estimates = _estimate_models(laps, time_since_start)
+    lap_time, pit_time, lap_distance = estimates[:, 0], estimates[:, 1], estimates[:, 2]
+    mean_lap_time, _, mean_lap_distance = estimates[MODELS.index(MODEL_MEAN)]
+
+    unfinished_lap_remaining_time = max(mean_lap_time - unfinished_lap_time, 0.0) \
+        if unfinished_lap_time is not None else 0.0
+    unfinished_lap_remaining_distance = max(mean_lap_distance - unfinished_lap_distance, 0.0) \
+        if unfinished_lap_distance is not None else 0.0
+    time_to_forecast = time_to_end - unfinished_lap_remaining_time
+
+    full_time = lap_time + pit_time
+    valid = full_time > 0
+    safe_full_time = np.where(valid, full_time, 1.0)
+    full_laps_remaining = np.where(valid, np.trunc(time_to_forecast / safe_full_time), 0.0)
+    # time left after max possible full laps
+    last_lap_coef = np.where(valid, (time_to_forecast - full_laps_remaining * full_time) / safe_full_time, 0.0)
+    estimated_distance = distance_since_start + unfinished_lap_remaining_distance \
+        + (full_laps_remaining + last_lap_coef) * lap_distance
+
+    speeds = np.nan_to_num(laps.full_avg_speed, nan=0.0)
+    best_lap_id = laps.lap_ids[int(np.argmax(speeds))] if speeds.max() > 0 else None
+    return RaceForecast(lap_time=lap_time, pit_time=pit_time, lap_distance=lap_distance,
+                        full_laps_remaining=full_laps_remaining.astype(np.int64), last_lap_coef=last_lap_coef,
+                        estimated_distance=estimated_distance,
+                        unfinished_lap_remaining_time=unfinished_lap_remaining_time,
+                        unfinished_lap_remaining_distance=unfinished_lap_remaining_distance,
+                        best_lap_id=best_lap_id)
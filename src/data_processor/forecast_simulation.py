@@ -0,0 +1,222 @@
+"""
+Monte Carlo forecast of the race distance. The rest of the race is simulated by laps (lap and pit together)
+drawn randomly from the finished laps, the distances reached at the end give percentiles of the estimate.
+The simulated runs are stored as cumulative times and distances, so they are generated just once for the set
+of finished laps (until a new lap finishes) and only evaluated for the remaining time by every refresh.
+The runs are generated in chunks until the time budget is used up, optionally by a pool of processes
+(spawned, not forked, as the refresher runs in threads).
+Just two simulations are kept (bounded by bytes): the live one (asked for by the refresher, see live) and the last
+other one (time machine). The simulation runs out of the cache lock, so the live refresh never waits for
+a time machine simulation (those run one at a time).
+The pool processes are started by the python interpreter explicitly, as sys.executable is not python when
+the application is embedded (i.e. it's the uwsgi binary).
+"""
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict, Tuple, Optional, NamedTuple, Hashable, List
+
+import numpy as np
+
+from src.data_processor.forecast_engine import LapArrays
+from src.utils import function_timer
+
+import logging
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (10, 50, 90)
+CHUNK_RUNS = 250  # runs generated at once (by one process)
+MAX_SIMULATION_BYTES = 32 * 1024 * 1024  # memory limit of one simulation (runs are cut to fit)
+_VALUE_BYTES = 8  # cumulative time and distance (float32) of a simulated lap
+
+
+def _get_python_executable() -> Optional[str]:
+    """ python interpreter to spawn the pool processes by (None if not found) """
+    if os.path.basename(sys.executable).startswith('python'):
+        return sys.executable
+    names = (f"python{sys.version_info.major}.{sys.version_info.minor}", f"python{sys.version_info.major}", "python")
+    for name in names:
+        path = os.path.join(sys.exec_prefix, 'bin', name)  # the virtualenv (or installation) the app runs in
+        if os.access(path, os.X_OK):
+            return path
+    for name in names:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+class SimulatedRuns(NamedTuple):
+    cumulative_time: np.ndarray  # runs x laps, seconds since the simulation start
+    cumulative_distance: np.ndarray  # runs x laps
+    horizon: float  # seconds covered by all the runs
+
+
+def simulate_runs(full_time: np.ndarray, distance: np.ndarray, runs: int, laps: int,
+                  seed: np.random.SeedSequence) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Simulate the runs by laps drawn from the finished ones (to be run in pool process as well)
+    :param full_time: lap and pit time of the finished laps
+    :param distance: distance of the finished laps
+    :param runs: number of runs
+    :param laps: number of laps of every run
+    :param seed: random seed of the chunk
+    :return: cumulative times and distances (runs x laps)
+    """
+    rng = np.random.default_rng(seed)
+    drawn = rng.integers(0, len(full_time), size=(runs, laps))
+    return np.cumsum(full_time[drawn], axis=1, dtype=np.float32), np.cumsum(distance[drawn], axis=1, dtype=np.float32)
+
+
+def get_distances(simulated: SimulatedRuns, time_to_forecast: float) -> np.ndarray:
+    """
+    Distance reached by every run in the time, the last lap is counted by the part of its time driven
+    :param simulated: the runs
+    :param time_to_forecast: seconds (not more than the horizon)
+    :return: distance by run
+    """
+    cumulative_time, cumulative_distance = simulated.cumulative_time, simulated.cumulative_distance
+    rows = np.arange(cumulative_time.shape[0])
+    full_laps = np.minimum((cumulative_time <= time_to_forecast).sum(axis=1), cumulative_time.shape[1] - 1)
+    previous = full_laps - 1
+    previous_time = np.where(previous >= 0, cumulative_time[rows, previous], 0.0)
+    previous_distance = np.where(previous >= 0, cumulative_distance[rows, previous], 0.0)
+    lap_time = cumulative_time[rows, full_laps] - previous_time
+    lap_distance = cumulative_distance[rows, full_laps] - previous_distance
+    coef = np.where(lap_time > 0, (time_to_forecast - previous_time) / np.where(lap_time > 0, lap_time, 1.0), 0.0)
+    return previous_distance + np.clip(coef, 0.0, 1.0) * lap_distance
+
+
+class ForecastSimulator:
+    def __init__(self):
+        self._lock = threading.Lock()  # cache and pool, never held while simulating
+        self._other_lock = threading.Lock()  # one not live simulation at a time
+        self._local = threading.local()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_processes = 0
+        self._live: Optional[Tuple[Hashable, SimulatedRuns]] = None
+        self._other: Optional[Tuple[Hashable, SimulatedRuns]] = None
+
+    @contextmanager
+    def live(self):
+        """ the simulations asked for by the thread in the block are the live ones """
+        self._local.live = True
+        try:
+            yield
+        finally:
+            self._local.live = False
+
+    def _get_pool(self, processes: int) -> Optional[ProcessPoolExecutor]:
+        """ the pool of the processes (None if it can't be started, simulated in the calling thread then) """
+        with self._lock:
+            if self._pool is None or self._pool_processes != processes:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                executable = _get_python_executable()
+                if executable is None:
+                    logger.warning("python interpreter not found, forecast simulation runs without process pool")
+                    return None
+                context = multiprocessing.get_context('spawn')
+                context.set_executable(executable)
+                self._pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+                self._pool_processes = processes
+            return self._pool
+
+    @function_timer()
+    def _simulate(self, full_time: np.ndarray, distance: np.ndarray, time_to_forecast: float, runs: int,
+                  budget_seconds: float, processes: int) -> Optional[SimulatedRuns]:
+        shortest = full_time[full_time > 0].min(initial=np.inf)
+        if not np.isfinite(shortest):
+            return None
+        laps = max(math.ceil(time_to_forecast / shortest) + 1, 1)
+        runs = min(runs, max(MAX_SIMULATION_BYTES // (laps * _VALUE_BYTES), 1))
+        chunk_runs = [min(CHUNK_RUNS, runs - start) for start in range(0, runs, CHUNK_RUNS)]
+        seeds = np.random.SeedSequence().spawn(len(chunk_runs))
+        deadline = time.monotonic() + budget_seconds
+
+        chunks: List[Tuple[np.ndarray, np.ndarray]] = []
+        pool = self._get_pool(processes) if processes > 0 else None
+        if pool is not None:
+            futures = [pool.submit(simulate_runs, full_time, distance, count, laps, seed)
+                       for count, seed in zip(chunk_runs, seeds)]
+            done, not_done = wait(futures, timeout=budget_seconds)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                if future.exception() is not None:
+                    logger.error(f"forecast simulation failed: {future.exception()}")
+                else:
+                    chunks.append(future.result())
+        else:
+            for count, seed in zip(chunk_runs, seeds):
+                chunks.append(simulate_runs(full_time, distance, count, laps, seed))
+                if time.monotonic() > deadline:
+                    break
+        if not chunks:  # the pool hasn't made it in time (i.e. still starting), at least one chunk
+            chunks.append(simulate_runs(full_time, distance, chunk_runs[0], laps, seeds[0]))
+        if sum(len(chunk[0]) for chunk in chunks) < runs:
+            logger.info(f"forecast simulation cut by time budget to {sum(len(chunk[0]) for chunk in chunks)} runs")
+        return SimulatedRuns(cumulative_time=np.concatenate([chunk[0] for chunk in chunks]),
+                             cumulative_distance=np.concatenate([chunk[1] for chunk in chunks]),
+                             horizon=time_to_forecast)
+
+    def get_percentiles(self, laps: LapArrays, time_to_forecast: float, runs: int, budget_seconds: float,
+                        processes: int) -> Optional[Tuple[int, Dict[int, float]]]:
+        """
+        Get percentiles of the distance driven in the time by laps like the finished ones. The runs are simulated
+        just if not simulated yet for the laps (or for shorter time)
+        :param laps: the finished laps
+        :param time_to_forecast: seconds to simulate
+        :param runs: number of runs wanted
+        :param budget_seconds: time limit of the simulation
+        :param processes: processes to simulate by (0 to simulate in the calling thread)
+        :return: (runs simulated, percentile -> distance) or None if the laps can't be simulated
+        """
+        if time_to_forecast <= 0 or not len(laps.lap_time):
+            return None
+        full_time = laps.lap_time + laps.pit_time
+        complete = ~np.isnan(full_time) & ~np.isnan(laps.distance)  # laps with missing values are not drawn
+        if not complete.any():
+            return None
+        full_time, distance = full_time[complete], laps.distance[complete]
+        key = (full_time.tobytes(), distance.tobytes(), runs)
+        live = getattr(self._local, 'live', False)
+        simulated = self._get_cached(key, time_to_forecast)
+        if simulated is None:
+            if live:
+                simulated = self._simulate(full_time, distance, time_to_forecast, runs, budget_seconds,
+                                           processes)
+            else:
+                with self._other_lock:
+                    simulated = self._get_cached(key, time_to_forecast)  # may have been simulated meanwhile
+                    if simulated is None:
+                        simulated = self._simulate(full_time, distance, time_to_forecast, runs,
+                                                   budget_seconds, processes)
+            if simulated is None:
+                return None
+            with self._lock:
+                if live:
+                    self._live = (key, simulated)
+                else:
+                    self._other = (key, simulated)
+        distances = get_distances(simulated, time_to_forecast)
+        return len(distances), dict(zip(PERCENTILES, np.percentile(distances, PERCENTILES).tolist()))
+
+
+    def _get_cached(self, key: Hashable, time_to_forecast: float) -> Optional[SimulatedRuns]:
+        with self._lock:
+            for cached in (self._live, self._other):
+                if cached is not None and cached[0] == key and cached[1].horizon >= time_to_forecast:
+                    return cached[1]
+        return None
+
+
+# let's have just one singleton to be used
+forecast_simulator = ForecastSimulator()
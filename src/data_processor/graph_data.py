@@ -0,0 +1,140 @@
+"""
+Graph data of laps (telemetry series) downsampled to a point budget, so the charts don't depend on the density
+of the positions. The series are serialized once and cached, the key contains the lap boundaries and length,
+so finished laps are computed just once and the running lap whenever it grows.
+Downsampling methods:
+- lttb: largest triangle three buckets, keeps the visual shape
+- minmax: min and max of every bucket, keeps the peaks
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Tuple, Hashable
+
+import numpy as np
+
+from src.data_source.position_store import PositionStore
+from src.utils import function_timer
+
+import logging
+logger = logging.getLogger(__name__)
+
+METHOD_LTTB = 'lttb'
+METHOD_MIN_MAX = 'minmax'
+DEFAULT_POINTS = 600
+MAX_POINTS = 10000
+CACHE_SIZE = 512  # serialized series kept
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Select points by largest triangle three buckets
+    :param x: x values (increasing)
+    :param y: y values (no NaN)
+    :param points: number of points wanted
+    :return: indices of the points selected (first and last always included)
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    # the first and last points are fixed, the others are split to points - 2 buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def min_max_indices(y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Select min and max of every bucket
+    :param y: y values (no NaN)
+    :param points: number of points wanted
+    :return: indices of the points selected (ordered)
+    """
+    n = len(y)
+    if points >= n or points < 2:
+        return np.arange(n)
+    edges = np.linspace(0, n, points // 2 + 1).astype(np.int64)
+    selected = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        selected += [start + int(np.argmin(bucket)), start + int(np.argmax(bucket))]
+    return np.unique(selected)
+
+
+def format_offset_labels(seconds) -> List[str]:
+    """ offsets from the first point (seconds) as hh:mm:ss labels """
+    labels = []
+    for offset in seconds:
+        offset = int(offset)
+        labels.append(f"{offset // 3600:02d}:{offset // 60 % 60:02d}:{offset % 60:02d}")
+    return labels
+
+
+def _get_values(lap_data: PositionStore, field: str) -> np.ndarray:
+    values = lap_data.column(field)
+    if isinstance(values, np.ndarray) and values.dtype == np.float64:
+        return values
+    return np.array([float(value) if value is not None else np.nan for value in lap_data.column_values(field)],
+                    dtype=np.float64)
+
+
+@function_timer()
+def render_series(lap_data: PositionStore, field: str, points: int, method: str) -> bytes:
+    """
+    Downsample the field of the positions and serialize it for the charts
+    :param lap_data: positions of the lap
+    :param field: field to show
+    :param points: max number of points
+    :param method: downsampling method (METHOD_LTTB or METHOD_MIN_MAX)
+    :return: json with labels (time from the lap start) and values
+    """
+    timestamps = lap_data.timestamps()
+    values = _get_values(lap_data, field)
+    valid = np.flatnonzero(np.isfinite(values) & np.isfinite(timestamps))  # missing values can't be selected
+    if method == METHOD_MIN_MAX:
+        selected = valid[min_max_indices(values[valid], points)]
+    else:
+        selected = valid[lttb_indices(timestamps[valid], values[valid], points)]
+    labels = format_offset_labels(timestamps[selected] - timestamps[0]) if len(timestamps) else []
+    return json.dumps({"labels": labels, "values": values[selected].tolist()}).encode()
+
+
+class GraphDataCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: 'OrderedDict[Tuple[Hashable, ...], bytes]' = OrderedDict()  # least recently used first
+
+    def get_series(self, key: Tuple[Hashable, ...], lap_data: PositionStore, field: str, points: int,
+                   method: str) -> bytes:
+        """
+        Get the serialized series (see render_series), computed just if not cached yet
+        :param key: identification of the lap data (must change whenever the data change)
+        """
+        key = key + (field, points, method)
+        with self._lock:
+            series = self._series.get(key)
+            if series is not None:
+                self._series.move_to_end(key)
+                return series
+        series = render_series(lap_data, field, points, method)
+        with self._lock:
+            self._series[key] = series
+            while len(self._series) > CACHE_SIZE:
+                self._series.popitem(last=False)
+        return series
+
+
+# let's have just one singleton to be used
+graph_data_cache = GraphDataCache()
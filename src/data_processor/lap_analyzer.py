@@ -2,14 +2,19 @@
 
 import pendulum
 
-from geopy.distance import distance as geopy_distance
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel
 from datetime import datetime
 import statistics
 from src.data_models import Configuration
+from src.data_processor.distance import distances_to_point
+from src.data_source.position_store import PositionStore
+from src.enums import DistanceModeEnum
 from src.utils import function_timer
 
+# position fields (database columns) needed to find laps
+USED_POSITION_FIELDS = {'date', 'latitude', 'longitude'}
+
 class LapSplit(BaseModel):
     lapId: str
     pitEntryIdx: Optional[int]
@@ -32,8 +37,171 @@ class LapStatus(BaseModel):
     outsideTemp: Optional[float]
 
 
+class LapDetector(BaseModel):
+    """
+    Resumable lap finder. It keeps the state machine between calls so just the newly appended positions
+    are analyzed on every update. Laps already finished are frozen (not extracted again).
+    """
+    key: Optional[str]  # identification of the data analyzed (to find out the state can't be reused)
+    region: float = 10
+    min_time: float = 5
+    start_idx: int = 0
+    distance_mode: str = DistanceModeEnum.ELLIPSOIDAL.value
+
+    start: Optional[Tuple[float, float]]
+    processed: int = 0  # number of positions already analyzed
+    distances: List[float] = []  # distance from start for all processed positions (km)
+    times: List[float] = []  # timestamps (epoch seconds) of all processed positions
+    lap_id: int = 1
+    splits: List[LapSplit] = []  # the last one is the current split
+    pit_entry_idx: Optional[int]
+    lap_entry_idx: Optional[int]
+    frozen_laps: Dict[str, Dict[str, Any]] = {}  # finished laps already extracted (by split signature)
+
+    def _get_start(self, configuration: Configuration, segment: PositionStore) -> Tuple[float, float]:
+        if configuration.start_latitude is not None and configuration.start_longitude:
+            return configuration.start_latitude, configuration.start_longitude
+        return segment[self.start_idx]['latitude'], segment[self.start_idx]['longitude']
+
+    def _process(self, i: int):
+        """ move the state machine by one position """
+        region = self.region
+        distance = self.distances
+        dist = distance[i]
+        if i == self.start_idx:  # in fact that just skips the first one
+            if dist > region:  # already at lap, so create new one
+                current_split = LapSplit(
+                    lapId=self.lap_id,
+                    pitEntryIdx=i,
+                    pitLeaveIdx=i,
+                    lapEntryIdx=i
+                )
+            else:  # in pit
+                current_split = LapSplit(
+                    lapId=self.lap_id,
+                    pitEntryIdx=i,
+                )
+            self.splits.append(current_split)
+            self.lap_id += 1
+            return
+        current_split = self.splits[-1] if self.splits else None
+        if dist <= region:  # we are inside the pit
+            if distance[i - 1] <= region:  # was in pit before
+                if self.pit_entry_idx:  # not recorded yet
+                    delta_t = self.times[i] - self.times[self.pit_entry_idx]
+                    if self.min_time < delta_t:  # check time in pit
+                        if current_split:  # long enough, close the previous one
+                            current_split.lapLeaveIdx = self.pit_entry_idx
+                        self.splits.append(LapSplit(lapId=str(self.lap_id), pitEntryIdx=self.pit_entry_idx))
+                        self.lap_id += 1
+                        self.pit_entry_idx = None
+            else:  # entered the pit (left lap)
+                self.pit_entry_idx = i  # remember entry, start measuring time
+        else:  # outside of pit (on lap)
+            if distance[i - 1] > region:  # was on lap before
+                if self.lap_entry_idx:  # not recorded yet
+                    delta_t = self.times[i] - self.times[self.lap_entry_idx]
+                    if self.min_time < delta_t:  # check time in pit
+                        if current_split:  # long enough, record switch to lap
+                            current_split.pitLeaveIdx = self.lap_entry_idx
+                            current_split.lapEntryIdx = self.lap_entry_idx
+                        self.pit_entry_idx = None
+            else:  # entered the lap (left pit)
+                self.lap_entry_idx = i  # remember exit, start measuring time
+
+    def _get_splits(self) -> List[LapSplit]:
+        """
+        Current splits including the tentative one: if the last point is in the pit, the new lap is created
+        even if min_time didn't pass yet. It's not part of the state as it may not be confirmed by next positions.
+        """
+        splits = list(self.splits)
+        last = self.processed - 1
+        if last > self.start_idx and self.pit_entry_idx \
+                and self.distances[last] <= self.region and self.distances[last - 1] <= self.region:
+            if splits:
+                closed_split = splits[-1].copy()
+                closed_split.lapLeaveIdx = self.pit_entry_idx
+                splits[-1] = closed_split
+            splits.append(LapSplit(lapId=str(self.lap_id), pitEntryIdx=self.pit_entry_idx))
+        return splits
+
+    @classmethod
+    def _is_frozen(cls, split: LapSplit) -> bool:
+        return split.lapLeaveIdx is not None and split.pitLeaveIdx is not None
+
+    @classmethod
+    def get_split_signature(cls, split: LapSplit) -> str:
+        return f"{split.lapId}:{split.pitEntryIdx}:{split.pitLeaveIdx}:{split.lapEntryIdx}:{split.lapLeaveIdx}"
+
+    def feed(self, configuration: Configuration, segment: PositionStore):
+        """
+        Move the state machine over positions appended since the last call, without extracting the laps.
+        Allows to find laps while the positions are still being loaded (batch by batch)
+        :param configuration: configuration
+        :param segment: all positions (the ones seen in previous calls must not change)
+        """
+        if not segment or self.processed == len(segment):
+            return
+
+        if self.start is None:
+            self.start = self._get_start(configuration, segment)
+
+        new_points = segment[self.processed:]
+        # For locating the tracks, we look for point which are such that
+        # we enter the starting region and pass through it.
+        # For each point, find the distance to the starting region (all new points at once):
+        self.distances.extend(distances_to_point(new_points.column('latitude'), new_points.column('longitude'),
+                                                 self.start, self.distance_mode).tolist())
+        self.times.extend(new_points.timestamps().tolist())
+
+        # Now look for points where we enter the region:
+        # We want to avoid cases where we jump back and forth across the
+        # boundary, so we set a minimum time we should spend inside the
+        # region.
+        for i in range(max(self.processed, self.start_idx), len(segment)):
+            self._process(i)
+        self.processed = len(segment)
+
+    @function_timer()
+    def update(self, configuration: Configuration, segment: PositionStore) -> List[Dict[str, Any]]:
+        """
+        Analyze positions appended since the last call and return all the laps
+        :param configuration: configuration
+        :param segment: all positions (the ones seen in previous calls must not change)
+        :return: list of laps, finished laps are the same objects as returned before
+        """
+        if not segment:  # race not started yet
+            return []
+
+        self.feed(configuration, segment)
+        agg_splits = aggregate_splits(configuration, self._get_splits())
+
+        statuses = []
+        signatures = set()
+        for split in agg_splits[:-1]:
+            if self._is_frozen(split):
+                signature = self.get_split_signature(split)
+                signatures.add(signature)
+                if signature not in self.frozen_laps:
+                    lap = extract_lap_status(configuration, split, segment)
+                    lap['frozen'] = True  # the lap won't change any more
+                    self.frozen_laps[signature] = lap
+                statuses.append(self.frozen_laps[signature])
+            else:
+                statuses.append(extract_lap_status(configuration, split, segment))
+        statuses.append(extract_lap_status(configuration, agg_splits[-1], segment))  # the last one is never frozen
+        # laps of splits not existing any more (i.e. merged differently) are not going to be used again
+        for signature in set(self.frozen_laps) - signatures:
+            del self.frozen_laps[signature]
+
+        # TODO implement better way
+        if not agg_splits[-1].lapLeaveIdx or self.distances[agg_splits[-1].lapLeaveIdx] > self.region:
+            statuses[-1]['finished'] = False  # outside of region
+        return statuses
+
+
 @function_timer()
-def find_laps(configuration: Configuration, segment, region=10, min_time=5, start_idx=0) -> List[Dict[str, Any]]:
+def find_laps(configuration: Configuration, segment: PositionStore, region=10, min_time=5, start_idx=0) -> List[Dict[str, Any]]:
     """Return laps given latitude & longitude data.
 
     We assume that the first point defines the start and
@@ -42,7 +210,7 @@ def find_laps(configuration: Configuration, segment, region=10, min_time=5, star
 
     Parameters
     ----------
-    segment : dict
+    segment : PositionStore
         The data for the full track.
     region : float
         The region around the starting point which is used to
@@ -56,88 +224,9 @@ def find_laps(configuration: Configuration, segment, region=10, min_time=5, star
         The starting point for the first lap.
 
     """
-    if not segment:  # race not started yet
-        return []
-
-    points = [(pt['latitude'], pt['longitude']) for pt in segment]
-    start = (configuration.start_latitude, configuration.start_longitude) \
-        if configuration.start_latitude is not None and configuration.start_longitude \
-        else points[start_idx]
-    time = [pt['date'] for pt in segment]
-    # For locating the tracks, we look for point which are such that
-    # we enter the starting region and pass through it.
-    # For each point, find the distance to the starting region:
-    distance = [geopy_distance(point, start) for point in points]
-    #np.set_printoptions(suppress=True)
-    # print(distance)
-
-    # Now look for points where we enter the region:
-    # We want to avoid cases where we jump back and forth across the
-    # boundary, so we set a minimum time we should spend inside the
-    # region.
-
-    # let's assume we are in pit or at the lap already at start time
-
-    lapId = 1
-    splits = []
-    pit_entry_idx = None
-    lap_entry_idx = None
-    current_split = None
-
-    for i, dist in enumerate(distance):
-        if i == start_idx:  # in fact that just skips the first one
-            if distance[0] > region:  # already at lap, so create new one
-                current_split = LapSplit(
-                    lapId=lapId,
-                    pitEntryIdx=start_idx,
-                    pitLeaveIdx=start_idx,
-                    lapEntryIdx=start_idx
-                )
-            else:  # in pit
-                current_split = LapSplit(
-                    lapId=lapId,
-                    pitEntryIdx=start_idx,
-                )
-            splits.append(current_split)  # HACK
-            lapId += 1
-            continue
-        if dist <= region:  # we are inside the pit
-            if distance[i - 1] <= region:  # was in pit before
-                if pit_entry_idx:  # not recorded yet
-                    delta_t = time[i] - time[pit_entry_idx]
-                    if min_time < delta_t.total_seconds() or (i == (len(distance) - 1)):  # check time in pit (if last point and in pit, create anyway
-                        if current_split:  # long enough, dump the previous one to output list
-                            current_split.lapLeaveIdx = pit_entry_idx
-                            # HACK splits.append(current_split)
-                        current_split = LapSplit(lapId=str(lapId), pitEntryIdx=pit_entry_idx)  # and create new one
-                        splits.append(current_split)  # HACK
-                        lapId += 1
-                        pit_entry_idx = None
-            else:  # entered the pit (left lap)
-                pit_entry_idx = i  # remember entry, start measuring time
-        else:  # outside of pit (on lap)
-            if distance[i - 1] > region:  # was on lap before
-                if lap_entry_idx:  # not recorded yet
-                    delta_t = time[i] - time[lap_entry_idx]
-                    if min_time < delta_t.total_seconds():  # check time in pit
-                        if current_split:  # long enough, record switch to lap
-                            current_split.pitLeaveIdx = lap_entry_idx
-                            current_split.lapEntryIdx = lap_entry_idx
-                        pit_entry_idx = None
-            else:  # entered the lap (left pit)
-                lap_entry_idx = i  # remember exit, start measuring time
-
-    # HACK if current_split and current_split.lapEntryIdx:  # do not include the one having just pit time
-    # HACK    splits.append(current_split)
-
-    agg_splits = aggregate_splits(configuration, splits)
-
-    # new
-    statuses = extract_lap_statuses(configuration, agg_splits, segment)
-    # TODO implement better way
-    if not agg_splits[-1].lapLeaveIdx or distance[agg_splits[-1].lapLeaveIdx] > region:
-        statuses[-1]['finished'] = False  # outside of region
-    return statuses
+    # one-shot analysis, use LapDetector directly to analyze the data incrementally
+    return LapDetector(region=region, min_time=min_time, start_idx=start_idx,
+                       distance_mode=configuration.distance_mode).update(configuration, segment)
 
 
 def aggregate_splits(configuration: Configuration, splits: List[LapSplit]) -> List[LapSplit]:
@@ -171,14 +260,14 @@ def aggregate_splits(configuration: Configuration, splits: List[LapSplit]) -> Li
     return agg_splits
 
 
-def extract_lap_statuses(configuration: Configuration, splits: List[LapSplit], segment: List) -> List[LapStatus]:
+def extract_lap_statuses(configuration: Configuration, splits: List[LapSplit], segment: PositionStore) -> List[LapStatus]:
     out = []
     for split in splits:
         out.append(extract_lap_status(configuration, split, segment))
     return out
 
 
-def extract_lap_status(configuration: Configuration, split: LapSplit, segment) -> Dict[str, Any]:
+def extract_lap_status(configuration: Configuration, split: LapSplit, segment: PositionStore) -> Dict[str, Any]:
     """ Lap data from database:
     xx id |
     xx date           |
@@ -209,7 +298,7 @@ def extract_lap_status(configuration: Configuration, split: LapSplit, segment) -
 
     lap_start = split.lapEntryIdx
     lap_stop = split.lapLeaveIdx + 1 if split.lapLeaveIdx is not None else len(segment) - 1
-    lap_data = segment[lap_start:lap_stop]
+    lap_data = segment[lap_start:lap_stop]  # views, the data are not copied
 
     pit_start = split.pitEntryIdx
     pit_stop = split.pitLeaveIdx + 1 if split.pitLeaveIdx is not None else len(segment) - 1
@@ -228,7 +317,9 @@ def extract_lap_status(configuration: Configuration, split: LapSplit, segment) -
         "lap_id": split.lapId,
         "lap_data": lap_data,
         "pit_data": pit_data,
-        "finished": True  # will be cleared later if needed
+        "finished": True,  # will be cleared later if needed
+        "frozen": False,  # set by LapDetector when the lap boundaries can't change any more
+        "split_signature": LapDetector.get_split_signature(split),
     }
 
 
@@ -0,0 +1,145 @@
+"""
+Persistent store of calculated fields of finished (frozen) laps. Once a lap can't change any more, its
+calculated fields are stored in TRAn database keyed by configuration hash and lap id, so they are not
+calculated again on next refreshes, after restart or by the time machine.
+Just the fields depending on the lap itself (and the lap related configuration) are stored, see
+DataProcessor._get_lap_recalculated_fields.
+"""
+import datetime
+import decimal
+import json
+import threading
+from typing import Dict, Any, Optional, Tuple, Set
+
+import pendulum
+
+from src.utils import function_timer
+
+import logging
+logger = logging.getLogger(__name__)
+
+# fields set before the calculated fields are added, these are never stored
+LAP_BASE_FIELDS = ('lap_id', 'lap_data', 'pit_data', 'finished', 'frozen', 'split_signature',
+                   'driver_name', 'copilot_name')
+
+
+def _encode_value(value: Any) -> Any:
+    """
+    JSON form of the values json doesn't know (see _decode_value), datetimes and durations are stored tagged
+    """
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.timedelta):  # pendulum Duration and Period included
+        return {'__duration__': value.total_seconds()}
+    if isinstance(value, decimal.Decimal):  # database aggregates
+        return float(value)
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    raise TypeError(f"{type(value).__name__} can't be stored in lap summary")
+
+
+def _decode_value(obj: Dict[str, Any]) -> Any:
+    """
+    Restore the tagged values stored by _encode_value (periods come back as durations)
+    """
+    if '__datetime__' in obj:
+        value = pendulum.parse(obj['__datetime__'])
+        return value.in_timezone('UTC') if not value.utcoffset() else value  # named zone instead of +00:00 offset
+    if '__duration__' in obj:
+        return pendulum.duration(seconds=obj['__duration__'])
+    return obj
+
+
+def _dumps_fields(fields: Dict[str, Any]) -> str:
+    return json.dumps(fields, default=_encode_value)
+
+
+def _loads_fields(data: str) -> Dict[str, Any]:
+    return json.loads(data, object_hook=_decode_value)
+
+
+class LapSummaryStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # config hash -> lap id -> (split signature, fields), loaded from database once per config hash (the current
+        # one is kept only)
+        self._summaries: Dict[str, Dict[str, Tuple[str, Dict[str, Any]]]] = {}
+
+    @function_timer()
+    def _load(self, config_hash: str) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        from src.db_models import LapSummary
+        summaries = {}
+        for lap_summary in LapSummary.query.filter_by(config_hash=config_hash).all():
+            try:
+                summaries[lap_summary.lap_id] = (lap_summary.split_signature, _loads_fields(lap_summary.fields))
+            except Exception as ex:
+                logger.warning(f"can't read summary of lap {lap_summary.lap_id}: {ex}")
+        logger.info(f"{len(summaries)} lap summaries loaded for {config_hash}")
+        self._delete_others(config_hash)
+        return summaries
+
+    @classmethod
+    def _delete_others(cls, config_hash: str):
+        """
+        Delete the summaries calculated for other configuration, these are not going to be used any more
+        """
+        from src import db
+        from src.db_models import LapSummary
+        try:
+            deleted = LapSummary.query.filter(LapSummary.config_hash != config_hash).delete(synchronize_session=False)
+            db.session.commit()
+            if deleted:
+                logger.info(f"{deleted} lap summaries of other configurations deleted")
+        except Exception as ex:
+            db.session.rollback()
+            logger.warning(f"can't delete lap summaries of other configurations: {ex}")
+
+    def _get_summaries(self, config_hash: str) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        summaries = self._summaries.get(config_hash)
+        if summaries is None:
+            summaries = self._load(config_hash)
+            with self._lock:
+                self._summaries = {config_hash: self._summaries.get(config_hash, summaries)}
+                summaries = self._summaries[config_hash]
+        return summaries
+
+    def get(self, config_hash: str, lap: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Get stored calculated fields of the lap
+        :param config_hash: hash of the configuration the fields were calculated for
+        :param lap: the lap (lap_id and split_signature are used)
+        :return: the fields or None if not stored yet (or stored for different lap boundaries)
+        """
+        summary = self._get_summaries(config_hash).get(lap['lap_id'])
+        if summary is None or summary[0] != lap['split_signature']:
+            return None
+        return summary[1]
+
+    def put(self, config_hash: str, lap: Dict[str, Any], recalculated: Set[str]):
+        """
+        Store the calculated fields of the lap (everything but the base fields and the fields reading other data)
+        :param config_hash: hash of the configuration the fields were calculated for
+        :param lap: the lap, meant to be frozen (not changing any more)
+        :param recalculated: fields reading other data than the lap, calculated every time (not stored)
+        """
+        from src import db
+        from src.db_models import LapSummary
+
+        fields = {k: v for k, v in lap.items() if k not in LAP_BASE_FIELDS and k not in recalculated}
+        self._get_summaries(config_hash)[lap['lap_id']] = (lap['split_signature'], fields)
+        try:
+            db_obj = LapSummary.query.filter_by(config_hash=config_hash, lap_id=lap['lap_id']).first()
+            if not db_obj:
+                db_obj = LapSummary(config_hash=config_hash, lap_id=lap['lap_id'])
+                db.session.add(db_obj)
+            db_obj.split_signature = lap['split_signature']
+            db_obj.fields = _dumps_fields(fields)
+            db.session.commit()
+        except Exception as ex:
+            # the summary is kept in memory at least, it will be just calculated again after restart
+            db.session.rollback()
+            logger.warning(f"can't store summary of lap {lap['lap_id']}: {ex}")
+
+
+# let's have just one singleton to be used
+lap_summary_store = LapSummaryStore()
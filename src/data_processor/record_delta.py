@@ -0,0 +1,56 @@
+"""
+Delta responses of formatted tables (label groups identified by record_id). Every record keeps the version it was
+changed in, the client sends the version it has seen and gets just the records changed since, plus the ids of
+all the records (to keep the order and drop the old ones). The records are serialized once when updated.
+"""
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.data_models import JsonLabelGroup
+
+
+class RecordDelta:
+    """ immutable, new instance is created by every update """
+    def __init__(self, version: int, ids: Dict[str, List[str]], records: Dict[str, Dict[str, Tuple[int, bytes]]]):
+        self.version = version
+        self.ids = ids  # table -> record ids in order
+        self.records = records  # table -> record id -> (version, serialized record)
+        self._ids_json = json.dumps(ids).encode()
+
+    @classmethod
+    def create(cls, previous: Optional['RecordDelta'], tables: Dict[str, List[JsonLabelGroup]]) -> 'RecordDelta':
+        """
+        Create new version of the tables, the records not changed keep their versions
+        :param previous: the previous version (None if there is none)
+        :param tables: table name -> records
+        :return: the new version
+        """
+        # time based, so the version keeps increasing even if another process takes over the refresh
+        # (microseconds, the client gets it as javascript number)
+        version = max(time.time_ns() // 1000, previous.version + 1 if previous else 0)
+        ids = {}
+        records = {}
+        for table, table_records in tables.items():
+            previous_records = previous.records.get(table, {}) if previous else {}
+            ids[table] = []
+            records[table] = {}
+            for record in table_records:
+                body = record.json().encode()
+                previous_record = previous_records.get(record.record_id)
+                ids[table].append(record.record_id)
+                records[table][record.record_id] = previous_record if previous_record and previous_record[1] == body \
+                    else (version, body)
+        return cls(version, ids, records)
+
+    def get_changed(self, since: int) -> bytes:
+        """
+        Serialized delta response
+        :param since: version the client has seen (0 for everything)
+        :return: json with version, ids (table -> record ids) and changed (table -> records changed since)
+        """
+        changed = b','.join(
+            b'"' + table.encode() + b'":[' + b','.join(body for version, body in records.values() if version > since)
+            + b']' for table, records in self.records.items())
+        return b'{"version":' + str(self.version).encode() + b',"ids":' + self._ids_json + \
+               b',"changed":{' + changed + b'}}'
@@ -0,0 +1,103 @@
+"""
+Cache of time machine snapshots. Snapshots of times fully covered by the data already stored in TeslaMate
+(no charging running at the time) never change, they are kept until evicted for memory. The other ones are
+valid for one data version only.
+Size of the snapshot is just estimated (formatted payloads, raw records and positions). Positions are views pinning
+their whole root store: views of the live positions cost just their range, but the root of positions loaded
+from database (or of the live positions replaced since, i.e. by a newer shared snapshot) is charged in full,
+once for all the snapshots sharing it.
+"""
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, NamedTuple
+
+from src.data_models import JsonStaticSnapshot
+from src.data_source.position_store import PositionStore
+
+import logging
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_VERSION = 0  # data version of the snapshots that never change
+_RECORD_SIZE = 2048  # estimated size of single raw record (dict with calculated fields)
+
+
+class SnapshotKey(NamedTuple):
+    config_key: str  # configuration (file and database) the snapshot was created for
+    data_version: int  # IMMUTABLE_VERSION or version of the live data
+    timestamp: int  # time rounded to the granularity
+
+
+def estimate_size(snapshot: JsonStaticSnapshot) -> int:
+    """ estimated size of the snapshot without the positions (see SnapshotCache._get_size) """
+    size = 0
+    for formatted in (snapshot.current_status_formatted, snapshot.lap_list_formatted,
+                      snapshot.charging_process_list_formatted, snapshot.total_formatted,
+                      snapshot.forecast_formatted):
+        if formatted is not None:
+            size += len(formatted.json())
+    records = len(snapshot.lap_list_raw or []) + len(snapshot.charging_process_list_raw or []) + 3
+    return size + records * _RECORD_SIZE
+
+
+class SnapshotCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # least recently used first
+        self._snapshots: 'OrderedDict[SnapshotKey, Tuple[JsonStaticSnapshot, int]]' = OrderedDict()
+        self._size = 0
+
+    def _get_size(self, live_positions: Optional[PositionStore]) -> int:
+        """
+        Size of the snapshots including the positions: range of the view for the live positions,
+        whole root store (once) for the others
+        """
+        live_root = live_positions.root if live_positions is not None else None
+        size = 0
+        roots = {}
+        for snapshot, snapshot_size in self._snapshots.values():
+            size += snapshot_size
+            positions = snapshot.car_positions_raw
+            if positions is None:
+                continue
+            if positions.root is live_root:
+                size += positions.estimate_size()
+            else:
+                roots[id(positions.root)] = positions.root
+        return size + sum(root.estimate_size() for root in roots.values())
+
+    def get(self, key: SnapshotKey) -> Optional[JsonStaticSnapshot]:
+        with self._lock:
+            cached = self._snapshots.get(key)
+            if cached is None:
+                return None
+            self._snapshots.move_to_end(key)
+            return cached[0]
+
+    def put(self, key: SnapshotKey, snapshot: JsonStaticSnapshot, max_size: int,
+            live_positions: Optional[PositionStore] = None):
+        """
+        Store the snapshot and evict the others if over the limit: outdated ones first (other configuration
+        or data version), then the least recently used
+        :param key: the key
+        :param snapshot: the snapshot
+        :param max_size: memory limit (bytes)
+        :param live_positions: the live positions (their root store is not charged to the snapshots)
+        """
+        size = estimate_size(snapshot)
+        with self._lock:
+            self._snapshots.pop(key, None)
+            for old_key in list(self._snapshots):
+                if old_key.config_key != key.config_key or (
+                        key.data_version != IMMUTABLE_VERSION
+                        and old_key.data_version not in (IMMUTABLE_VERSION, key.data_version)):
+                    self._snapshots.pop(old_key)  # can't be used any more
+            self._snapshots[key] = (snapshot, size)
+            self._size = self._get_size(live_positions)
+            while self._size > max_size and len(self._snapshots) > 1:
+                self._snapshots.popitem(last=False)
+                self._size = self._get_size(live_positions)
+        logger.debug(f"{len(self._snapshots)} snapshots cached, {self._size} bytes")
+
+
+# let's have just one singleton to be used
+snapshot_cache = SnapshotCache()
@@ -0,0 +1,441 @@
+"""
+Columnar storage of car positions. It replaces list of dicts (dict and pendulum objects for every record) by one
+typed array per column. Timestamps are kept as int epoch microseconds and converted to pendulum on access only.
+Rows are available as dict-like views (PositionRow), so the code (including user defined calculated fields)
+can still use position_list[i]['odometer'].
+Just the columns needed are usually loaded from database, others may be loaded lazily on first access (column loader).
+Lazily loaded columns remember how many positions they cover, positions appended later are loaded on the next access.
+"""
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Sequence, Iterator, Union, Callable, Collection
+
+import numpy as np
+import pendulum
+
+# column kinds (how the values are stored)
+KIND_FLOAT = 'float'  # float64, NaN for None
+KIND_INT = 'int'  # float64 (exact up to 2^53), NaN for None, returned as int
+KIND_BOOL = 'bool'  # float64 (0/1), NaN for None, returned as bool
+KIND_DATE = 'date'  # int64 epoch microseconds, NAT for None, returned as pendulum.DateTime (utc)
+KIND_OBJECT = 'object'  # python list, anything else
+
+_NUMERIC_KINDS = (KIND_FLOAT, KIND_INT, KIND_BOOL)
+NAT = np.iinfo(np.int64).min  # "not a time", the same value numpy uses for NaT
+_MIN_CAPACITY = 1024
+# changes of the columns (the refresher appends positions while a request may load a column lazily),
+# module wide as the stores are pickled (shared snapshot)
+_columns_lock = threading.Lock()
+
+
+def _infer_kind(values: Sequence) -> Optional[str]:
+    """ kind by the first not None value (None if all values are None) """
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return KIND_BOOL
+        if isinstance(v, int):
+            return KIND_INT
+        if isinstance(v, (float, Decimal)):
+            return KIND_FLOAT
+        if isinstance(v, datetime):
+            return KIND_DATE
+        return KIND_OBJECT
+    return None
+
+
+def _merge_kinds(kind1: str, kind2: Optional[str]) -> str:
+    """ kind able to keep values of both kinds """
+    if kind2 is None or kind1 == kind2:
+        return kind1
+    if kind1 in _NUMERIC_KINDS and kind2 in _NUMERIC_KINDS:
+        return KIND_FLOAT
+    return KIND_OBJECT
+
+
+def _to_epoch_us(v: Optional[datetime]) -> int:
+    if v is None:
+        return NAT
+    if v.tzinfo is None:  # TeslaMate keeps the dates in utc without timezone
+        v = v.replace(tzinfo=timezone.utc)
+    return round(v.timestamp() * 1_000_000)
+
+
+def _from_epoch_us(v) -> Optional[pendulum.DateTime]:
+    return None if v == NAT else pendulum.from_timestamp(int(v) / 1_000_000, tz='utc')
+
+
+def _encode(kind: str, values: Sequence) -> Union[np.ndarray, List]:
+    """ raw python values (as coming from database) to storage form """
+    if kind in _NUMERIC_KINDS:
+        return np.array([float(v) if isinstance(v, Decimal) else v for v in values]
+                        if kind == KIND_FLOAT else values, dtype=np.float64)  # None is converted to NaN
+    if kind == KIND_DATE:
+        return np.array([_to_epoch_us(v) for v in values], dtype=np.int64)
+    return list(values)
+
+
+def _decode(kind: str, v) -> Any:
+    """ stored value to python value """
+    if kind == KIND_FLOAT:
+        return None if v != v else float(v)
+    if kind == KIND_INT:
+        return None if v != v else int(v)
+    if kind == KIND_BOOL:
+        return None if v != v else bool(v)
+    if kind == KIND_DATE:
+        return _from_epoch_us(v)
+    return v
+
+
+def _null_array(kind: str, size: int) -> Union[np.ndarray, List]:
+    if kind in _NUMERIC_KINDS:
+        return np.full(size, np.nan, dtype=np.float64)
+    if kind == KIND_DATE:
+        return np.full(size, NAT, dtype=np.int64)
+    return [None] * size
+
+
+class _Column:
+    """ single column. Numeric buffers may be longer than the store (capacity), object lists are not """
+    __slots__ = ('kind', 'data')
+
+    def __init__(self, kind: str, data: Union[np.ndarray, List]):
+        self.kind = kind
+        self.data = data
+
+    def make_writeable(self):
+        """
+        copy the buffer if it's read-only (mapped from shared snapshot in the processes not refreshing the data),
+        the process writes to its private copy then
+        """
+        if isinstance(self.data, np.ndarray) and not self.data.flags.writeable:
+            self.data = self.data.copy()
+
+    def to_python(self, start: int, stop: int) -> List:
+        if self.kind == KIND_OBJECT:
+            return self.data[start:stop]
+        return [_decode(self.kind, v) for v in self.data[start:stop].tolist()]
+
+    def convert(self, kind: str, length: int, capacity: int):
+        """ change the kind keeping the values (just the first length values matter) """
+        if kind == self.kind:
+            return
+        if kind == KIND_OBJECT:
+            self.data = self.to_python(0, length)
+        elif self.kind in _NUMERIC_KINDS and kind in _NUMERIC_KINDS:
+            pass  # the same storage
+        else:
+            data = _null_array(kind, capacity)
+            data[:length] = _encode(kind, self.to_python(0, length))
+            self.data = data
+        self.kind = kind
+
+
+class PositionRow(MutableMapping):
+    """
+    Dict-like view of single position. Writing a value writes to the store (adds column if needed).
+    """
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'PositionStore', index: int):
+        self._store = store  # the root store
+        self._index = index  # absolute index in the root store
+
+    def __getitem__(self, key):
+        return self._store._get_value(key, self._index)
+
+    def __setitem__(self, key, value):
+        self._store._set_value(key, self._index, value)
+
+    def __delitem__(self, key):
+        raise TypeError("columns can't be deleted from single position")
+
+    def __contains__(self, key):
+        return self._store._has_column(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store.column_names())
+
+    def __len__(self):
+        return len(self._store.column_names())
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class PositionStore:
+    """
+    Columnar list of positions ordered by date. Slicing returns a view sharing the data (no copy),
+    indexing returns PositionRow. New positions can be appended (extend) to the root store only.
+    """
+
+    def __init__(self):
+        self._columns: Dict[str, _Column] = {}
+        self._length = 0
+        self._capacity = 0
+        self._root: PositionStore = self
+        self._start = 0
+        self._stop: Optional[int] = None  # None means "till the end" (follows appended positions)
+        # lazy loading of columns not loaded yet, loader(store, names, start) has to add the columns for the positions
+        # from start on (see add_columns)
+        self._loader: Optional[Callable[['PositionStore', List[str], int], None]] = None
+        self._loadable: frozenset = frozenset()
+        self._lazy: Dict[str, int] = {}  # lazily loaded column -> number of positions loaded
+
+    ################
+    # construction #
+    ################
+
+    @classmethod
+    def from_rows(cls, column_names: Sequence[str], rows: Sequence[Sequence]) -> 'PositionStore':
+        """
+        Create store from database rows
+        :param column_names: names of the columns
+        :param rows: list of tuples, values in column_names order
+        """
+        store = cls()
+        store.extend_rows(column_names, rows)
+        return store
+
+    def extend_rows(self, column_names: Sequence[str], rows: Sequence[Sequence]):
+        """
+        Append database rows (root store only)
+        :param column_names: names of the columns
+        :param rows: list of tuples, values in column_names order
+        """
+        self.extend_columns(dict(zip(column_names, zip(*rows))) if rows else {name: () for name in column_names},
+                            len(rows))
+
+    @classmethod
+    def from_dict_list(cls, items: List[Dict[str, Any]]) -> 'PositionStore':
+        column_names = list(items[0].keys()) if items else []
+        return cls.from_rows(column_names, [tuple(item.get(name) for name in column_names) for item in items])
+
+    def _reserve(self, capacity: int):
+        if capacity <= self._capacity:
+            return
+        new_capacity = max(capacity, 2 * self._capacity, _MIN_CAPACITY)
+        for column in self._columns.values():
+            if column.kind != KIND_OBJECT:
+                data = _null_array(column.kind, new_capacity)
+                data[:self._length] = column.data[:self._length]
+                column.data = data
+        self._capacity = new_capacity
+
+    def extend_columns(self, values: Dict[str, Sequence], count: int):
+        """
+        Append positions given by columns of raw values (root store only)
+        :param values: column name -> raw values (all of the same length)
+        :param count: number of positions appended
+        """
+        assert self._root is self, "positions can be appended to the root store only"
+        with _columns_lock:
+            self._extend_columns(values, count)
+
+    def _extend_columns(self, values: Dict[str, Sequence], count: int):
+        old_length = self._length
+        new_length = old_length + count
+        self._reserve(new_length)
+        for name, column_values in values.items():
+            kind = _infer_kind(column_values)
+            column = self._columns.get(name)
+            if column is None:
+                column = _Column(kind or KIND_FLOAT, _null_array(kind or KIND_FLOAT, self._capacity))
+                if column.kind == KIND_OBJECT:
+                    column.data = column.data[:old_length]
+                self._columns[name] = column
+            else:
+                column.convert(_merge_kinds(column.kind, kind), old_length, self._capacity)
+                column.make_writeable()
+            if column.kind == KIND_OBJECT:
+                column.data.extend(column_values)
+            else:
+                column.data[old_length:new_length] = _encode(column.kind, column_values)
+            if self._lazy.get(name) == old_length:
+                del self._lazy[name]  # complete, loaded with the positions from now on
+        for name, column in self._columns.items():
+            if name not in values and column.kind == KIND_OBJECT:
+                column.data.extend([None] * count)  # numeric ones are already filled by nulls
+        self._length = new_length
+
+    def add_columns(self, values: Dict[str, Sequence], start: int = 0):
+        """
+        Add (or replace) columns loaded lazily (root store only). The values may cover less positions than the store
+        has (positions appended while loading), the rest is loaded on the next access.
+        :param values: column name -> raw values for the positions from start on
+        :param start: index of the first position of the values, the ones before have to be loaded already
+        """
+        assert self._root is self, "columns can be added to the root store only"
+        with _columns_lock:
+            for name, column_values in values.items():
+                stop = start + len(column_values)
+                if stop > self._length or (start > 0 and self._lazy.get(name) != start):
+                    continue  # doesn't match the store (replaced meanwhile), loaded again on the next access
+                column = self._columns.get(name) if start > 0 else None
+                kind = _infer_kind(column_values)
+                if column is None:
+                    kind = kind or KIND_FLOAT
+                    column = _Column(kind, _null_array(kind, self._length if kind == KIND_OBJECT else self._capacity))
+                    self._columns[name] = column
+                else:
+                    column.convert(_merge_kinds(column.kind, kind), self._length, self._capacity)
+                    column.make_writeable()
+                if column.kind == KIND_OBJECT:
+                    column.data[start:stop] = list(column_values)
+                else:
+                    column.data[start:stop] = _encode(column.kind, column_values)
+                self._lazy[name] = stop
+
+    def set_column_loader(self, loader: Callable[['PositionStore', List[str]], None], loadable: Collection[str]):
+        """
+        Allow to load the columns not loaded yet on the first access
+        :param loader: function(store, names, start) loading the columns for the positions from start on
+                       into the (root) store using add_columns
+        :param loadable: names of the columns the loader is able to provide
+        """
+        self._root._loader = loader
+        self._root._loadable = frozenset(loadable)
+
+    def ensure_columns(self, names: Collection[str]):
+        """
+        load all the loadable columns from names not loaded yet (in one go), lazily loaded columns are completed
+        for the positions appended since
+        """
+        root = self._root
+        if not root._loader:
+            return
+        with _columns_lock:
+            missing = {}  # name -> first position to load
+            for name in names:
+                if name not in root._loadable:
+                    continue
+                if name not in root._columns:
+                    missing[name] = 0
+                elif root._lazy.get(name, root._length) < root._length:
+                    missing[name] = root._lazy[name]
+        for start in sorted(set(missing.values())):
+            root._loader(root, [name for name, name_start in missing.items() if name_start == start], start)
+
+    def _get_column(self, name: str) -> _Column:
+        root = self._root
+        column = root._columns.get(name)
+        if column is None or root._lazy.get(name, root._length) < root._length:
+            self.ensure_columns([name])
+            column = root._columns[name]  # KeyError as dict does
+        return column
+
+    def extend(self, other: 'PositionStore'):
+        """ append all positions of other store (root store only) """
+        self.extend_columns({name: other.column_values(name) for name in other.column_names()}, len(other))
+
+    ##########
+    # access #
+    ##########
+
+    def _has_column(self, name: str) -> bool:
+        return name in self._root._columns or name in self._root._loadable
+
+    def _get_value(self, name: str, index: int):
+        column = self._get_column(name)
+        return _decode(column.kind, column.data[index])
+
+    def _set_value(self, name: str, index: int, value):
+        root = self._root
+        column = root._columns.get(name)
+        kind = _infer_kind([value])
+        if column is None:
+            column = _Column(kind or KIND_FLOAT, _null_array(kind or KIND_FLOAT, root._capacity))
+            if column.kind == KIND_OBJECT:
+                column.data = column.data[:root._length]
+            root._columns[name] = column
+        else:
+            column.convert(_merge_kinds(column.kind, kind), root._length, root._capacity)
+            column.make_writeable()
+        if column.kind == KIND_OBJECT:
+            column.data[index] = value
+        elif column.kind == KIND_DATE:
+            column.data[index] = _to_epoch_us(value)
+        else:
+            column.data[index] = np.nan if value is None else float(value)
+
+    def _get_range(self):
+        stop = self._stop if self._stop is not None else self._root._length
+        return self._start, stop
+
+    def __len__(self):
+        start, stop = self._get_range()
+        return stop - start
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, item):
+        start, stop = self._get_range()
+        if isinstance(item, slice):
+            s_start, s_stop, step = item.indices(stop - start)
+            if step != 1:
+                return [PositionRow(self._root, start + i) for i in range(s_start, s_stop, step)]
+            view = PositionStore.__new__(PositionStore)
+            view._root = self._root
+            view._start = start + s_start
+            view._stop = start + max(s_start, s_stop)
+            return view
+        index = item + (stop - start) if item < 0 else item
+        if index < 0 or index >= stop - start:
+            raise IndexError("position index out of range")
+        return PositionRow(self._root, start + index)
+
+    def __iter__(self) -> Iterator[PositionRow]:
+        start, stop = self._get_range()
+        root = self._root
+        return (PositionRow(root, i) for i in range(start, stop))
+
+    def __repr__(self):
+        return f"PositionStore({len(self)} positions)"
+
+    @property
+    def root(self) -> 'PositionStore':
+        """ the store owning the data (the store itself if it's not a view) """
+        return self._root
+
+    def estimate_size(self) -> int:
+        """
+        Estimated memory of the positions in bytes (8 bytes per value), the root store counts its whole capacity,
+        a view just its range
+        """
+        rows = max(self._capacity, self._length) if self._root is self else len(self)
+        return rows * len(self._root._columns) * 8
+
+    def column_names(self) -> List[str]:
+        """ names of the columns loaded (not the lazily loadable ones) """
+        return list(self._root._columns.keys())
+
+    def column(self, name: str) -> Union[np.ndarray, List]:
+        """
+        Column in storage form (no copy for numeric ones, don't change it):
+        float64 array for numbers (NaN for None), int64 epoch microseconds for dates, list for others
+        """
+        start, stop = self._get_range()
+        return self._get_column(name).data[start:stop]
+
+    def column_values(self, name: str) -> List:
+        """ column as list of python values (pendulum for dates, None for missing values) """
+        start, stop = self._get_range()
+        return self._get_column(name).to_python(start, stop)
+
+    def timestamps(self) -> np.ndarray:
+        """ dates as epoch seconds (float) """
+        return self.column('date') / 1_000_000
+
+    def to_dict_list(self) -> List[Dict[str, Any]]:
+        """ positions as list of dicts (expensive, meant for debug outputs) """
+        names = self.column_names()
+        columns = [self.column_values(name) for name in names]
+        return [dict(zip(names, values)) for values in zip(*columns)]
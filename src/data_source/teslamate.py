@@ -1,7 +1,9 @@
 import pendulum
-from typing import Dict, Any, List
+from functools import partial
+from typing import Dict, Any, List, Optional, Collection, Iterator, Tuple, Sequence
 from sqlalchemy import text
 from src.utils import function_timer
+from src.data_source.position_store import PositionStore
 from decimal import Decimal
 from datetime import datetime, timezone
 
@@ -30,6 +32,88 @@ def _cursor_one_to_dict_list(resultproxy):
     return a
 
 
+def _cursor_to_position_store(resultproxy) -> PositionStore:
+    # no dict per record, the values go to columns directly
+    return PositionStore.from_rows(list(resultproxy.keys()), resultproxy.fetchall())
+
+
+# default number of rows fetched at once by streaming queries
+DEFAULT_FETCH_SIZE = 5000
+
+# columns always loaded for positions (identification and ordering, needed for incremental loads)
+POSITION_KEY_COLUMNS = ('id', 'date')
+
+_position_column_names: Optional[List[str]] = None
+
+
+def get_position_column_names() -> List[str]:
+    """
+    Names of the columns of positions table (loaded once, the schema doesn't change while running)
+    """
+    global _position_column_names
+    if _position_column_names is None:
+        from src import db
+        sql = text("""SELECT column_name FROM information_schema.columns 
+                      WHERE table_name = 'positions' ORDER BY ordinal_position""")
+        resultproxy = db.get_engine(bind='teslamate').execute(sql)
+        _position_column_names = [row[0] for row in resultproxy]
+    return _position_column_names
+
+
+def _get_position_select_list(columns: Optional[Collection[str]]) -> str:
+    """
+    SQL select list for positions. The names are checked against the table columns (unknown ones are skipped),
+    so they are safe to be put into the query
+    :param columns: columns needed, None for all of them
+    """
+    if columns is None:
+        return '*'
+    selected = [name for name in get_position_column_names() if name in columns or name in POSITION_KEY_COLUMNS]
+    return ', '.join(f'"{name}"' for name in selected)
+
+
+def _load_position_columns(car_id: int, store: PositionStore, columns: List[str], start: int):
+    """
+    Column loader for PositionStore. Load the columns for the positions in the store from start on (by position id),
+    the positions appended meanwhile are loaded on the next access
+    """
+    from src import db
+    columns = [name for name in get_position_column_names() if name in columns and name not in POSITION_KEY_COLUMNS]
+    if not columns:
+        return
+    ids = [int(position_id) for position_id in store.column('id')[start:].tolist()]
+    sql = text(f"""SELECT id, {_get_position_select_list(columns)} FROM positions 
+                   WHERE car_id = :car_id AND id = ANY(:ids)""")
+    resultproxy = db.get_engine(bind='teslamate').execute(sql, {'car_id': car_id, 'ids': ids})
+    keys = list(resultproxy.keys())
+    rows_by_id = {row[0]: row for row in resultproxy}
+    empty_row = (None,) * len(keys)
+    rows = [rows_by_id.get(position_id, empty_row) for position_id in ids]
+    store.add_columns({name: [row[index] for row in rows] for index, name in enumerate(keys) if name in columns},
+                      start)
+
+
+def _stream_row_batches(sql, params: Dict[str, Any], fetch_size: int) -> Iterator[Tuple[List[str], List[Sequence]]]:
+    """
+    Execute the query using server side (named) cursor and yield the rows in batches. The whole result set
+    is never kept in memory (neither by the driver), so the consumer can process it as a pipeline.
+    The connection is held until the generator is exhausted or closed.
+    :param sql: query to execute
+    :param params: query parameters
+    :param fetch_size: number of rows fetched from the server at once (and the batch size)
+    :return: generator of (column names, rows)
+    """
+    from src import db
+    with db.get_engine(bind='teslamate').connect() as connection:
+        resultproxy = connection.execution_options(stream_results=True, max_row_buffer=fetch_size).execute(sql, params)
+        column_names = list(resultproxy.keys())
+        while True:
+            rows = resultproxy.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield column_names, rows
+
+
 def _cursor_one_to_dict(resultproxy):
     l = _cursor_one_to_dict_list(resultproxy)
     return l[0] if l else {}
@@ -59,46 +143,139 @@ def get_car_status(car_id: int, dt: pendulum.DateTime, update_fast_data: bool =
     return resp
 
 
+def create_position_store(car_id: int, columns: Optional[Collection[str]] = None) -> PositionStore:
+    """
+    Create empty store for the car positions (to be filled by iter_car_positions batches)
+    :param columns: columns to be loaded, if provided, the others are loaded lazily when accessed
+    """
+    store = PositionStore()
+    if columns is not None:
+        store.set_column_loader(partial(_load_position_columns, car_id), get_position_column_names())
+    return store
+
+
+def iter_car_positions(car_id: int, dt_start: pendulum.DateTime, dt_end: pendulum.DateTime,
+                       columns: Optional[Collection[str]] = None, fetch_size: int = DEFAULT_FETCH_SIZE) \
+        -> Iterator[Tuple[List[str], List[Sequence]]]:
+    """
+    Stream positions in the time window using server side cursor
+    :param columns: columns to load (id and date are loaded always), None for all
+    :param fetch_size: number of rows in a batch
+    :return: generator of (column names, rows) batches, positions ordered by date
+    """
+    # get the full records  #####   AND usable_battery_level IS NOT NULL
+    sql = text(f"""SELECT {_get_position_select_list(columns)} FROM positions 
+                   WHERE car_id = :car_id AND date >= :dt_start AND date <= :dt_end
+                   AND usable_battery_level IS NOT NULL 
+                   ORDER BY date""")
+    return _stream_row_batches(sql, {'car_id': car_id, 'dt_start': dt_start, 'dt_end': dt_end}, fetch_size)
+
+
 @function_timer()
-def get_car_positions(car_id: int, dt_start: pendulum.DateTime, dt_end: pendulum.DateTime, update_fast_data: bool = True) -> List[Dict[str, Any]]:
+def get_car_positions(car_id: int, dt_start: pendulum.DateTime, dt_end: pendulum.DateTime, update_fast_data: bool = True,
+                      columns: Optional[Collection[str]] = None, fetch_size: int = DEFAULT_FETCH_SIZE) -> PositionStore:
+    """
+    Get positions in the time window
+    :param columns: columns to load (id and date are loaded always), None for all. The others are loaded lazily
+                    when accessed.
+    :param fetch_size: number of rows fetched at once
+    :return: positions ordered by date
+    """
+    store = create_position_store(car_id, columns)
+    for column_names, rows in iter_car_positions(car_id, dt_start, dt_end, columns, fetch_size):
+        store.extend_rows(column_names, rows)
+    return store
+
+
+@function_timer()
+def get_car_positions_since(car_id: int, last_date: pendulum.DateTime, last_id: int, dt_end: pendulum.DateTime,
+                            columns: Optional[Collection[str]] = None) -> PositionStore:
+    """
+    Get positions newer than the last already loaded one (to append to the cached list)
+    :param car_id: car to load positions for
+    :param last_date: date of the last position already loaded
+    :param last_id: id of the last position already loaded (to resolve records having the same date)
+    :param dt_end: end of the time window
+    :param columns: columns to load (id and date are loaded always), None for all
+    :return: new positions ordered by date
+    """
     from src import db
-    # get the full records  #####   AND usable_battery_level IS NOT NULL
-    sql = text("""SELECT * FROM positions 
-                  WHERE car_id = :car_id AND date >= :dt_start AND date <= :dt_end
-                  AND usable_battery_level IS NOT NULL 
-                  ORDER BY date""")
-    resultproxy = db.get_engine(bind='teslamate').execute(sql, {'car_id': car_id, 'dt_start': dt_start, 'dt_end': dt_end})
-    return _cursor_one_to_dict_list(resultproxy)
+    sql = text(f"""SELECT {_get_position_select_list(columns)} FROM positions 
+                   WHERE car_id = :car_id AND date <= :dt_end
+                   AND (date > :last_date OR (date = :last_date AND id > :last_id))
+                   AND usable_battery_level IS NOT NULL 
+                   ORDER BY date, id""")
+    resultproxy = db.get_engine(bind='teslamate').execute(sql, {'car_id': car_id, 'last_date': last_date,
+                                                                'last_id': last_id, 'dt_end': dt_end})
+    return _cursor_to_position_store(resultproxy)
 
 
 @function_timer()
 def get_car_charging_processes(car_id: int, dt_from: pendulum.DateTime, dt_to: pendulum.DateTime) -> List[Dict[str, Any]]:
     from src import db
-    # first get the charging processes itself
-    sql = text("""SELECT * FROM charging_processes 
-                  WHERE car_id = :car_id
-                  AND (start_date BETWEEN (:dt_from - interval ':min minutes') AND (:dt_to + interval ':min minutes')) 
-                  AND (end_date IS NULL OR end_date BETWEEN (:dt_from - interval ':min minutes') AND (:dt_to + interval ':min minutes'))
-                  ORDER BY start_date""")
+    # the charging processes with the aggregated charges data in one go
+    sql = text("""SELECT chp.*, ch.charging_process_id, 
+                  ch.min_charger_power, ch.avg_charger_power, ch.max_charger_power
+                  FROM charging_processes chp
+                  LEFT JOIN LATERAL (
+                      SELECT charging_process_id, min(charger_power) AS min_charger_power, 
+                      avg(charger_power) AS avg_charger_power, max(charger_power) AS max_charger_power
+                      FROM charges WHERE charging_process_id = chp.id GROUP BY charging_process_id
+                  ) ch ON true
+                  WHERE chp.car_id = :car_id
+                  AND (chp.start_date BETWEEN (:dt_from - make_interval(mins => :min)) AND (:dt_to + make_interval(mins => :min))) 
+                  AND (chp.end_date IS NULL OR chp.end_date BETWEEN (:dt_from - make_interval(mins => :min)) AND (:dt_to + make_interval(mins => :min)))
+                  ORDER BY chp.start_date""")
     resultproxy = db.get_engine(bind='teslamate').execute(sql, {'car_id': car_id, 'dt_from': dt_from, 'dt_to': dt_to, 'min': 5})  # safety margin TODO make configurable
-    charging_processes = _cursor_one_to_dict_list(resultproxy)
-    chp_id_list = [chp['id'] for chp in charging_processes]
-    charging_processes_dict = {chp['id']: chp for chp in charging_processes}
-
-    # and the aggregate charges data
-    sql = text("""SELECT charging_process_id, 
-    min(charger_power) as min_charger_power, avg(charger_power) as avg_charger_power, max(charger_power) as max_charger_power
-    FROM charges 
-    WHERE charging_process_id = ANY(:chp_id_list) GROUP BY charging_process_id""")
-    resultproxy = db.get_engine(bind='teslamate').execute(sql, {'chp_id_list': chp_id_list})
-    charges_list = _cursor_one_to_dict_list(resultproxy)
+    return _cursor_one_to_dict_list(resultproxy)
 
-    # and now merge the data
-    for item in charges_list:
-        id = item['charging_process_id']
-        charging_processes_dict[id].update(item)
 
-    return charging_processes
+@function_timer()
+def get_lap_aggregates(car_id: int, lap_boundaries: List[Tuple[str, pendulum.DateTime, pendulum.DateTime]]) \
+        -> Dict[str, Dict[str, Any]]:
+    """
+    Aggregate positions of many laps in one grouped query, so the raw positions are not needed to build lap summaries
+    :param car_id: car the laps belong to
+    :param lap_boundaries: list of (lap id, first position date, last position date)
+    :return: lap id -> aggregates (odometer_delta, energy in kWh, avg_speed, max_speed, avg_outside_temp,
+             avg_inside_temp, start/end/min/max_battery_level, position_count)
+    """
+    from src import db
+    if not lap_boundaries:
+        return {}
+    sql = text("""WITH laps AS (
+                      SELECT * FROM unnest(CAST(:lap_ids AS text[]), CAST(:dt_starts AS timestamptz[]), 
+                                           CAST(:dt_ends AS timestamptz[])) AS l(lap_id, dt_start, dt_end)
+                  ), lap_positions AS (
+                      SELECT l.lap_id, pos.date, pos.speed, pos.power, pos.battery_level, 
+                      pos.outside_temp, pos.inside_temp,
+                      first_value(pos.odometer) OVER w AS first_odometer,
+                      last_value(pos.odometer) OVER w AS last_odometer,
+                      first_value(pos.battery_level) OVER w AS first_battery_level,
+                      last_value(pos.battery_level) OVER w AS last_battery_level,
+                      extract(epoch FROM pos.date - lag(pos.date) OVER (PARTITION BY l.lap_id ORDER BY pos.date)) 
+                          AS seconds
+                      FROM laps l JOIN positions pos 
+                      ON pos.car_id = :car_id AND pos.date >= l.dt_start AND pos.date <= l.dt_end 
+                      AND pos.usable_battery_level IS NOT NULL
+                      WINDOW w AS (PARTITION BY l.lap_id ORDER BY pos.date 
+                                   ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+                  )
+                  SELECT lap_id, count(*) AS position_count,
+                  max(last_odometer) - max(first_odometer) AS odometer_delta,
+                  sum(power * seconds) / 3600 AS energy,
+                  avg(speed) AS avg_speed, max(speed) AS max_speed,
+                  avg(outside_temp) AS avg_outside_temp, avg(inside_temp) AS avg_inside_temp,
+                  max(first_battery_level) AS start_battery_level, max(last_battery_level) AS end_battery_level,
+                  min(battery_level) AS min_battery_level, max(battery_level) AS max_battery_level
+                  FROM lap_positions GROUP BY lap_id""")
+    resultproxy = db.get_engine(bind='teslamate').execute(sql, {
+        'car_id': car_id,
+        'lap_ids': [lap_id for lap_id, _, _ in lap_boundaries],
+        'dt_starts': [dt_start for _, dt_start, _ in lap_boundaries],
+        'dt_ends': [dt_end for _, _, dt_end in lap_boundaries],
+    })
+    return {item.pop('lap_id'): item for item in _cursor_one_to_dict_list(resultproxy)}
 
 
 @function_timer()
@@ -114,4 +291,26 @@ def get_car_charging_details(charging_process_id: int) -> List[
     return  _cursor_one_to_dict_list(resultproxy)
 
 
+@function_timer()
+def get_charging_details_bulk(charging_process_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Charges of more charging processes in one query (the same fields as get_car_charging_details)
+    :param charging_process_ids: ids of the charging processes
+    :return: charging process id -> charges ordered by date (empty list if there are none)
+    """
+    from src import db
+    out = {charging_process_id: [] for charging_process_id in charging_process_ids}
+    if not charging_process_ids:
+        return out
+    sql = text("""SELECT charging_process_id, 
+    date, battery_level, charge_energy_added, charger_actual_current, charger_power, 
+    ideal_battery_range_km, outside_temp, rated_battery_range_km, usable_battery_level   
+    FROM charges 
+    WHERE charging_process_id = ANY(:chp_ids) ORDER BY charging_process_id, date""")
+    resultproxy = db.get_engine(bind='teslamate').execute(sql, {'chp_ids': list(charging_process_ids)})
+    for charge in _cursor_one_to_dict_list(resultproxy):
+        out[charge.pop('charging_process_id')].append(charge)
+    return out
+
+
     return charging_processes
@@ -139,6 +139,24 @@ class CalculatedField(db.Model):
         return self.name
 
 
+class LapSummary(db.Model):
+    """ calculated fields of finished lap (not recalculated any more, survive restarts) """
+    __tablename__ = 'lap_summaries'
+    __table_args__ = (
+        UniqueConstraint('config_hash', 'lap_id', name='uix_lap_summary_config_lap'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    config_hash = db.Column(db.String, nullable=False, index=True)  # race configuration + calculated fields
+    lap_id = db.Column(db.String, nullable=False)
+    split_signature = db.Column(db.String, nullable=False)  # lap boundaries the fields were calculated for
+    fields = db.Column(db.Text, nullable=False)  # JSON of the calculated fields (see lap_summaries)
+    created = db.Column(db.DateTime, nullable=False, default=lambda: pendulum.now(tz='utc'))
+
+    def __repr__(self):
+        return f"{self.lap_id} ({self.config_hash})"
+
+
 class CustomPage(db.Model):
     __tablename__ = 'custom_pages'
 
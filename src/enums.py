@@ -18,3 +18,8 @@ class CalculatedFieldScopeEnum(Enum):
     LAP = 'lap'
     FORECAST = 'forecast'
     CHARGING = 'charging'
+
+
+class DistanceModeEnum(Enum):
+    HAVERSINE = 'haversine'  # sphere, fast
+    ELLIPSOIDAL = 'ellipsoidal'  # WGS-84 ellipsoid, precise
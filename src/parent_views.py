@@ -8,6 +8,7 @@ from flask_jwt_extended import create_access_token
 
 from src.admin.admin_forms import TestLabelFormatForm, TestCalculatedFieldForm
 from src.data_processor.data_processor import data_processor
+from src.config_cache import config_cache, driver_change_index
 
 
 class MyRedirectView(BaseView):
@@ -54,6 +55,21 @@ class MyRoleRequiredDataView(sqla.ModelView):
         if not self.is_accessible():
             return redirect(url_for('security.login'))
 
+    def after_model_change(self, form, model, is_created):
+        self._invalidate_caches(model)
+
+    def after_model_delete(self, model):
+        self._invalidate_caches(model)
+
+    @classmethod
+    def _invalidate_caches(cls, model):
+        """ data derived from the edited record must not be used any more """
+        from src.db_models import CalculatedField, FieldScope, LabelFormat, LabelGroup, DriverChange
+        if isinstance(model, (CalculatedField, FieldScope, LabelFormat, LabelGroup)):
+            config_cache.invalidate()
+        elif isinstance(model, DriverChange):
+            driver_change_index.invalidate()
+
 
 class MyRoleRequiredCustomView(BaseView):
     """
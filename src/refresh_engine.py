@@ -0,0 +1,81 @@
+"""
+In-process refresh of the cached data. Background jobs used to call the internal API over HTTP (through
+nginx and uwsgi), now the updates run directly in worker threads with application context.
+Every task is single-flight: if it's triggered while running, the triggers are coalesced to one more run
+after the current one finishes (never stacked).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from src.utils import function_timer_block
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class _TaskState:
+    __slots__ = ('fn', 'running', 'pending')
+
+    def __init__(self, fn: Callable[[], None]):
+        self.fn = fn
+        self.running = False  # submitted to the executor and not finished yet
+        self.pending = False  # triggered while running, run once more when finished
+
+
+class RefreshEngine:
+    def __init__(self):
+        self._app = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, _TaskState] = {}
+
+    def init_app(self, app):
+        self._app = app
+
+    def register(self, name: str, fn: Callable[[], None]):
+        """
+        Register task to be triggered later
+        :param name: name of the task
+        :param fn: function to run (in application context)
+        """
+        with self._lock:
+            self._tasks[name] = _TaskState(fn)
+            # one worker per task, so the long running ones don't delay the others
+            if self._executor:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=len(self._tasks), thread_name_prefix='refresh')
+
+    def trigger(self, name: str) -> bool:
+        """
+        Run the task in background (don't wait for it)
+        :param name: name of the task
+        :return: True if started, False if it's already running (it will be run once more after)
+        """
+        with self._lock:
+            task = self._tasks[name]
+            if task.running:
+                task.pending = True
+                logger.info(f"refresh {name} still running, coalescing")
+                return False
+            task.running = True
+        self._executor.submit(self._run, name, task)
+        return True
+
+    def _run(self, name: str, task: _TaskState):
+        while True:
+            try:
+                with self._app.app_context():
+                    with function_timer_block(f"refresh {name}"):
+                        task.fn()
+            except Exception as ex:
+                logger.exception(f"refresh {name} failed: {ex}")
+            with self._lock:
+                if not task.pending:
+                    task.running = False
+                    return
+                task.pending = False  # triggered meanwhile, run again with fresh data
+
+
+# let's have just one singleton to be used
+refresh_engine = RefreshEngine()
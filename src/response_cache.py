@@ -0,0 +1,143 @@
+"""
+Pre-serialized responses of the public endpoints (/api/car/*). The refresher renders every payload to json once
+per update, together with the gzip compressed variant, the endpoints just return the bytes (no serialization per
+request).
+Every response carries a version, increased whenever the payload changes, it's used for ETag/Last-Modified so the
+polling clients get 304 if nothing has changed. Clients listening for changes (server-sent events) wait for the
+generation to change (see wait_for_change).
+"""
+import gzip
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, NamedTuple, Collection
+
+from flask import Response, request
+
+import logging
+logger = logging.getLogger(__name__)
+
+GZIP_LEVEL = 6
+ENCODINGS = ('gzip',)  # content encodings prepared, in order of preference
+
+
+class EncodedResponse(NamedTuple):
+    """ the same payload in all the encodings available """
+    body: bytes
+    encoded: Dict[str, bytes]  # content encoding -> compressed body
+    version: int  # increases with every change of the payload
+    modified: float  # timestamp of the change
+
+
+def encode_response(body: bytes, version: int, modified: float) -> EncodedResponse:
+    encoded = {'gzip': gzip.compress(body, GZIP_LEVEL)}
+    return EncodedResponse(body, encoded, version, modified)
+
+
+class ResponseCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._generation = 0  # increased by every change
+        self._responses: Dict[str, EncodedResponse] = {}
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def put(self, name: str, body: bytes):
+        """
+        Store the payload (and its compressed variants), nothing changes if it's the same as the stored one
+        :param name: name of the response
+        :param body: serialized payload
+        """
+        previous = self._responses.get(name)
+        if previous and previous.body == body:
+            return
+        # time based, so the version keeps increasing even if another process takes over the refresh
+        version = max(time.time_ns(), previous.version + 1 if previous else 0)
+        encoded = encode_response(body, version, time.time())
+        with self._lock:
+            self._responses = {**self._responses, name: encoded}  # copy on write, readers don't lock
+            self._generation += 1
+            self._changed.notify_all()
+
+    def get(self, name: str) -> Optional[EncodedResponse]:
+        return self._responses.get(name)
+
+    def get_versions(self) -> Dict[str, int]:
+        return {name: response.version for name, response in self._responses.items()}
+
+    def get_blobs(self, names: Collection[str]) -> Dict[str, bytes]:
+        """ the responses as named blobs (to be published in shared snapshot) """
+        blobs = {}
+        for name, response in self._responses.items():
+            if name not in names:
+                continue
+            blobs[f"response:{name}"] = response.body
+            blobs[f"response:{name}:meta"] = json.dumps({'version': response.version,
+                                                         'modified': response.modified}).encode()
+            for encoding, body in response.encoded.items():
+                blobs[f"response:{name}:{encoding}"] = body
+        return blobs
+
+    def set_blobs(self, blobs: Dict[str, memoryview]):
+        """ replace the responses by the ones published by the refresher (see get_blobs), keep the others """
+        responses = dict(self._responses)
+        for key, blob in blobs.items():
+            parts = key.split(':')
+            if parts[0] != 'response' or len(parts) != 2:
+                continue
+            encoded = {encoding: bytes(blobs[f"{key}:{encoding}"]) for encoding in ENCODINGS
+                       if f"{key}:{encoding}" in blobs}
+            meta = json.loads(bytes(blobs[f"{key}:meta"]))
+            responses[parts[1]] = EncodedResponse(bytes(blob), encoded, meta['version'], meta['modified'])
+        with self._lock:
+            self._responses = responses
+            self._generation += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, generation: int, timeout: float) -> int:
+        """
+        Wait until the responses change
+        :param generation: generation the caller has seen
+        :param timeout: max time to wait (seconds)
+        :return: current generation (the same as given if timed out)
+        """
+        with self._lock:
+            self._changed.wait_for(lambda: self._generation != generation, timeout)
+            return self._generation
+
+
+def make_response(response: EncodedResponse, mimetype: str = 'application/json') -> Response:
+    """
+    Create HTTP response in the best encoding the client accepts (304 if the client has the version already)
+    :param response: the cached response
+    :param mimetype: mime type of the payload
+    :return: HTTP Response
+    """
+    encoding = request.accept_encodings.best_match([e for e in ENCODINGS if e in response.encoded])
+    if encoding:
+        out = Response(response.encoded[encoding], mimetype=mimetype)
+        out.headers['Content-Encoding'] = encoding
+    else:
+        out = Response(response.body, mimetype=mimetype)
+    out.vary.add('Accept-Encoding')
+    out.set_etag(str(response.version), weak=True)  # weak, the same for all the encodings
+    out.last_modified = datetime.fromtimestamp(response.modified, timezone.utc)
+    return make_conditional(out)
+
+
+def make_conditional(response: Response) -> Response:
+    """
+    Let the client always revalidate and answer 304 if it has the current payload (If-None-Match/If-Modified-Since)
+    :param response: the response (with ETag or Last-Modified)
+    :return: the response or 304 response
+    """
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+# let's have just one singleton to be used
+response_cache = ResponseCache()
@@ -0,0 +1,163 @@
+"""
+Data shared between the processes (uwsgi workers). Just one process (the refresher, holding the lock file)
+loads the data from database and publishes immutable snapshots to a file, the other processes map the latest one.
+File layout: magic, header length, header (json: version, sections) and the sections. The objects are pickled
+with out-of-band buffers (protocol 5), the buffers (numpy columns of positions) are used directly from the mapped
+file without copying, so memory doesn't grow with the number of workers.
+Binary blobs (i.e. pre-serialized responses) may be published along the objects, they are served from the mapping.
+The data are split to parts (one file each), so a part is published again only if its data have changed
+(i.e. not all the positions with every status change).
+"""
+import fcntl
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'TRANSNP1'
+_HEADER_LEN = struct.Struct('<Q')
+_ALIGNMENT = 64  # buffers aligned for numpy
+SNAPSHOT_FILE = 'snapshot-{}.bin'  # by part
+LOCK_FILE = 'refresher.lock'
+
+
+class SnapshotView:
+    """ immutable snapshot mapped from the file """
+    def __init__(self, part: str, version: int, objects: Dict[str, Any], blobs: Dict[str, memoryview]):
+        self.part = part
+        self.version = version
+        self.objects = objects
+        self.blobs = blobs
+
+
+class SharedSnapshot:
+    def __init__(self):
+        self._dir: Optional[str] = None
+        self._lock = threading.Lock()
+        self._lock_file = None  # kept open while this process is the refresher
+        self._file_keys: Dict[str, Tuple[int, int]] = {}  # part -> (inode, mtime) of the file mapped
+        self._views: Dict[str, SnapshotView] = {}  # by part
+
+    def init_app(self, app):
+        self._dir = app.config.get("SHARED_SNAPSHOT_DIR") or None
+        if self._dir:
+            os.makedirs(self._dir, exist_ok=True)
+            logger.info(f"shared snapshot in {self._dir}")
+
+    @property
+    def enabled(self) -> bool:
+        return self._dir is not None
+
+    @property
+    def is_refresher(self) -> bool:
+        """ True if this process refreshes the data (holds the lock or sharing is disabled) """
+        return not self.enabled or self._lock_file is not None
+
+    def acquire_refresher(self) -> bool:
+        """
+        Try to become the process refreshing the data (take over if the previous one is gone)
+        :return: True if this process is the refresher
+        """
+        if self.is_refresher:
+            return True
+        with self._lock:
+            if self._lock_file:
+                return True
+            lock_file = open(os.path.join(self._dir, LOCK_FILE), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file  # the lock is released by OS when the process ends
+            logger.info(f"process {os.getpid()} is the refresher now")
+            return True
+
+    def publish(self, part: str, objects: Dict[str, Any], blobs: Optional[Dict[str, bytes]] = None) -> int:
+        """
+        Write new snapshot of the part (atomically replace the file)
+        :param part: name of the part
+        :param objects: objects to be pickled (all in one pickle, so shared references are kept)
+        :param blobs: binary data to be used as they are
+        :return: version of the snapshot
+        """
+        version = time.time_ns()
+        buffers: List[pickle.PickleBuffer] = []
+        payload = pickle.dumps(objects, protocol=5, buffer_callback=buffers.append)
+        parts: List[Tuple[str, Any]] = [('pickle', payload)]
+        parts += [(f'buffer:{i}', buffer.raw()) for i, buffer in enumerate(buffers)]
+        parts += [(f'blob:{name}', blob) for name, blob in (blobs or {}).items()]
+
+        # offsets are relative to the data start (after the header)
+        sections = {}
+        offset = 0
+        for name, data in parts:
+            offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+            sections[name] = [offset, len(data)]
+            offset += len(data)
+        header = json.dumps({'version': version, 'buffers': len(buffers), 'sections': sections}).encode()
+        data_start = -(-(len(_MAGIC) + _HEADER_LEN.size + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, prefix='.snapshot')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_MAGIC + _HEADER_LEN.pack(len(header)) + header)
+                for name, data in parts:
+                    f.seek(data_start + sections[name][0])
+                    f.write(data)
+            os.replace(tmp_path, os.path.join(self._dir, SNAPSHOT_FILE.format(part)))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return version
+
+    def load(self, part: str) -> Optional[SnapshotView]:
+        """
+        Get the latest snapshot of the part (mapped again just if the file has changed)
+        :param part: name of the part
+        :return: the snapshot or None if nothing has been published yet
+        """
+        path = os.path.join(self._dir, SNAPSHOT_FILE.format(part))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        file_key = (stat.st_ino, stat.st_mtime_ns)
+        if file_key == self._file_keys.get(part):
+            return self._views[part]
+
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # stays valid after the file is replaced
+        if mapped[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"invalid snapshot file {path}")
+        header_len, = _HEADER_LEN.unpack_from(mapped, len(_MAGIC))
+        header_start = len(_MAGIC) + _HEADER_LEN.size
+        header = json.loads(mapped[header_start:header_start + header_len])
+        data_start = -(-(header_start + header_len) // _ALIGNMENT) * _ALIGNMENT
+        memory = memoryview(mapped)
+
+        def _section(name: str) -> memoryview:
+            offset, length = header['sections'][name]
+            return memory[data_start + offset:data_start + offset + length]
+
+        buffers = [_section(f'buffer:{i}') for i in range(header['buffers'])]
+        objects = pickle.loads(_section('pickle'), buffers=buffers)
+        blobs = {name[len('blob:'):]: _section(name) for name in header['sections'] if name.startswith('blob:')}
+        view = SnapshotView(part, header['version'], objects, blobs)
+        with self._lock:
+            self._file_keys[part] = file_key
+            self._views[part] = view
+        logger.info(f"shared snapshot {part} {view.version} mapped")
+        return view
+
+
+# let's have just one singleton to be used
+shared_snapshot = SharedSnapshot()
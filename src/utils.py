@@ -1,7 +1,9 @@
+import ast
 import logging
 from functools import wraps
 from time import perf_counter
 from contextlib import contextmanager
+from typing import Set
 
 logger = logging.getLogger(__name__)
 
@@ -28,3 +30,29 @@ def function_timer_block(name):
     finally:
         elapsed_time = perf_counter() - start_time
         logger.info('{0} took {1:.5f} seconds'.format(name, elapsed_time))
+
+
+def get_string_literals(code: str) -> Set[str]:
+    """
+    Get all the string constants used in python expression, i.e. the keys in current_item['odometer']
+    :param code: expression to analyze
+    :return: set of the strings (empty if the code can't be parsed)
+    """
+    try:
+        tree = ast.parse(code, mode='eval')
+    except SyntaxError:
+        return set()
+    return {node.value for node in ast.walk(tree) if isinstance(node, ast.Constant) and isinstance(node.value, str)}
+
+
+def get_names(code: str) -> Set[str]:
+    """
+    Get all the variable names used in python expression, i.e. lap_list in lap_list[-1]['lap_id']
+    :param code: expression to analyze
+    :return: set of the names (empty if the code can't be parsed)
+    """
+    try:
+        tree = ast.parse(code, mode='eval')
+    except SyntaxError:
+        return set()
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
@@ -0,0 +1,180 @@
+"""
+Forecast models on float arrays compared with the original forecast calculated on pendulum periods (old_forecast
+below is the original mean and best lap forecast, the only models it had).
+"""
+import math
+
+import pendulum
+import pytest
+
+from src.data_models import Configuration
+from src.data_processor import calculated_fields_forecast
+from src.data_processor.forecast_engine import MODELS
+
+START_TIME = pendulum.datetime(2021, 6, 5, 12, tz='utc')
+NOW = START_TIME.add(hours=3, minutes=17, seconds=23)
+DISTANCE_SINCE_START = 253.4
+
+
+def _configuration() -> Configuration:
+    return Configuration(anonymous_index_page='', admin_index_page='', car_id=1, start_latitude=49.5,
+                         start_longitude=12.1, start_time=START_TIME, hours=24, start_radius=0.05, merge_from_lap=1,
+                         laps_merged=1, show_previous_laps=10, previous_laps_table_vertical=False,
+                         previous_laps_table_reversed=False, charging_table_vertical=False,
+                         charging_table_reversed=False, forecast_exclude_first_laps=0, forecast_use_last_laps=5,
+                         update_run_background=True, update_status_seconds=5, update_laps_seconds=10)
+
+
+def _lap(lap_id: int, lap_seconds: float, pit_seconds: float, distance: float, finished: bool = True):
+    lap_start = START_TIME.add(seconds=lap_id * 3600)
+    lap_end = lap_start.add(seconds=lap_seconds)
+    lap_duration = lap_end - lap_start
+    pit_duration = lap_end.add(seconds=pit_seconds) - lap_end
+    full_duration = lap_duration + pit_duration
+    return {
+        'lap_id': str(lap_id),
+        'finished': finished,
+        'lap_duration': lap_duration,
+        'pit_duration': pit_duration,
+        'full_duration': full_duration,
+        'distance': distance,
+        'full_avg_speed': distance / full_duration.total_seconds() * 3600,
+    }
+
+
+LAPS = [
+    _lap(1, 1502, 315, 41.2),
+    _lap(2, 1467, 0, 40.8),
+    _lap(3, 1611, 842, 41.5),
+    _lap(4, 1398, 127, 40.9),
+    _lap(5, 1530, 603, 41.1),
+    _lap(6, 1721, 0, 41.3),
+    _lap(7, 712, 0, 18.7, finished=False),
+]
+
+
+def old_forecast(lap_list, current_status, configuration: Configuration, now_dt: pendulum.DateTime):
+    """ the original forecast (calculated_fields_forecast on pendulum periods) """
+    forecast = {}
+    unfinished_lap = lap_list[-1] if not lap_list[-1]['finished'] else None
+    car_laps = lap_list[:-1]
+
+    end_time = configuration.start_time.add(hours=configuration.hours)
+    time_since_start = now_dt - configuration.start_time
+    time_to_end = end_time - now_dt
+    distance_since_start = current_status['distance']
+
+    avg_lap_time = pendulum.Period(now_dt, now_dt)
+    avg_pit_time = pendulum.Period(now_dt, now_dt)
+    avg_lap_distance = 0
+    for lap in car_laps:
+        avg_lap_time += lap['lap_duration']
+        avg_pit_time += lap['pit_duration']
+        avg_lap_distance += lap['distance']
+    avg_lap_time /= len(car_laps)
+    avg_pit_time /= len(car_laps)
+    avg_lap_distance /= len(car_laps)
+
+    unfinished_lap_remaining_time = pendulum.Period(now_dt, now_dt)
+    unfinished_lap_remaining_distance = 0
+    if unfinished_lap and unfinished_lap['lap_duration'] < avg_lap_time:
+        unfinished_lap_remaining_time = avg_lap_time - unfinished_lap['lap_duration']
+    if unfinished_lap and unfinished_lap['distance'] < avg_lap_distance:
+        unfinished_lap_remaining_distance = avg_lap_distance - unfinished_lap['distance']
+
+    time_to_forecast = time_to_end
+    if unfinished_lap_remaining_time:
+        time_to_forecast -= unfinished_lap_remaining_time
+    full_laps_remaining = int(time_to_forecast / (avg_lap_time + avg_pit_time))
+    remaining_last_lap_time = time_to_forecast - full_laps_remaining * (avg_lap_time + avg_pit_time)
+    coef = remaining_last_lap_time / (avg_lap_time + avg_pit_time)
+    last_lap_distance = avg_lap_distance * coef
+
+    forecast['avg_lap_duration'] = avg_lap_time
+    forecast['avg_pit_duration'] = avg_pit_time
+    forecast['avg_full_duration'] = avg_lap_time + avg_pit_time
+    forecast['avg_lap_distance'] = avg_lap_distance
+    forecast['unfinished_lap_remaining_time'] = unfinished_lap_remaining_time
+    forecast['unfinished_lap_remaining_distance'] = unfinished_lap_remaining_distance
+    forecast['full_laps_remaining'] = full_laps_remaining
+    forecast['last_lap_duration'] = avg_lap_time * coef
+    forecast['last_pit_duration'] = avg_pit_time * coef
+    forecast['last_full_duration'] = avg_lap_time * coef + avg_pit_time * coef
+    forecast['last_lap_distance'] = last_lap_distance
+    forecast['total_estimated_distance'] = distance_since_start + unfinished_lap_remaining_distance + \
+        full_laps_remaining * avg_lap_distance + last_lap_distance
+
+    best_lap_id = None
+    best_avg_speed = 0
+    best_full_duration = time_since_start
+    best_lap_distance = 0
+    for lap in car_laps:
+        if lap['full_avg_speed'] > best_avg_speed:
+            best_avg_speed = lap['full_avg_speed']
+            best_lap_id = lap['lap_id']
+            best_full_duration = lap['full_duration']
+            best_lap_distance = lap['distance']
+    forecast['best_lap'] = best_lap_id
+
+    best_full_laps_remaining = int(time_to_forecast / best_full_duration)
+    best_remaining_last_lap_time = time_to_forecast - best_full_laps_remaining * best_full_duration
+    best_coef = best_remaining_last_lap_time / best_full_duration
+    forecast['best_estimated_distance'] = distance_since_start + unfinished_lap_remaining_distance + \
+        best_full_laps_remaining * best_lap_distance + best_lap_distance * best_coef
+    return forecast
+
+
+def _forecast(lap_list):
+    forecast = {}
+    calculated_fields_forecast.add_calculated_fields(current_item=forecast,
+                                                     initial_status=None,
+                                                     current_status={'distance': DISTANCE_SINCE_START},
+                                                     position_list=None,
+                                                     lap_list=lap_list,
+                                                     total=None,
+                                                     charging_process_list=None,
+                                                     forecast=None,
+                                                     configuration=_configuration(),
+                                                     current_item_index=None,
+                                                     now_dt=NOW)
+    return forecast
+
+
+def _value(value):
+    return value.total_seconds() if hasattr(value, 'total_seconds') else value
+
+
+@pytest.mark.parametrize('lap_list', [LAPS, LAPS[:-1], LAPS[3:]], ids=['unfinished', 'finished', 'few'])
+def test_parity_with_periods(lap_list):
+    expected = old_forecast(lap_list, {'distance': DISTANCE_SINCE_START}, _configuration(), NOW)
+    forecast = _forecast(lap_list)
+    for field, value in expected.items():
+        # periods are rounded to microseconds by every operation
+        assert _value(forecast[field]) == pytest.approx(_value(value), rel=1e-6, abs=1e-3), field
+
+
+def test_models():
+    forecast = _forecast(LAPS)
+    assert forecast['mean_estimated_distance'] == pytest.approx(forecast['total_estimated_distance'])
+    for model in MODELS:
+        assert math.isfinite(forecast[f'{model}_estimated_distance'])
+        assert forecast[f'{model}_estimated_distance'] > DISTANCE_SINCE_START
+        assert forecast[f'{model}_full_duration'].total_seconds() > 0
+
+
+def test_same_laps_same_models():
+    # no spread nor trend, all the models give the same forecast
+    forecast = _forecast([_lap(i, 1500, 300, 41.0) for i in range(1, 8)] + [_lap(8, 600, 0, 16.0, finished=False)])
+    for model in MODELS:
+        assert forecast[f'{model}_estimated_distance'] == pytest.approx(forecast['total_estimated_distance'])
+
+
+def test_missing_values_left_out():
+    lap_list = list(LAPS)
+    lap_list.insert(3, {**_lap(10, 1500, 100, 0), 'distance': None, 'full_avg_speed': None})
+    forecast = _forecast(lap_list)
+    expected = _forecast(LAPS)
+    assert forecast['avg_lap_distance'] == pytest.approx(expected['avg_lap_distance'])
+    assert forecast['best_lap'] == expected['best_lap']
+    for model in MODELS:
+        assert math.isfinite(forecast[f'{model}_estimated_distance'])
@@ -0,0 +1,168 @@
+"""
+LapDetector compared with the original one-shot lap finding (old_find_splits below is the state machine of find_laps
+before it was made resumable, it worked on list of positions with geopy distances).
+"""
+import math
+from typing import List, Dict, Any, Tuple
+
+import pendulum
+import pytest
+from geopy.distance import distance as geopy_distance
+
+from src.data_models import Configuration
+from src.data_processor import lap_analyzer
+from src.data_processor.lap_analyzer import LapDetector, LapSplit
+from src.data_source.position_store import PositionStore
+
+START = (49.532277, 12.135311)
+COLUMNS = ['id', 'date', 'latitude', 'longitude', 'odometer']
+POSITION_PERIOD_SECONDS = 10
+LAP_POSITIONS = 60  # positions of the track (without the pit stop)
+REGION = 0.05  # km
+MIN_TIME = 15  # seconds
+
+
+def _configuration(**kwargs) -> Configuration:
+    values = dict(anonymous_index_page='', admin_index_page='', car_id=1, start_latitude=START[0],
+                  start_longitude=START[1], start_time=pendulum.datetime(2021, 6, 5, 12, tz='utc'), hours=24,
+                  start_radius=REGION, merge_from_lap=1, laps_merged=1, show_previous_laps=10,
+                  previous_laps_table_vertical=False, previous_laps_table_reversed=False,
+                  charging_table_vertical=False, charging_table_reversed=False, forecast_exclude_first_laps=0,
+                  forecast_use_last_laps=5, update_run_background=True, update_status_seconds=5,
+                  update_laps_seconds=10, distance_mode='ellipsoidal')
+    values.update(kwargs)
+    return Configuration(**values)
+
+
+def _generate_rows(pit_stops: List[int], tail: int) -> List[Tuple]:
+    """
+    Laps on ~4 km ellipse starting at START. After every lap the car passes the start (one position in the region,
+    not long enough to be a pit stop) or stays in the pit for the number of positions given
+    :param pit_stops: positions in the pit after every lap (0 to just pass the start)
+    :param tail: positions of the lap driven at the end
+    """
+    rows = []
+    date = pendulum.datetime(2021, 6, 5, 12, tz='utc')
+    odometer = 1000.0
+
+    def add(latitude, longitude):
+        nonlocal date, odometer
+        rows.append((len(rows) + 1, date, latitude, longitude, odometer))
+        date = date.add(seconds=POSITION_PERIOD_SECONDS)
+        odometer += 0.07
+
+    for pit_positions in pit_stops + [None]:
+        for i in range(LAP_POSITIONS if pit_positions is not None else tail):
+            angle = 2 * math.pi * i / LAP_POSITIONS
+            add(START[0] + 0.006 * math.sin(angle), START[1] + 0.012 * (1 - math.cos(angle)))
+        for _ in range(pit_positions or 0):
+            add(START[0] + 0.00001, START[1] - 0.00001)
+    return rows
+
+
+def _store(rows: List[Tuple]) -> PositionStore:
+    store = PositionStore()
+    store.extend_rows(COLUMNS, rows)
+    return store
+
+
+def old_find_splits(configuration: Configuration, segment: List[Dict[str, Any]], region: float, min_time: float,
+                    start_idx: int = 0) -> Tuple[List[LapSplit], bool]:
+    """
+    The original find_laps (up to the extraction of the laps)
+    :return: aggregated splits and whether the last lap is finished
+    """
+    points = [(pt['latitude'], pt['longitude']) for pt in segment]
+    start = (configuration.start_latitude, configuration.start_longitude)
+    time = [pt['date'] for pt in segment]
+    distance = [geopy_distance(point, start).km for point in points]
+
+    lap_id = 1
+    splits = []
+    pit_entry_idx = None
+    lap_entry_idx = None
+    current_split = None
+
+    for i, dist in enumerate(distance):
+        if i == start_idx:
+            if distance[0] > region:
+                current_split = LapSplit(lapId=lap_id, pitEntryIdx=start_idx, pitLeaveIdx=start_idx,
+                                         lapEntryIdx=start_idx)
+            else:
+                current_split = LapSplit(lapId=lap_id, pitEntryIdx=start_idx)
+            splits.append(current_split)
+            lap_id += 1
+            continue
+        if dist <= region:
+            if distance[i - 1] <= region:
+                if pit_entry_idx:
+                    delta_t = time[i] - time[pit_entry_idx]
+                    if min_time < delta_t.total_seconds() or (i == (len(distance) - 1)):
+                        if current_split:
+                            current_split.lapLeaveIdx = pit_entry_idx
+                        current_split = LapSplit(lapId=str(lap_id), pitEntryIdx=pit_entry_idx)
+                        splits.append(current_split)
+                        lap_id += 1
+                        pit_entry_idx = None
+            else:
+                pit_entry_idx = i
+        else:
+            if distance[i - 1] > region:
+                if lap_entry_idx:
+                    delta_t = time[i] - time[lap_entry_idx]
+                    if min_time < delta_t.total_seconds():
+                        if current_split:
+                            current_split.pitLeaveIdx = lap_entry_idx
+                            current_split.lapEntryIdx = lap_entry_idx
+                        pit_entry_idx = None
+            else:
+                lap_entry_idx = i
+
+    agg_splits = lap_analyzer.aggregate_splits(configuration, splits)
+    finished = not (not agg_splits[-1].lapLeaveIdx or distance[agg_splits[-1].lapLeaveIdx] > region)
+    return agg_splits, finished
+
+
+def _summarize(laps: List[Dict[str, Any]]) -> List[Tuple[str, str, bool]]:
+    return [(lap['lap_id'], lap['split_signature'], lap['finished']) for lap in laps]
+
+
+@pytest.mark.parametrize('pit_stops, tail', [
+    ([5, 0, 3, 4, 0, 0, 6], 20),  # pit stops and passes of the start
+    ([5, 4, 6], 0),  # ends just after the pit stop
+    ([5, 4, 2], 0),  # ends in the pit (not long enough yet)
+    ([0, 0], 30),  # no pit stop at all
+])
+def test_batch_parity(pit_stops, tail):
+    configuration = _configuration()
+    rows = _generate_rows(pit_stops, tail)
+    store = _store(rows)
+
+    laps = LapDetector(region=REGION, min_time=MIN_TIME, distance_mode=configuration.distance_mode) \
+        .update(configuration, store)
+
+    splits, finished = old_find_splits(configuration, [dict(zip(COLUMNS, row)) for row in rows], REGION, MIN_TIME)
+    expected = [(split.lapId, LapDetector.get_split_signature(split), True) for split in splits]
+    expected[-1] = expected[-1][:2] + (finished,)
+    assert _summarize(laps) == expected
+    assert _summarize(lap_analyzer.find_laps(configuration, store, region=REGION, min_time=MIN_TIME)) == expected
+
+
+@pytest.mark.parametrize('batch', [1, 7, 60])
+def test_incremental_parity(batch):
+    configuration = _configuration()
+    rows = _generate_rows([5, 0, 3, 4, 0, 6], 20)
+    expected = LapDetector(region=REGION, min_time=MIN_TIME).update(configuration, _store(rows))
+
+    detector = LapDetector(region=REGION, min_time=MIN_TIME)
+    store = PositionStore()
+    frozen = {}
+    for i in range(0, len(rows), batch):
+        store.extend_rows(COLUMNS, rows[i:i + batch])
+        laps = detector.update(configuration, store)
+        for lap in laps:
+            if lap['frozen']:
+                # frozen laps are extracted just once
+                assert frozen.setdefault(lap['split_signature'], lap) is lap
+    assert _summarize(laps) == _summarize(expected)
+    assert set(detector.frozen_laps) == {lap['split_signature'] for lap in laps if lap['frozen']}
@@ -0,0 +1,72 @@
+"""
+RecordDelta round trip: the deltas are applied the same way the client does (macro_delta_merge in macro_ajax.jinja2),
+the client has to end up with the current tables whatever version it has seen.
+"""
+import json
+from typing import Dict, List, Any
+
+from src.data_models import JsonLabelGroup, JsonLabelItem
+from src.data_processor.record_delta import RecordDelta
+
+
+def _record(record_id: str, value: str) -> JsonLabelGroup:
+    return JsonLabelGroup(title=f"Lap {record_id}", record_id=record_id,
+                          items=[JsonLabelItem(label='Distance', value=value)])
+
+
+def _tables(values: Dict[str, str], recent: str = None) -> Dict[str, List[JsonLabelGroup]]:
+    return {
+        'previous': [_record(record_id, value) for record_id, value in values.items()],
+        'recent': [_record('recent', recent)] if recent else [],
+    }
+
+
+class Client:
+    """ the client side of the delta responses """
+    def __init__(self):
+        self.version = 0
+        self.records: Dict[str, Dict[str, Any]] = {}
+
+    def apply(self, response: bytes) -> Dict[str, List[Dict[str, Any]]]:
+        delta = json.loads(response)
+        tables = {}
+        for table, ids in delta['ids'].items():
+            records = self.records.get(table, {})
+            for record in delta['changed'][table]:
+                records[record['record_id']] = record
+            tables[table] = [records[record_id] for record_id in ids]
+            self.records[table] = {record_id: records[record_id] for record_id in ids}
+        self.version = delta['version']
+        return tables
+
+
+def _expected(tables: Dict[str, List[JsonLabelGroup]]) -> Dict[str, List[Dict[str, Any]]]:
+    return {table: [json.loads(record.json()) for record in records] for table, records in tables.items()}
+
+
+def test_round_trip():
+    updates = [
+        _tables({'1': '10'}, recent='2'),
+        _tables({'1': '10'}, recent='5'),  # just the recent one changes
+        _tables({'1': '10', '2': '12'}, recent='1'),  # new lap
+        _tables({'1': '10', '2': '12'}, recent='1'),  # nothing changes
+        _tables({'2': '12.5', '3': '11'}),  # lap dropped, changed and added, no recent
+    ]
+    client = Client()  # follows every update
+    delta = None
+    for tables in updates:
+        delta = RecordDelta.create(delta, tables)
+        assert client.apply(delta.get_changed(client.version)) == _expected(tables)
+    # late client gets everything
+    assert Client().apply(delta.get_changed(0)) == _expected(updates[-1])
+
+
+def test_unchanged_records_keep_version():
+    first = RecordDelta.create(None, _tables({'1': '10', '2': '12'}, recent='1'))
+    second = RecordDelta.create(first, _tables({'1': '10', '2': '12'}, recent='3'))
+    assert second.version > first.version
+    assert second.records['previous'] == first.records['previous']
+
+    changed = json.loads(second.get_changed(first.version))['changed']
+    assert changed['previous'] == []
+    assert [record['items'][0]['value'] for record in changed['recent']] == ['3']